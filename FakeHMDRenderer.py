@@ -0,0 +1,94 @@
+import numpy as np
+
+import OpenGL.GL as gl
+
+from pyrr import matrix44
+
+
+import gltfutils as gltfu
+from glstate import state as glstate
+
+
+class FakeHMDRenderer(object):
+    """Stand-in for `OpenVRRenderer` which renders both eyes of a stereo view without VR hardware or openvr,
+    e.g. for benchmarking the stereo rendering path.
+
+    The head pose (a world matrix in the row-vector convention) is fixed, or cycles through the given sequence
+    of `poses` (one per rendered frame).  The eye projections are the asymmetric frusta given by the tangents
+    of the half-angles of their fields of view (left, right, bottom, top)."""
+    def __init__(self, znear=0.1, zfar=1000, render_target_size=(1080, 1200), ipd=0.064,
+                 poses=None, eye_tangents=((-1.39, 1.24, -1.47, 1.46), (-1.24, 1.39, -1.47, 1.46)),
+                 mirror=True):
+        self.width, self.height = render_target_size
+        self.framebuffers = []
+        self.textures = []
+        self.depth_buffers = []
+        for eye in (0, 1):
+            texture = gl.glGenTextures(1)
+            glstate.bind_texture(0, gl.GL_TEXTURE_2D, texture)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA8, self.width, self.height, 0,
+                            gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+            depth_buffer = gl.glGenRenderbuffers(1)
+            gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, depth_buffer)
+            gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH_COMPONENT24, self.width, self.height)
+            framebuffer = gl.glGenFramebuffers(1)
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer)
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, texture, 0)
+            gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_DEPTH_ATTACHMENT, gl.GL_RENDERBUFFER, depth_buffer)
+            if gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER) != gl.GL_FRAMEBUFFER_COMPLETE:
+                raise Exception('failed to create framebuffer for eye %d' % eye)
+            self.framebuffers.append(framebuffer)
+            self.textures.append(texture)
+            self.depth_buffers.append(depth_buffer)
+        glstate.bind_texture(0, gl.GL_TEXTURE_2D, 0)
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, 0)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        self.projection_matrices = np.array([matrix44.create_perspective_projection_matrix_from_bounds(left * znear, right * znear,
+                                                                                                    bottom * znear, top * znear,
+                                                                                                    znear, zfar)
+                                             for left, right, bottom, top in eye_tangents], dtype=np.float32)
+        # inverses of the eye-to-head transforms:
+        self.eye_transforms = np.array([np.eye(4), np.eye(4)], dtype=np.float32)
+        self.eye_transforms[0,3,0] = 0.5 * ipd
+        self.eye_transforms[1,3,0] = -0.5 * ipd
+        if poses is None:
+            poses = [np.eye(4, dtype=np.float32)]
+        self.poses = poses
+        self.frame = 0
+        self.view_matrices = np.empty((2,4,4), dtype=np.float32)
+        self.mirror = mirror
+
+    def render(self, gltf, draw_list, window_size=(800, 600)):
+        pose = self.poses[self.frame % len(self.poses)]
+        self.frame += 1
+        view = np.linalg.inv(pose)
+        np.matmul(view, self.eye_transforms, out=self.view_matrices)
+        # culling, sorting and instance grouping are done once for both eyes:
+        rows = gltfu.prepare_draw_list(draw_list, self.projection_matrices, self.view_matrices)
+        modelview_matrices, normal_matrices = gltfu.calc_view_matrices(draw_list.hierarchy.world_matrices,
+                                                                       self.view_matrices)
+        glstate.viewport(0, 0, self.width, self.height)
+        for eye in (0, 1):
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.framebuffers[eye])
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+            gltfu.replay_draw_list(draw_list, rows, gltf,
+                                   self.projection_matrices[eye], self.view_matrices[eye],
+                                   modelview_matrices[eye], normal_matrices[eye])
+        if self.mirror:
+            # mirror left eye framebuffer to screen:
+            gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.framebuffers[0])
+            gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, 0)
+            gl.glBlitFramebuffer(0, 0, self.width, self.height,
+                                 0, 0, window_size[0], window_size[1],
+                                 gl.GL_COLOR_BUFFER_BIT, gl.GL_NEAREST)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    def process_input(self):
+        pass
+
+    def shutdown(self):
+        gl.glDeleteFramebuffers(2, self.framebuffers)
+        gl.glDeleteRenderbuffers(2, self.depth_buffers)
+        gl.glDeleteTextures(self.textures)
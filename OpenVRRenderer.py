@@ -11,6 +11,7 @@ from openvr.tracked_devices_actor import TrackedDevicesActor
 
 
 import gltfutils as gltfu
+from glstate import state as glstate
 
 
 c_float_p = POINTER(c_float)
@@ -29,21 +30,23 @@ class OpenVRRenderer(object):
         self.vr_framebuffers[1].init_gl()
         poses_t = openvr.TrackedDevicePose_t * openvr.k_unMaxTrackedDeviceCount
         self.poses = poses_t()
-        self.projection_matrices = (np.asarray(matrixForOpenVRMatrix(self.vr_system.getProjectionMatrix(openvr.Eye_Left,
-                                                                                                        znear, zfar))),
-                                    np.asarray(matrixForOpenVRMatrix(self.vr_system.getProjectionMatrix(openvr.Eye_Right,
-                                                                                                        znear, zfar))))
+        self.projection_matrices = np.array([matrixForOpenVRMatrix(self.vr_system.getProjectionMatrix(openvr.Eye_Left,
+                                                                                                      znear, zfar)),
+                                             matrixForOpenVRMatrix(self.vr_system.getProjectionMatrix(openvr.Eye_Right,
+                                                                                                      znear, zfar))],
+                                            dtype=np.float32)
         self.eye_transforms = (np.asarray(matrixForOpenVRMatrix(self.vr_system.getEyeToHeadTransform(openvr.Eye_Left)).I),
                                np.asarray(matrixForOpenVRMatrix(self.vr_system.getEyeToHeadTransform(openvr.Eye_Right)).I))
         self.view = np.eye(4, dtype=np.float32)
-        self.view_matrices  = (np.empty((4,4), dtype=np.float32),
-                               np.empty((4,4), dtype=np.float32))
+        self.view_matrices = np.empty((2,4,4), dtype=np.float32)
         self.controllers = TrackedDevicesActor(self.poses)
         self.controllers.show_controllers_only = False
         self.controllers.init_gl()
+        # openvr's GL helpers do not go through glstate:
+        glstate.reset()
         self.vr_event = openvr.VREvent_t()
 
-    def render(self, gltf, nodes, window_size=(800, 600)):
+    def render(self, gltf, draw_list, window_size=(800, 600)):
         self.vr_compositor.waitGetPoses(self.poses, openvr.k_unMaxTrackedDeviceCount, None, 0)
         hmd_pose = self.poses[openvr.k_unTrackedDeviceIndex_Hmd]
         if not hmd_pose.bPoseIsValid:
@@ -54,17 +57,19 @@ class OpenVRRenderer(object):
         view = np.linalg.inv(self.view.T)
         view.dot(self.eye_transforms[0], out=self.view_matrices[0])
         view.dot(self.eye_transforms[1], out=self.view_matrices[1])
-        gl.glViewport(0, 0, self.vr_framebuffers[0].width, self.vr_framebuffers[0].height)
+        # culling, sorting and instance grouping are done once for both eyes:
+        rows = gltfu.prepare_draw_list(draw_list, self.projection_matrices, self.view_matrices)
+        modelview_matrices, normal_matrices = gltfu.calc_view_matrices(draw_list.hierarchy.world_matrices,
+                                                                       self.view_matrices)
+        glstate.viewport(0, 0, self.vr_framebuffers[0].width, self.vr_framebuffers[0].height)
         for eye in (0, 1):
             gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.vr_framebuffers[eye].fb)
             gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-            gltfu.set_material_state.current_material = None
-            gltfu.set_technique_state.current_technique = None
-            for node in nodes:
-                gltfu.draw_node(node, gltf,
-                                projection_matrix=self.projection_matrices[eye],
-                                view_matrix=self.view_matrices[eye])
+            gltfu.replay_draw_list(draw_list, rows, gltf,
+                                   self.projection_matrices[eye], self.view_matrices[eye],
+                                   modelview_matrices[eye], normal_matrices[eye])
             self.controllers.display_gl(self.view_matrices[eye], self.projection_matrices[eye])
+            glstate.reset()
         self.vr_compositor.submit(openvr.Eye_Left, self.vr_framebuffers[0].texture)
         self.vr_compositor.submit(openvr.Eye_Right, self.vr_framebuffers[1].texture)
         # mirror left eye framebuffer to screen:
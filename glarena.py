@@ -0,0 +1,161 @@
+"""Suballocation of vertex and index data from a few large GL buffer objects ("arenas").
+
+Arenas are grouped by target and alignment group (e.g. vertex data of one stride), so that all vertex data
+of a given stride lies at stride-aligned offsets of the same few buffers, and all index data in one buffer.
+
+Data can also be uploaded through a `StagingBuffer`, from which the GL copies it asynchronously."""
+import bisect
+import ctypes
+import logging
+from collections import defaultdict
+
+import OpenGL.GL as gl
+
+from glstate import state as glstate
+
+
+_logger = logging.getLogger(__name__)
+
+# capacity (in bytes) of the arenas which are created when the reserved arenas are full:
+ARENA_SIZE = 32 * 2**20
+# initial capacity (in bytes) of staging buffers:
+STAGING_BUFFER_SIZE = 16 * 2**20
+# alignment of the data staged in staging buffers (a multiple of the size of any texel component):
+STAGING_ALIGNMENT = 16
+
+
+class BufferArena(object):
+    """A GL buffer object of fixed capacity from which aligned ranges are allocated (first fit).
+
+    The bytes skipped to align an allocation belong to it (and are counted as `padding`) until it is freed."""
+    def __init__(self, target, capacity, usage=gl.GL_STATIC_DRAW):
+        self.target = target
+        self.capacity = capacity
+        self.id = gl.glGenBuffers(1)
+        # uploads go through the copy-write binding point, which (unlike the element array binding) is not VAO state:
+        glstate.bind_buffer(gl.GL_COPY_WRITE_BUFFER, self.id)
+        gl.glBufferData(gl.GL_COPY_WRITE_BUFFER, capacity, None, usage)
+        if gl.glGetError() != gl.GL_NO_ERROR:
+            raise Exception('failed to create buffer arena (%d bytes)' % capacity)
+        # sorted (offset, length) pairs:
+        self.free_ranges = [(0, capacity)]
+        # offset -> (start, end) of the range allocated for it:
+        self.allocations = {}
+        self.used = 0
+        self.padding = 0
+    def allocate(self, size, alignment=4):
+        """Returns the (aligned) offset of a newly allocated range of `size` bytes, or None if there is no room."""
+        for i, (start, length) in enumerate(self.free_ranges):
+            offset = -(-start // alignment) * alignment
+            end = offset + size
+            if end <= start + length:
+                if end < start + length:
+                    self.free_ranges[i] = (end, start + length - end)
+                else:
+                    del self.free_ranges[i]
+                self.allocations[offset] = (start, end)
+                self.used += size
+                self.padding += offset - start
+                return offset
+        return None
+    def free(self, offset):
+        start, end = self.allocations.pop(offset)
+        self.used -= end - offset
+        self.padding -= offset - start
+        i = bisect.bisect(self.free_ranges, (start,))
+        if i < len(self.free_ranges) and self.free_ranges[i][0] == end:
+            end += self.free_ranges.pop(i)[1]
+        if i > 0 and sum(self.free_ranges[i-1]) == start:
+            i -= 1
+            start = self.free_ranges.pop(i)[0]
+        self.free_ranges.insert(i, (start, end - start))
+    def upload(self, offset, data, size=None):
+        glstate.bind_buffer(gl.GL_COPY_WRITE_BUFFER, self.id)
+        gl.glBufferSubData(gl.GL_COPY_WRITE_BUFFER, offset, len(data) if size is None else size, data)
+    def get_stats(self):
+        """Returns the capacity, used, padding and free bytes, the largest free range,
+        the utilization (used / capacity) and the fragmentation (1 - largest free range / free bytes) of the arena."""
+        free = self.capacity - self.used - self.padding
+        largest_free = max([length for _, length in self.free_ranges] or [0])
+        return {'capacity': self.capacity, 'used': self.used, 'padding': self.padding, 'free': free,
+                'largest_free': largest_free,
+                'utilization': self.used / self.capacity if self.capacity else 0.0,
+                'fragmentation': 1 - largest_free / free if free else 0.0}
+
+
+class ArenaPool(object):
+    """Arenas grouped by (target, group).  Space for known data can be reserved in arenas of exactly the needed size;
+    allocations which do not fit into the existing arenas of their group create new arenas of (at least) `arena_size` bytes."""
+    def __init__(self, arena_size=ARENA_SIZE):
+        self.arena_size = arena_size
+        self.arenas = defaultdict(list)
+    def reserve(self, target, size, group=None):
+        self.arenas[target, group].append(BufferArena(target, size))
+    def allocate(self, target, size, alignment=4, group=None):
+        """Returns the arena and offset of a newly allocated range."""
+        arenas = self.arenas[target, group]
+        for arena in arenas:
+            offset = arena.allocate(size, alignment)
+            if offset is not None:
+                return arena, offset
+        arenas.append(BufferArena(target, max(self.arena_size, size + alignment - 1)))
+        return arenas[-1], arenas[-1].allocate(size, alignment)
+    def get_stats(self):
+        """Returns a list of (target, group, stats) tuples (see `BufferArena.get_stats`), one per arena."""
+        return [(target, group, arena.get_stats())
+                for (target, group), arenas in sorted(self.arenas.items(), key=lambda item: (item[0][0], item[0][1] or 0))
+                for arena in arenas]
+    def log_stats(self):
+        stats = self.get_stats()
+        for target, group, arena_stats in stats:
+            _logger.info('* %s arena%s: %d / %d bytes used (%.1f%%), %d bytes padding, %d bytes free (%.1f%% fragmented)',
+                         'index' if target == gl.GL_ELEMENT_ARRAY_BUFFER else 'vertex',
+                         '' if group is None else ' (alignment %d)' % group,
+                         arena_stats['used'], arena_stats['capacity'], 100 * arena_stats['utilization'],
+                         arena_stats['padding'], arena_stats['free'], 100 * arena_stats['fragmentation'])
+
+
+class StagingBuffer(object):
+    """A stream buffer to which data is written (through unsynchronized mappings of the range it is written to),
+    to be copied by the GL to a buffer object (`copy_to`) or a texture (e.g. bound as GL_PIXEL_UNPACK_BUFFER),
+    so that neither the write nor the copy waits for the GPU.
+
+    Data is appended; when the buffer is full it is orphaned (and grown if needed), so that ranges which may still be
+    read by pending copies are never overwritten."""
+    def __init__(self, capacity=STAGING_BUFFER_SIZE):
+        self.id = gl.glGenBuffers(1)
+        self.capacity = 0
+        self.offset = 0
+        self._allocate(capacity)
+    def _allocate(self, capacity):
+        glstate.bind_buffer(gl.GL_COPY_READ_BUFFER, self.id)
+        gl.glBufferData(gl.GL_COPY_READ_BUFFER, capacity, None, gl.GL_STREAM_DRAW)
+        if gl.glGetError() != gl.GL_NO_ERROR:
+            raise Exception('failed to create staging buffer (%d bytes)' % capacity)
+        self.capacity = capacity
+        self.offset = 0
+    def stage(self, data):
+        """Writes the data (a contiguous NumPy array) to the buffer and returns its offset."""
+        size = data.nbytes
+        offset = -(-self.offset // STAGING_ALIGNMENT) * STAGING_ALIGNMENT
+        if offset + size > self.capacity:
+            self._allocate(max(self.capacity, size))
+            offset = 0
+        glstate.bind_buffer(gl.GL_COPY_READ_BUFFER, self.id)
+        if size:
+            address = gl.glMapBufferRange(gl.GL_COPY_READ_BUFFER, offset, size,
+                                          gl.GL_MAP_WRITE_BIT | gl.GL_MAP_INVALIDATE_RANGE_BIT | gl.GL_MAP_UNSYNCHRONIZED_BIT)
+            if not address:
+                raise Exception('failed to map staging buffer')
+            ctypes.memmove(address, data.ctypes.data, size)
+            gl.glUnmapBuffer(gl.GL_COPY_READ_BUFFER)
+        self.offset = offset + size
+        return offset
+    def copy_to(self, buffer_id, offset, data):
+        """Uploads the data to the given offset of a buffer object."""
+        source_offset = self.stage(data)
+        glstate.bind_buffer(gl.GL_COPY_WRITE_BUFFER, buffer_id)
+        gl.glCopyBufferSubData(gl.GL_COPY_READ_BUFFER, gl.GL_COPY_WRITE_BUFFER, source_offset, offset, data.nbytes)
+
+
+pool = ArenaPool()
@@ -0,0 +1,130 @@
+"""Shadowed OpenGL state which skips calls that would not change the current state.
+
+All GL state changes of the modules of this repo go through `state` (the shadow of the current context's state),
+so that the shadow stays in sync with the context.  After the state has been changed by other means, call `state.reset()`."""
+from collections import Counter
+
+import OpenGL.GL as gl
+
+
+class GLState(object):
+    """Shadow copy of the bound program, vertex array object, buffers, per-unit textures and samplers,
+    enabled capabilities, blend function and viewport of a GL context, and of the uniform values
+    set on each program (identified by an arbitrary key, e.g. a material's binding plan).
+
+    Unknown state (e.g. after `reset`) is never assumed to match, so the first call after a reset is always issued.
+    `issued` and `skipped` count the calls which were issued and skipped, by function name."""
+    def __init__(self):
+        self.issued = Counter()
+        self.skipped = Counter()
+        self.reset()
+    def reset(self):
+        """Forgets all shadowed state."""
+        self.program = None
+        self.vertex_array = None
+        self.buffers = {}
+        # element array buffer bindings are part of the vertex array object state:
+        self.element_array_buffers = {}
+        self.active_texture = None
+        self.textures = {}
+        self.samplers = {}
+        self.capabilities = {}
+        self.blend_function = None
+        self.viewport_rect = None
+        self.program_uniforms = {}
+    def reset_counts(self):
+        self.issued.clear()
+        self.skipped.clear()
+    @property
+    def num_issued(self):
+        return sum(self.issued.values())
+    @property
+    def num_skipped(self):
+        return sum(self.skipped.values())
+    def _count(self, name, issue):
+        if issue:
+            self.issued[name] += 1
+        else:
+            self.skipped[name] += 1
+        return issue
+    def use_program(self, program_id):
+        """Returns True if the program was changed."""
+        if self._count('glUseProgram', program_id != self.program):
+            gl.glUseProgram(program_id)
+            self.program = program_id
+            return True
+        return False
+    def bind_vertex_array(self, vertex_array):
+        if self._count('glBindVertexArray', vertex_array != self.vertex_array):
+            gl.glBindVertexArray(vertex_array)
+            self.vertex_array = vertex_array
+            self.buffers[gl.GL_ELEMENT_ARRAY_BUFFER] = self.element_array_buffers.get(vertex_array)
+    def bind_buffer(self, target, buffer_id):
+        if self._count('glBindBuffer', buffer_id != self.buffers.get(target)):
+            gl.glBindBuffer(target, buffer_id)
+            self.buffers[target] = buffer_id
+            if target == gl.GL_ELEMENT_ARRAY_BUFFER and self.vertex_array is not None:
+                self.element_array_buffers[self.vertex_array] = buffer_id
+    def bind_buffer_base(self, target, index, buffer_id):
+        """Binds a buffer to an indexed binding point (which also binds it to the generic binding point of `target`).
+        Indexed bindings are not shadowed."""
+        self._count('glBindBufferBase', True)
+        gl.glBindBufferBase(target, index, buffer_id)
+        self.buffers[target] = buffer_id
+    def set_active_texture(self, unit):
+        if self._count('glActiveTexture', unit != self.active_texture):
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            self.active_texture = unit
+    def bind_texture(self, unit, target, texture_id):
+        """Binds a texture to the given texture unit (making it the active unit if the texture is not already bound).
+        Returns True if the binding was changed."""
+        if self._count('glBindTexture', texture_id != self.textures.get((unit, target))):
+            self.set_active_texture(unit)
+            gl.glBindTexture(target, texture_id)
+            self.textures[unit, target] = texture_id
+            return True
+        return False
+    def delete_texture(self, texture_id):
+        """Deletes a texture object (which reverts the units it is bound to to texture 0)."""
+        self._count('glDeleteTextures', True)
+        gl.glDeleteTextures([texture_id])
+        for unit_target, bound_id in self.textures.items():
+            if bound_id == texture_id:
+                self.textures[unit_target] = 0
+    def bind_sampler(self, unit, sampler_id):
+        if self._count('glBindSampler', sampler_id != self.samplers.get(unit)):
+            gl.glBindSampler(unit, sampler_id)
+            self.samplers[unit] = sampler_id
+    def set_enabled(self, capability, enabled):
+        enabled = bool(enabled)
+        if self._count('glEnable' if enabled else 'glDisable', enabled != self.capabilities.get(capability)):
+            if enabled:
+                gl.glEnable(capability)
+            else:
+                gl.glDisable(capability)
+            self.capabilities[capability] = enabled
+    def enable(self, capability):
+        self.set_enabled(capability, True)
+    def disable(self, capability):
+        self.set_enabled(capability, False)
+    def blend_func(self, sfactor, dfactor):
+        if self._count('glBlendFunc', (sfactor, dfactor) != self.blend_function):
+            gl.glBlendFunc(sfactor, dfactor)
+            self.blend_function = (sfactor, dfactor)
+    def viewport(self, x, y, width, height):
+        if self._count('glViewport', (x, y, width, height) != self.viewport_rect):
+            gl.glViewport(x, y, width, height)
+            self.viewport_rect = (x, y, width, height)
+    def set_uniforms(self, program_id, key, uniform_calls):
+        """Makes the (setter, args) `uniform_calls` on the given (current) program, unless the uniform calls with the same key
+        were the last ones made on it by this method (uniform values persist in program objects).
+        Returns True if the calls were made."""
+        if self._count('uniforms', self.program_uniforms.get(program_id) is not key):
+            for setter, args in uniform_calls:
+                setter(*args)
+            self.program_uniforms[program_id] = key
+            return True
+        return False
+
+
+state = GLState()
@@ -1,27 +1,27 @@
 import os.path
 from ctypes import c_void_p
+from collections import OrderedDict
 
 import numpy as np
 import OpenGL.GL as gl
 import PIL.Image as Image
 
+from glstate import state as glstate
 
-_vertex_shader = """precision highp float;
-uniform mat4 u_modelviewMatrix;
+
+_vertex_shader = """uniform mat4 u_modelviewMatrix;
 uniform mat4 u_projectionMatrix;
-uniform float advance;
 attribute vec2 a_position;
 attribute vec2 a_texcoord0;
 varying vec2 v_texcoord0;
 void main(void) {
-  vec4 pos = u_modelviewMatrix * vec4(a_position.x + advance, a_position.y, 0.0, 1.0);
+  vec4 pos = u_modelviewMatrix * vec4(a_position, 0.0, 1.0);
   v_texcoord0 = a_texcoord0;
   gl_Position = u_projectionMatrix * pos;
 }"""
 
 
-_fragment_shader = """precision highp float;
-uniform sampler2D u_fonttex;
+_fragment_shader = """uniform sampler2D u_fonttex;
 uniform vec4 u_color;
 varying vec2 v_texcoord0;
 void main(void) {
@@ -73,8 +73,24 @@ stb__consolas_32_usascii_a = np.array([282,282,282,282,282,282,282,282,
                                        282,282,282,282,282,282,282,282,282,282,282,282,282,282,282,282,
                                        282,282,282,282,282,282,282])
 
+# maximum number of laid-out strings whose vertex buffers are kept by a TextDrawer:
+TEXT_CACHE_SIZE = 64
+# initial capacity (in bytes) of the buffer to which uncached strings are streamed:
+STREAM_BUFFER_SIZE = 64 * 1024
+# vertex layout of laid-out text (two triangles per glyph):
+TEXT_VERTEX_DTYPE = np.dtype([('a_position', np.float32, (2,)), ('a_texcoord0', np.float32, (2,))])
+# order of the quad corners (top-left, bottom-left, top-right, bottom-right) of the two triangles of each glyph:
+_GLYPH_TRIANGLE_CORNERS = np.array([0, 1, 2, 2, 1, 3])
+
+
 class TextDrawer(object):
-    def __init__(self, font_image=DEFAULT_FONT_IMAGE):
+    """Draws strings of the stb consolas font, each with a single draw call.
+
+    Each string is laid out (into two triangles per glyph) in one vectorized step.
+    The vertex buffers of the `TEXT_CACHE_SIZE` most recently drawn strings are kept (least recently used strings
+    are evicted), so static labels are laid out and uploaded once; strings which change from frame to frame
+    (e.g. frame times) should be drawn with `cache=False`, which streams them to a shared buffer instead."""
+    def __init__(self, font_image=DEFAULT_FONT_IMAGE, cache_size=TEXT_CACHE_SIZE):
         image = Image.open(font_image)
         vs_id = gl.glCreateShader(gl.GL_VERTEX_SHADER)
         gl.glShaderSource(vs_id, _vertex_shader)
@@ -95,7 +111,7 @@ class TextDrawer(object):
         if not gl.glGetProgramiv(program_id, gl.GL_LINK_STATUS):
             raise Exception('failed to link gltext program')
         texture_id = gl.glGenTextures(1)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
+        glstate.bind_texture(0, gl.GL_TEXTURE_2D, texture_id)
         sampler_id = gl.glGenSamplers(1)
         gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_MIN_FILTER, 9986)
         gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_MAG_FILTER, 9729)
@@ -107,87 +123,132 @@ class TextDrawer(object):
                         image.width, image.height, 0,
                         gl.GL_RED,
                         gl.GL_UNSIGNED_BYTE,
-                        np.array(list(image.getdata()), dtype=np.ubyte))
+                        np.asarray(image.convert('L'), dtype=np.ubyte))
         gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        glstate.bind_texture(0, gl.GL_TEXTURE_2D, 0)
         if gl.glGetError() != gl.GL_NO_ERROR:
             raise Exception('failed to create font texture')
         self._program_id = program_id
         self._attribute_locations = {attribute: gl.glGetAttribLocation(program_id, attribute)
-                                     for attribute in ['a_position', 'a_texcoord0']}
+                                     for attribute in TEXT_VERTEX_DTYPE.names}
         self._uniform_locations = {uniform: gl.glGetUniformLocation(program_id, uniform)
-                                   for uniform in ['u_modelviewMatrix', 'u_projectionMatrix', 'u_fonttex', 'u_color', 'advance']}
+                                   for uniform in ['u_modelviewMatrix', 'u_projectionMatrix', 'u_fonttex', 'u_color']}
         self._texture_id = texture_id
         self._sampler_id = sampler_id
 
-        recip_width = 1.0 / STB_FONT_consolas_32_usascii_BITMAP_WIDTH
-        recip_height = 1.0 / STB_FONT_consolas_32_usascii_BITMAP_HEIGHT
-        s0f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        t0f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        s1f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        t1f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        x0f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        y0f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        x1f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        y1f = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        advance = np.empty(STB_FONT_consolas_32_usascii_NUM_CHARS, dtype=np.float32)
-        for i in range(len(s0f)):
-            s0f[i] = (stb__consolas_32_usascii_s[i] - 0.5) * recip_width
-            t0f[i] = (stb__consolas_32_usascii_t[i] - 0.5) * recip_height
-            s1f[i] = (stb__consolas_32_usascii_s[i] + stb__consolas_32_usascii_w[i] + 0.5) * recip_width
-            t1f[i] = (stb__consolas_32_usascii_t[i] + stb__consolas_32_usascii_h[i] + 0.5) * recip_height
-            x0f[i] = stb__consolas_32_usascii_x[i] - 0.5
-            y0f[i] = stb__consolas_32_usascii_y[i] - 0.5
-            x1f[i] = stb__consolas_32_usascii_x[i] + stb__consolas_32_usascii_w[i] + 0.5
-            y1f[i] = stb__consolas_32_usascii_y[i] + stb__consolas_32_usascii_h[i] + 0.5
-            advance[i] = stb__consolas_32_usascii_a[i] / 16.0
-        self._advance = advance
-        buffer_ids = gl.glGenBuffers(STB_FONT_consolas_32_usascii_NUM_CHARS)
-        for i, buffer_id in enumerate(buffer_ids):
-            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, buffer_id)
-            buffer_data = np.array([x0f[i], y0f[i],
-                                    x0f[i], y1f[i],
-                                    x1f[i], y0f[i],
-                                    x1f[i], y1f[i],
-                                    s0f[i], t1f[i],
-                                    s0f[i], t0f[i],
-                                    s1f[i], t1f[i],
-                                    s1f[i], t0f[i]]).tobytes()
-            gl.glBufferData(gl.GL_ARRAY_BUFFER, len(buffer_data), buffer_data, gl.GL_STATIC_DRAW)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+        # per-glyph quad corners and texture coordinates (in the order of _GLYPH_TRIANGLE_CORNERS),
+        # with y pointing up from the top of the line:
+        x0 = stb__consolas_32_usascii_x - 0.5
+        x1 = stb__consolas_32_usascii_x + stb__consolas_32_usascii_w + 0.5
+        y0 = -(stb__consolas_32_usascii_y - 0.5)
+        y1 = -(stb__consolas_32_usascii_y + stb__consolas_32_usascii_h + 0.5)
+        s0 = (stb__consolas_32_usascii_s - 0.5) / STB_FONT_consolas_32_usascii_BITMAP_WIDTH
+        s1 = (stb__consolas_32_usascii_s + stb__consolas_32_usascii_w + 0.5) / STB_FONT_consolas_32_usascii_BITMAP_WIDTH
+        t0 = (stb__consolas_32_usascii_t - 0.5) / STB_FONT_consolas_32_usascii_BITMAP_HEIGHT
+        t1 = (stb__consolas_32_usascii_t + stb__consolas_32_usascii_h + 0.5) / STB_FONT_consolas_32_usascii_BITMAP_HEIGHT
+        glyph_quads = np.empty((STB_FONT_consolas_32_usascii_NUM_CHARS, 4), dtype=TEXT_VERTEX_DTYPE)
+        glyph_quads['a_position'] = np.stack([np.stack([x0, y0], -1), np.stack([x0, y1], -1),
+                                              np.stack([x1, y0], -1), np.stack([x1, y1], -1)], 1)
+        glyph_quads['a_texcoord0'] = np.stack([np.stack([s0, t0], -1), np.stack([s0, t1], -1),
+                                               np.stack([s1, t0], -1), np.stack([s1, t1], -1)], 1)
+        self._glyph_vertices = glyph_quads[:, _GLYPH_TRIANGLE_CORNERS]
+        self._advance = (stb__consolas_32_usascii_a / 16.0).astype(np.float32)
+
+        self._vao = gl.glGenVertexArrays(1)
+        glstate.bind_vertex_array(self._vao)
+        for location in self._attribute_locations.values():
+            gl.glEnableVertexAttribArray(location)
+        glstate.bind_vertex_array(0)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._stream_buffer = gl.glGenBuffers(1)
+        self._stream_capacity = 0
+        self._stream_offset = 0
         if gl.glGetError() != gl.GL_NO_ERROR:
             raise Exception('failed to create buffers')
-        self._buffer_ids = buffer_ids
         self._matrix = np.eye(4, dtype=np.float32)
         self._matrix[:3, :3] *= 0.01;
         self._modelview_matrix = np.eye(4, dtype=np.float32)
+    def layout_text(self, text):
+        """Returns the `TEXT_VERTEX_DTYPE` vertices (two triangles per glyph) of a line of text.
+        Characters outside of the font's range are skipped."""
+        glyphs = np.frombuffer(text.encode('ascii', 'ignore'), dtype=np.uint8).astype(np.intp) - STB_FONT_consolas_32_usascii_FIRST_CHAR
+        glyphs = glyphs[(glyphs >= 0) & (glyphs < STB_FONT_consolas_32_usascii_NUM_CHARS)]
+        advance = self._advance[glyphs]
+        vertices = self._glyph_vertices[glyphs]
+        vertices['a_position'][..., 0] += (np.cumsum(advance) - advance)[:, np.newaxis]
+        return vertices.reshape(-1)
+    def _get_cached_buffer(self, text):
+        # returns the buffer and vertex count of the cached layout of the text (laying it out if needed)
+        if text in self._cache:
+            self._cache.move_to_end(text)
+            return self._cache[text]
+        vertices = self.layout_text(text)
+        if len(self._cache) >= self._cache_size:
+            buffer_id, _ = self._cache.popitem(last=False)[1]
+        else:
+            buffer_id = gl.glGenBuffers(1)
+        glstate.bind_buffer(gl.GL_ARRAY_BUFFER, buffer_id)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, vertices.nbytes, vertices, gl.GL_STATIC_DRAW)
+        self._cache[text] = (buffer_id, len(vertices))
+        return self._cache[text]
+    def _stream(self, text):
+        # appends the layout of the text to the stream buffer (orphaning it when it is full),
+        # returning its byte offset and vertex count
+        vertices = self.layout_text(text)
+        glstate.bind_buffer(gl.GL_ARRAY_BUFFER, self._stream_buffer)
+        if self._stream_offset + vertices.nbytes > self._stream_capacity:
+            self._stream_capacity = max(STREAM_BUFFER_SIZE, 2 * self._stream_capacity, vertices.nbytes)
+            gl.glBufferData(gl.GL_ARRAY_BUFFER, self._stream_capacity, None, gl.GL_STREAM_DRAW)
+            self._stream_offset = 0
+        offset = self._stream_offset
+        if vertices.nbytes:
+            gl.glBufferSubData(gl.GL_ARRAY_BUFFER, offset, vertices.nbytes, vertices)
+        self._stream_offset += vertices.nbytes
+        return offset, len(vertices)
     def draw_text(self, text, color=(1.0, 1.0, 1.0, 0.0),
-                  view_matrix=None, projection_matrix=None):
-        gl.glUseProgram(self._program_id)
-        gl.glActiveTexture(gl.GL_TEXTURE0+0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self._texture_id)
-        gl.glBindSampler(0, self._sampler_id)
-        gl.glUniform1i(self._uniform_locations['u_fonttex'], 0)
-        gl.glUniform4f(self._uniform_locations['u_color'], *color)
+                  view_matrix=None, projection_matrix=None, cache=True):
+        """Draws a line of text (in a plane scaled by 0.01 from the view space of `view_matrix`).
+        Strings which change every frame should be drawn with `cache=False`."""
         if view_matrix is not None:
             self._matrix.dot(view_matrix, out=self._modelview_matrix)
-            gl.glUniformMatrix4fv(self._uniform_locations['u_modelviewMatrix'], 1, False, self._modelview_matrix)
+        self._draw(text, color, self._modelview_matrix if view_matrix is not None else None,
+                   projection_matrix, cache)
+    def draw_screen_text(self, text, x, y, window_size, color=(1.0, 1.0, 1.0, 0.0), scale=0.5, cache=True):
+        """Draws a line of text at the window position (`x`, `y`) (in pixels from the top left corner of the window,
+        at `scale` times the font's size of 32 pixels), without depth testing."""
+        projection_matrix = np.array([[2.0 / window_size[0], 0.0, 0.0, 0.0],
+                                      [0.0, 2.0 / window_size[1], 0.0, 0.0],
+                                      [0.0, 0.0, -1.0, 0.0],
+                                      [-1.0, -1.0, 0.0, 1.0]], dtype=np.float32)
+        modelview_matrix = np.diag(np.array([scale, scale, 1.0, 1.0], dtype=np.float32))
+        modelview_matrix[3, :2] = (x, window_size[1] - y)
+        glstate.disable(gl.GL_DEPTH_TEST)
+        self._draw(text, color, modelview_matrix, projection_matrix, cache)
+    def _draw(self, text, color, modelview_matrix, projection_matrix, cache):
+        if cache:
+            buffer_id, count = self._get_cached_buffer(text)
+            offset = 0
+        else:
+            offset, count = self._stream(text)
+            buffer_id = self._stream_buffer
+        if not count:
+            return
+        glstate.use_program(self._program_id)
+        glstate.bind_texture(0, gl.GL_TEXTURE_2D, self._texture_id)
+        glstate.bind_sampler(0, self._sampler_id)
+        gl.glUniform1i(self._uniform_locations['u_fonttex'], 0)
+        gl.glUniform4f(self._uniform_locations['u_color'], *color)
+        if modelview_matrix is not None:
+            gl.glUniformMatrix4fv(self._uniform_locations['u_modelviewMatrix'], 1, False, modelview_matrix)
         if projection_matrix is not None:
             gl.glUniformMatrix4fv(self._uniform_locations['u_projectionMatrix'], 1, False, projection_matrix)
-        gl.glEnableVertexAttribArray(0)
-        gl.glEnableVertexAttribArray(1)
-        gl.glEnable(gl.GL_BLEND)
-        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
-        x = 0.0
-        text = [ord(c) - 32 for c in text]
-        for i in text:
-            if i >= 0 and i < 95:
-                gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self._buffer_ids[i])
-                gl.glVertexAttribPointer(0, 2, gl.GL_FLOAT, False, 0, c_void_p(0))
-                gl.glVertexAttribPointer(1, 2, gl.GL_FLOAT, False, 0, c_void_p(8*4))
-                gl.glUniform1f(self._uniform_locations['advance'], x)
-                gl.glDrawArrays(gl.GL_TRIANGLE_STRIP, 0, 4)
-                x += self._advance[i]
-        gl.glDisableVertexAttribArray(0)
-        gl.glDisableVertexAttribArray(1)
-        gl.glDisable(gl.GL_BLEND)
+        glstate.bind_vertex_array(self._vao)
+        glstate.bind_buffer(gl.GL_ARRAY_BUFFER, buffer_id)
+        for name, location in self._attribute_locations.items():
+            gl.glVertexAttribPointer(location, 2, gl.GL_FLOAT, False, TEXT_VERTEX_DTYPE.itemsize,
+                                     c_void_p(offset + TEXT_VERTEX_DTYPE.fields[name][1]))
+        glstate.enable(gl.GL_BLEND)
+        glstate.blend_func(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, count)
+        glstate.disable(gl.GL_BLEND)
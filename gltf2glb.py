@@ -0,0 +1,134 @@
+"""Packs a glTF file, along with all of its external and embedded resources
+(buffers, shaders and images), into a single binary glTF (.glb) file."""
+import os.path
+import copy
+import json
+import base64
+import struct
+import argparse
+import logging
+
+import PIL.Image as Image
+
+import gltfutils as gltfu
+
+
+_logger = logging.getLogger(__name__)
+
+
+def _read_uri(uri, uri_path):
+    if uri.startswith('data:'):
+        header, data = uri.split(',', 1)
+        if header.endswith(';base64'):
+            return base64.urlsafe_b64decode(data) if header.startswith('data:text/plain') else base64.b64decode(data)
+        return data.encode()
+    with open(os.path.join(uri_path, uri), 'rb') as f:
+        return f.read()
+
+
+def pack_glb(gltf, uri_path):
+    """Packs the buffers, shaders and images of the given gltf into a single binary body,
+    following the KHR_binary_glTF extension.
+
+    Returns a packed copy of the gltf, which refers only to the 'binary_glTF' buffer,
+    and the list of (4-byte aligned) pieces which make up the binary body."""
+    gltf = copy.deepcopy(gltf)
+    gltfu.load_buffers(gltf, uri_path)
+    pieces = []
+    offsets = {}
+    body_length = 0
+    def append(data):
+        nonlocal body_length
+        offset = body_length
+        pieces.append(data)
+        body_length += len(data)
+        if body_length % 4:
+            pieces.append(b'\0' * (4 - body_length % 4))
+            body_length += 4 - body_length % 4
+        return offset
+    buffers = gltf.get('buffers', {})
+    for buffer_name, buffer in buffers.items():
+        offsets[buffer_name] = append(buffer.pop('data'))
+    bufferViews = gltf.setdefault('bufferViews', {})
+    for bufferView in bufferViews.values():
+        bufferView['byteOffset'] = offsets[bufferView['buffer']] + bufferView.get('byteOffset', 0)
+        bufferView['buffer'] = gltfu.GLB_BINARY_BUFFER_NAME
+    for shader_name, shader in gltf.get('shaders', {}).items():
+        if 'KHR_binary_glTF' in shader.get('extensions', {}):
+            continue
+        data = _read_uri(shader['uri'], uri_path)
+        bufferView_name = 'binary_shader_%s' % shader_name
+        bufferViews[bufferView_name] = {'buffer': gltfu.GLB_BINARY_BUFFER_NAME,
+                                        'byteOffset': append(data),
+                                        'byteLength': len(data)}
+        shader['uri'] = 'data:,'
+        shader.setdefault('extensions', {})['KHR_binary_glTF'] = {'bufferView': bufferView_name}
+    for image_name, image in gltf.get('images', {}).items():
+        if 'KHR_binary_glTF' in image.get('extensions', {}):
+            continue
+        data = _read_uri(image['uri'], uri_path)
+        filename = os.path.join(uri_path, image['uri'])
+        pil_image = Image.open(filename) if not image['uri'].startswith('data:') else None
+        bufferView_name = 'binary_image_%s' % image_name
+        bufferViews[bufferView_name] = {'buffer': gltfu.GLB_BINARY_BUFFER_NAME,
+                                        'byteOffset': append(data),
+                                        'byteLength': len(data)}
+        extension = {'bufferView': bufferView_name}
+        if pil_image is not None:
+            extension.update({'mimeType': Image.MIME.get(pil_image.format, 'application/octet-stream'),
+                              'width': pil_image.width,
+                              'height': pil_image.height})
+        image['uri'] = 'data:,'
+        image.setdefault('extensions', {})['KHR_binary_glTF'] = extension
+    gltf['buffers'] = {gltfu.GLB_BINARY_BUFFER_NAME: {'byteLength': body_length,
+                                                      'type': 'arraybuffer',
+                                                      'uri': 'data:,'}}
+    extensions_used = gltf.setdefault('extensionsUsed', [])
+    if 'KHR_binary_glTF' not in extensions_used:
+        extensions_used.append('KHR_binary_glTF')
+    return gltf, pieces
+
+
+def write_glb(filename, gltf, pieces, version=1):
+    """Writes a packed gltf and its binary body (as returned by `pack_glb`) to a binary glTF file.
+
+    Version 1 writes the KHR_binary_glTF container; version 2 writes the chunked (JSON/BIN) container."""
+    content = json.dumps(gltf, separators=(',', ':')).encode()
+    content += b' ' * (-len(content) % 4)
+    body_length = sum(len(piece) for piece in pieces)
+    with open(filename, 'wb') as f:
+        if version == 1:
+            length = 20 + len(content) + body_length
+            f.write(struct.pack('<4sIIII', gltfu.GLB_MAGIC, 1, length, len(content), 0))
+            f.write(content)
+        elif version == 2:
+            length = 12 + 8 + len(content) + 8 + body_length
+            f.write(struct.pack('<4sII', gltfu.GLB_MAGIC, 2, length))
+            f.write(struct.pack('<II', len(content), gltfu.GLB_CHUNK_TYPE_JSON))
+            f.write(content)
+            f.write(struct.pack('<II', body_length, gltfu.GLB_CHUNK_TYPE_BIN))
+        else:
+            raise Exception('unsupported binary glTF version: %d' % version)
+        for piece in pieces:
+            f.write(piece)
+    return length
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('filename', help='path of glTF file to convert')
+    parser.add_argument('-o', '--output', help='path of binary glTF file to write (default: the input path with a .glb extension)')
+    parser.add_argument('--chunked', help='write the chunked (version 2) container rather than KHR_binary_glTF (version 1)',
+                        action='store_true')
+    parser.add_argument("-v", help="enable verbose logging", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=(logging.DEBUG if args.v else logging.INFO))
+    output = args.output or os.path.splitext(args.filename)[0] + '.glb'
+    gltf = gltfu.load_gltf(args.filename)
+    gltf, pieces = pack_glb(gltf, os.path.dirname(args.filename))
+    length = write_glb(output, gltf, pieces, version=(2 if args.chunked else 1))
+    _logger.info('* wrote %s (%d bytes)', output, length)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Vectorized sampling of glTF animations.
+
+The keyframe times and values of all channels are read from their accessors once, into NumPy arrays.
+Each frame, the keyframe interval of every distinct input (timeline) is found with a single batched `searchsorted`
+(skipped for the timelines whose interval is unchanged since the previous frame), and the channels of all animations
+are interpolated in a few array operations per (path, interpolation) pair, writing the results into the translation,
+rotation and scale arrays of a `gltfutils.NodeHierarchy`."""
+from types import MappingProxyType
+import logging
+
+import numpy as np
+
+import gltfutils as gltfu
+
+
+_logger = logging.getLogger(__name__)
+
+ANIMATION_PATH_SIZES = MappingProxyType({
+    'translation': 3,
+    'rotation':    4,
+    'scale':       3
+})
+
+ANIMATION_INTERPOLATIONS = ('STEP', 'LINEAR', 'CUBICSPLINE')
+
+
+def slerp(q0, q1, alpha):
+    """Spherical linear interpolation (along the shorter arc) of (N,4) arrays of unit quaternions
+    by an (N,1) array of fractions.  Nearly parallel pairs of quaternions are interpolated linearly."""
+    dots = (q0 * q1).sum(axis=1, keepdims=True)
+    q1 = np.where(dots < 0, -q1, q1)
+    dots = np.minimum(np.abs(dots), 1)
+    theta = np.arccos(dots)
+    sin_theta = np.sin(theta)
+    near = sin_theta < 1e-5
+    sin_theta[near] = 1
+    w0 = np.where(near, 1 - alpha, np.sin((1 - alpha) * theta) / sin_theta)
+    w1 = np.where(near, alpha, np.sin(alpha * theta) / sin_theta)
+    q = w0 * q0 + w1 * q1
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q
+
+
+class _ChannelGroup(object):
+    """The channels of one (path, interpolation) pair: their target node indices, timeline indices,
+    and the offsets of their keyframe values (one row per keyframe, or three for CUBICSPLINE) in `values`."""
+    __slots__ = ('path', 'interpolation', 'nodes', 'timelines', 'value_offsets', 'values')
+    def __init__(self, path, interpolation, nodes, timelines, value_offsets, values):
+        self.path = path
+        self.interpolation = interpolation
+        self.nodes = nodes
+        self.timelines = timelines
+        self.value_offsets = value_offsets
+        self.values = values
+
+
+class AnimationEngine(object):
+    """Evaluates the channels of the given animations (by default, all animations of the gltf) which target nodes
+    of `hierarchy`.  glTF 1.0 samplers (whose input and output are animation parameters) and samplers whose
+    input and output are accessors are both understood; channels targeting nodes with a `matrix` are ignored.
+
+    Each animation starts at time 0 and, if `loop` is True, repeats after its duration (its last keyframe time);
+    otherwise its channels hold their last values."""
+    def __init__(self, gltf, hierarchy, animation_names=None, loop=True):
+        animations = gltf.get('animations', {})
+        if animation_names is None:
+            animation_names = list(animations.keys())
+        self.hierarchy = hierarchy
+        self.loop = loop
+        timeline_indices = {}
+        timeline_times = []
+        timeline_animations = []
+        channels = {}
+        for animation_index, animation_name in enumerate(animation_names):
+            animation = animations[animation_name]
+            parameters = animation.get('parameters', {})
+            for channel in animation['channels']:
+                sampler = animation['samplers'][channel['sampler']]
+                target = channel['target']
+                node_name, path = target.get('id', target.get('node')), target['path']
+                if path not in ANIMATION_PATH_SIZES:
+                    _logger.warning('* animation "%s": ignoring channel with unsupported path "%s"', animation_name, path)
+                    continue
+                node = hierarchy.node_indices.get(node_name)
+                if node is None:
+                    continue
+                if hierarchy.has_matrix[node]:
+                    _logger.warning('* animation "%s": ignoring channel targeting node "%s", which has a matrix',
+                                    animation_name, node_name)
+                    continue
+                interpolation = sampler.get('interpolation', 'LINEAR')
+                if interpolation not in ANIMATION_INTERPOLATIONS:
+                    raise Exception('unsupported interpolation "%s" (animation "%s")' % (interpolation, animation_name))
+                input_name = parameters.get(sampler['input'], sampler['input'])
+                output_name = parameters.get(sampler['output'], sampler['output'])
+                if (animation_index, input_name) not in timeline_indices:
+                    timeline_indices[animation_index, input_name] = len(timeline_times)
+                    timeline_times.append(np.asarray(gltfu.get_accessor_data(gltf, input_name), dtype=np.float64).ravel())
+                    timeline_animations.append(animation_index)
+                timeline = timeline_indices[animation_index, input_name]
+                values = np.asarray(gltfu.get_accessor_data(gltf, output_name), dtype=np.float32)
+                values = values.reshape(len(values), -1)
+                num_keys = len(timeline_times[timeline])
+                if values.shape != ((3 if interpolation == 'CUBICSPLINE' else 1) * num_keys, ANIMATION_PATH_SIZES[path]):
+                    raise Exception('animation "%s": output "%s" does not match input "%s"'
+                                    % (animation_name, output_name, input_name))
+                channels.setdefault((path, interpolation), []).append((node, timeline, values))
+        self.num_channels = sum(len(group_channels) for group_channels in channels.values())
+        # the keyframe times of all timelines, concatenated:
+        self.time_offsets = np.cumsum([0] + [len(times) for times in timeline_times])[:-1].astype(np.intp)
+        self.time_counts = np.array([len(times) for times in timeline_times], dtype=np.intp)
+        self.times = np.concatenate(timeline_times) if timeline_times else np.zeros(0)
+        first_times = self.times[self.time_offsets] if timeline_times else np.zeros(0)
+        last_times = self.times[self.time_offsets + self.time_counts - 1] if timeline_times else np.zeros(0)
+        self.timeline_animations = np.array(timeline_animations, dtype=np.intp)
+        self.durations = np.zeros(len(animation_names))
+        np.maximum.at(self.durations, self.timeline_animations, last_times)
+        self._first_times, self._last_times = first_times, last_times
+        # the times of each timeline are offset by (timeline index) * span from its first time, so that the intervals
+        # of all timelines are found by a single search of one sorted array:
+        self._span = (last_times - first_times).max() + 1 if timeline_times else 1.0
+        timelines = np.repeat(np.arange(len(timeline_times)), self.time_counts)
+        self._search_keys = timelines * self._span + (self.times - np.repeat(first_times, self.time_counts))
+        self._last_keys = np.maximum(self.time_counts - 2, 0)
+        # the keyframe interval of each timeline found by the previous update:
+        self._hints = np.zeros(len(timeline_times), dtype=np.intp)
+        self.channel_groups = []
+        for (path, interpolation), group_channels in sorted(channels.items()):
+            nodes, timelines, values = zip(*group_channels)
+            value_offsets = np.cumsum([0] + [len(channel_values) for channel_values in values])[:-1]
+            self.channel_groups.append(_ChannelGroup(path, interpolation, np.array(nodes, dtype=np.intp),
+                                                     np.array(timelines, dtype=np.intp), value_offsets.astype(np.intp),
+                                                     np.concatenate(values)))
+        _logger.debug('* animation engine: %d animations, %d timelines, %d channels in %d groups',
+                      len(animation_names), len(timeline_times), self.num_channels, len(self.channel_groups))
+    def _find_keys(self, local_times):
+        # returns the index of the first keyframe of the interval containing each timeline's local time
+        keys = self._hints
+        offsets, last_keys = self.time_offsets, self._last_keys
+        next_keys = np.minimum(keys + 1, self.time_counts - 1)
+        hit = (self.times[offsets + keys] <= local_times) & ((local_times < self.times[offsets + next_keys]) |
+                                                            (keys == last_keys))
+        if not hit.all():
+            misses = np.flatnonzero(~hit)
+            queries = misses * self._span + (local_times[misses] - self._first_times[misses])
+            found = np.searchsorted(self._search_keys, queries, side='right') - 1 - offsets[misses]
+            keys[misses] = np.clip(found, 0, last_keys[misses])
+        return keys
+    def update(self, time):
+        """Samples all channels at the given time (in seconds), writes the sampled values into the local transforms
+        of their target nodes and marks the nodes whose transforms changed as dirty.
+        Returns the number of nodes marked dirty."""
+        if not self.num_channels:
+            return 0
+        durations = self.durations[self.timeline_animations]
+        if self.loop:
+            local_times = np.where(durations > 0, np.mod(time, np.where(durations > 0, durations, 1)), 0)
+        else:
+            local_times = np.full(len(durations), float(time))
+        local_times = np.clip(local_times, self._first_times, self._last_times)
+        keys = self._find_keys(local_times)
+        next_keys = np.minimum(keys + 1, self.time_counts - 1)
+        t0, t1 = self.times[self.time_offsets + keys], self.times[self.time_offsets + next_keys]
+        intervals = t1 - t0
+        alphas = np.clip((local_times - t0) / np.where(intervals > 0, intervals, 1), 0, 1)
+        hierarchy = self.hierarchy
+        targets = {'translation': hierarchy.translations, 'rotation': hierarchy.rotations, 'scale': hierarchy.scales}
+        changed_nodes = []
+        for group in self.channel_groups:
+            timelines, offsets, values = group.timelines, group.value_offsets, group.values
+            k0, k1 = keys[timelines], next_keys[timelines]
+            alpha = alphas[timelines].astype(np.float32)[:,np.newaxis]
+            if group.interpolation == 'STEP':
+                sampled = values[offsets + np.where(alpha[:,0] >= 1, k1, k0)]
+            elif group.interpolation == 'LINEAR':
+                v0, v1 = values[offsets + k0], values[offsets + k1]
+                if group.path == 'rotation':
+                    sampled = slerp(v0, v1, alpha)
+                else:
+                    sampled = v0 + (v1 - v0) * alpha
+            else:
+                # cubic Hermite spline, with the (in-tangent, value, out-tangent) triple of each keyframe:
+                dt = intervals[timelines].astype(np.float32)[:,np.newaxis]
+                p0, m0 = values[offsets + 3*k0 + 1], dt * values[offsets + 3*k0 + 2]
+                p1, m1 = values[offsets + 3*k1 + 1], dt * values[offsets + 3*k1]
+                alpha2 = alpha * alpha
+                alpha3 = alpha2 * alpha
+                sampled = ((2*alpha3 - 3*alpha2 + 1) * p0 + (alpha3 - 2*alpha2 + alpha) * m0 +
+                           (-2*alpha3 + 3*alpha2) * p1 + (alpha3 - alpha2) * m1)
+                if group.path == 'rotation':
+                    sampled /= np.linalg.norm(sampled, axis=1, keepdims=True)
+            target = targets[group.path]
+            changed = (target[group.nodes] != sampled).any(axis=1)
+            if changed.any():
+                target[group.nodes] = sampled
+                changed_nodes.append(group.nodes[changed])
+        if not changed_nodes:
+            return 0
+        changed_nodes = np.unique(np.concatenate(changed_nodes))
+        hierarchy.mark_dirty(changed_nodes)
+        return len(changed_nodes)
@@ -0,0 +1,465 @@
+"""Headless rendering benchmark: renders a glTF scene along a camera path in an offscreen
+(EGL surfaceless, e.g. Mesa llvmpipe) context and reports load-stage timings, CPU frame time percentiles,
+draw calls and state changes per frame.  Also generates synthetic glTF scenes to benchmark."""
+import os
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+import sys
+import json
+import time
+import base64
+import argparse
+import ctypes
+import logging
+
+import numpy as np
+
+import OpenGL
+# the EGL bindings must be imported before GL error checking is disabled:
+from OpenGL import EGL
+OpenGL.ERROR_CHECKING = False
+OpenGL.ERROR_LOGGING = False
+OpenGL.ERROR_ON_COPY = True
+import OpenGL.GL as gl
+
+import PIL.Image as Image
+from pyrr import matrix44
+
+
+_logger = logging.getLogger(__name__)
+import gltfutils as gltfu
+from glstate import state as glstate
+import gltfloader
+import glarena
+import gltfanim
+from jsobject import JSobject as jsobject
+from FakeHMDRenderer import FakeHMDRenderer
+
+
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+SYNTHETIC_VERTEX_SHADER = """uniform mat4 u_modelViewMatrix;
+uniform mat4 u_projectionMatrix;
+uniform mat3 u_normalMatrix;
+attribute vec3 a_position;
+attribute vec3 a_normal;
+attribute vec2 a_texcoord0;
+varying vec3 v_normal;
+varying vec2 v_texcoord0;
+void main(void) {
+    v_normal = u_normalMatrix * a_normal;
+    v_texcoord0 = a_texcoord0;
+    gl_Position = u_projectionMatrix * u_modelViewMatrix * vec4(a_position, 1.0);
+}
+"""
+
+SYNTHETIC_FRAGMENT_SHADER = """uniform sampler2D u_diffuse;
+uniform vec4 u_color;
+varying vec3 v_normal;
+varying vec2 v_texcoord0;
+void main(void) {
+    float lambert = max(0.2, normalize(v_normal).z);
+    gl_FragColor = vec4(lambert * u_color.rgb * texture2D(u_diffuse, v_texcoord0).rgb, 1.0);
+}
+"""
+
+
+def create_context(width, height):
+    """Creates an offscreen OpenGL context (EGL, preferring a surfaceless Mesa display) and binds
+    a framebuffer object of the given size to render into.  Returns the framebuffer id."""
+    try:
+        display = EGL.eglGetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None)
+    except Exception:
+        display = EGL.EGL_NO_DISPLAY
+    if display == EGL.EGL_NO_DISPLAY:
+        display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise Exception('failed to initialize EGL')
+    attributes = (EGL.EGLint * 5)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                  EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+    config, num_configs = EGL.EGLConfig(), EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(num_configs)) or not num_configs.value:
+        raise Exception('no suitable EGL config found')
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if context == EGL.EGL_NO_CONTEXT or not EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context):
+        raise Exception('failed to create EGL context')
+    _logger.info('GL_VERSION: %s', gl.glGetString(gl.GL_VERSION))
+    _logger.info('GL_RENDERER: %s', gl.glGetString(gl.GL_RENDERER))
+    framebuffer = gl.glGenFramebuffers(1)
+    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer)
+    color_buffer, depth_buffer = gl.glGenRenderbuffers(2)
+    gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, color_buffer)
+    gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_RGBA8, width, height)
+    gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_RENDERBUFFER, color_buffer)
+    gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, depth_buffer)
+    gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH_COMPONENT24, width, height)
+    gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_DEPTH_ATTACHMENT, gl.GL_RENDERBUFFER, depth_buffer)
+    if gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER) != gl.GL_FRAMEBUFFER_COMPLETE:
+        raise Exception('failed to create offscreen framebuffer')
+    return framebuffer
+
+
+def _make_sphere(segments):
+    """Returns the interleaved (position, normal, texcoord) vertices and the triangle indices of a UV sphere of radius 0.5."""
+    u = np.linspace(0, 1, segments + 1, dtype=np.float32)
+    v = np.linspace(0, 1, segments // 2 + 1, dtype=np.float32)
+    uu, vv = np.meshgrid(u, v)
+    theta, phi = 2 * np.pi * uu, np.pi * vv
+    normals = np.stack([np.sin(phi) * np.cos(theta), np.cos(phi), -np.sin(phi) * np.sin(theta)], axis=-1).reshape(-1, 3)
+    vertices = np.hstack([0.5 * normals, normals, np.stack([uu, vv], axis=-1).reshape(-1, 2)]).astype(np.float32)
+    i, j = np.meshgrid(np.arange(segments // 2), np.arange(segments), indexing='ij')
+    a = i * (segments + 1) + j
+    b = a + segments + 1
+    indices = np.stack([a, b, a + 1, a + 1, b, b + 1], axis=-1).ravel()
+    return vertices, indices.astype(np.uint16 if len(vertices) <= 0xffff else np.uint32)
+
+
+def _make_animation(rng, num_animated, num_keys, duration):
+    # returns the keyframe times and the (rotation, translation, scale) keyframe values of each animated node,
+    # the translations having (in-tangent, value, out-tangent) triples for CUBICSPLINE interpolation
+    times = np.linspace(0, duration, num_keys).astype(np.float32)
+    rotations = rng.normal(size=(num_animated, num_keys, 4)).astype(np.float32)
+    rotations /= np.linalg.norm(rotations, axis=-1, keepdims=True)
+    translations = rng.uniform(-0.5, 0.5, size=(num_animated, 3 * num_keys, 3)).astype(np.float32)
+    scales = rng.uniform(0.5, 1.5, size=(num_animated, num_keys, 1)).repeat(3, axis=-1).astype(np.float32)
+    return times, rotations, translations, scales
+
+
+def generate_scene(path, num_nodes=1000, depth=1, num_meshes=10, num_materials=10, texture_size=256,
+                   segments=16, seed=0, num_animated=0):
+    """Writes a synthetic glTF scene to the directory `path` (as scene.gltf, scene.bin and one .png image per texture)
+    and returns the filename of the .gltf file.
+
+    The scene has `num_nodes` nodes in chains of `depth` nodes (the first node of each chain is a root node),
+    each referencing one of `num_meshes` UV spheres of `segments` segments (so that on average num_nodes / num_meshes
+    nodes share each mesh), drawn with one of `num_materials` materials.  Each material has its own
+    `texture_size` x `texture_size` texture, unless `texture_size` is 0, in which case all materials share a 1x1 texture.
+    The first `num_animated` nodes are animated by one looping animation, with a LINEAR rotation channel,
+    a CUBICSPLINE translation channel and a STEP scale channel each."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    rng = np.random.RandomState(seed)
+    vertices, indices = _make_sphere(segments)
+    body = vertices.tobytes() + indices.tobytes()
+    animation_offset = len(body)
+    if num_animated:
+        times, rotations, translations, scales = _make_animation(rng, num_animated, num_keys=5, duration=4.0)
+        body += times.tobytes() + rotations.tobytes() + translations.tobytes() + scales.tobytes()
+    with open(os.path.join(path, 'scene.bin'), 'wb') as f:
+        f.write(body)
+    num_textures = num_materials if texture_size else 1
+    for i in range(num_textures):
+        size = texture_size or 1
+        pixels = rng.randint(128, 256, size=(size, size, 3)).astype(np.uint8)
+        Image.fromarray(pixels, 'RGB').save(os.path.join(path, 'texture%d.png' % i))
+    gltf = {
+        'asset': {'version': '1.0', 'generator': 'gltfbench.py'},
+        'scene': 'scene0',
+        'buffers': {'buffer0': {'uri': 'scene.bin', 'byteLength': len(body), 'type': 'arraybuffer'}},
+        'bufferViews': {
+            'vertices': {'buffer': 'buffer0', 'byteOffset': 0, 'byteLength': vertices.nbytes, 'target': gl.GL_ARRAY_BUFFER},
+            'indices': {'buffer': 'buffer0', 'byteOffset': vertices.nbytes, 'byteLength': indices.nbytes,
+                        'target': gl.GL_ELEMENT_ARRAY_BUFFER}
+        },
+        'accessors': {
+            'position': {'bufferView': 'vertices', 'byteOffset': 0, 'byteStride': 32, 'componentType': gl.GL_FLOAT,
+                         'count': len(vertices), 'type': 'VEC3', 'min': [-0.5, -0.5, -0.5], 'max': [0.5, 0.5, 0.5]},
+            'normal': {'bufferView': 'vertices', 'byteOffset': 12, 'byteStride': 32, 'componentType': gl.GL_FLOAT,
+                       'count': len(vertices), 'type': 'VEC3'},
+            'texcoord': {'bufferView': 'vertices', 'byteOffset': 24, 'byteStride': 32, 'componentType': gl.GL_FLOAT,
+                         'count': len(vertices), 'type': 'VEC2'},
+            'indices': {'bufferView': 'indices', 'byteOffset': 0, 'byteStride': 0,
+                        'componentType': gl.GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else gl.GL_UNSIGNED_INT,
+                        'count': len(indices), 'type': 'SCALAR'}
+        },
+        'shaders': {
+            'vertexShader': {'type': gl.GL_VERTEX_SHADER,
+                             'uri': 'data:text/plain;base64,' + base64.urlsafe_b64encode(SYNTHETIC_VERTEX_SHADER.encode()).decode()},
+            'fragmentShader': {'type': gl.GL_FRAGMENT_SHADER,
+                               'uri': 'data:text/plain;base64,' + base64.urlsafe_b64encode(SYNTHETIC_FRAGMENT_SHADER.encode()).decode()}
+        },
+        'programs': {'program0': {'attributes': ['a_position', 'a_normal', 'a_texcoord0'],
+                                  'vertexShader': 'vertexShader', 'fragmentShader': 'fragmentShader'}},
+        'techniques': {'technique0': {
+            'program': 'program0',
+            'attributes': {'a_position': 'position', 'a_normal': 'normal', 'a_texcoord0': 'texcoord'},
+            'uniforms': {'u_modelViewMatrix': 'modelViewMatrix', 'u_projectionMatrix': 'projectionMatrix',
+                         'u_normalMatrix': 'normalMatrix', 'u_diffuse': 'diffuse', 'u_color': 'color'},
+            'parameters': {'modelViewMatrix': {'semantic': 'MODELVIEW', 'type': gl.GL_FLOAT_MAT4},
+                           'projectionMatrix': {'semantic': 'PROJECTION', 'type': gl.GL_FLOAT_MAT4},
+                           'normalMatrix': {'semantic': 'MODELVIEWINVERSETRANSPOSE', 'type': gl.GL_FLOAT_MAT3},
+                           'position': {'semantic': 'POSITION', 'type': gl.GL_FLOAT_VEC3},
+                           'normal': {'semantic': 'NORMAL', 'type': gl.GL_FLOAT_VEC3},
+                           'texcoord': {'semantic': 'TEXCOORD_0', 'type': gl.GL_FLOAT_VEC2},
+                           'diffuse': {'type': gl.GL_SAMPLER_2D},
+                           'color': {'type': gl.GL_FLOAT_VEC4, 'value': [1, 1, 1, 1]}},
+            'states': {'enable': [gl.GL_CULL_FACE, gl.GL_DEPTH_TEST]}
+        }},
+        'samplers': {'sampler0': {'minFilter': gl.GL_LINEAR_MIPMAP_LINEAR, 'magFilter': gl.GL_LINEAR,
+                                  'wrapS': gl.GL_REPEAT, 'wrapT': gl.GL_REPEAT}},
+        'images': {'image%d' % i: {'uri': 'texture%d.png' % i} for i in range(num_textures)},
+        'textures': {'texture%d' % i: {'format': gl.GL_RGBA, 'internalFormat': gl.GL_RGBA, 'sampler': 'sampler0',
+                                       'source': 'image%d' % i, 'target': gl.GL_TEXTURE_2D, 'type': gl.GL_UNSIGNED_BYTE}
+                     for i in range(num_textures)},
+        'materials': {'material%d' % i: {'technique': 'technique0',
+                                         'values': {'diffuse': 'texture%d' % (i % num_textures),
+                                                    'color': rng.uniform(0.3, 1, 3).tolist() + [1.0]}}
+                      for i in range(num_materials)},
+        'meshes': {'mesh%d' % i: {'primitives': [{'attributes': {'POSITION': 'position', 'NORMAL': 'normal',
+                                                                 'TEXCOORD_0': 'texcoord'},
+                                                  'indices': 'indices', 'material': 'material%d' % (i % num_materials),
+                                                  'mode': gl.GL_TRIANGLES}]}
+                   for i in range(num_meshes)},
+        'nodes': {},
+        'scenes': {'scene0': {'nodes': []}}
+    }
+    extent = 2 * num_nodes ** (1.0 / 3)
+    nodes, root_names = gltf['nodes'], gltf['scenes']['scene0']['nodes']
+    for i in range(num_nodes):
+        node_name = 'node%d' % i
+        rotation = rng.normal(size=4)
+        rotation /= np.linalg.norm(rotation)
+        nodes[node_name] = {'children': [], 'meshes': ['mesh%d' % rng.randint(num_meshes)],
+                            'rotation': rotation.tolist(), 'scale': [1.0, 1.0, 1.0]}
+        if i % depth == 0:
+            nodes[node_name]['translation'] = rng.uniform(-extent, extent, 3).tolist()
+            root_names.append(node_name)
+        else:
+            nodes[node_name]['translation'] = rng.uniform(-1, 1, 3).tolist()
+            nodes[node_name]['scale'] = [0.9, 0.9, 0.9]
+            nodes['node%d' % (i - 1)]['children'].append(node_name)
+    if num_animated:
+        gltf['bufferViews']['animation'] = {'buffer': 'buffer0', 'byteOffset': animation_offset,
+                                            'byteLength': len(body) - animation_offset}
+        accessors = gltf['accessors']
+        accessors['time'] = {'bufferView': 'animation', 'byteOffset': 0, 'componentType': gl.GL_FLOAT,
+                             'count': len(times), 'type': 'SCALAR'}
+        animation = {'channels': [], 'parameters': {'TIME': 'time'}, 'samplers': {}}
+        offset = times.nbytes
+        for path_name, values, interpolation, vector_type in (('rotation', rotations, 'LINEAR', 'VEC4'),
+                                                              ('translation', translations, 'CUBICSPLINE', 'VEC3'),
+                                                              ('scale', scales, 'STEP', 'VEC3')):
+            for i in range(num_animated):
+                name = 'node%d_%s' % (i, path_name)
+                accessors[name] = {'bufferView': 'animation', 'byteOffset': offset, 'componentType': gl.GL_FLOAT,
+                                   'count': values.shape[1], 'type': vector_type}
+                offset += values[i].nbytes
+                animation['parameters'][name] = name
+                animation['samplers'][name] = {'input': 'TIME', 'interpolation': interpolation, 'output': name}
+                animation['channels'].append({'sampler': name, 'target': {'id': 'node%d' % i, 'path': path_name}})
+        gltf['buffers']['buffer0']['byteLength'] = len(body)
+        gltf['animations'] = {'animation0': animation}
+    filename = os.path.join(path, 'scene.gltf')
+    with open(filename, 'w') as f:
+        json.dump(gltf, f)
+    return filename
+
+
+def calc_orbit_camera_path(center, radius, num_frames, height=0.25):
+    """Returns (num_frames,4,4) camera world matrices for one orbit around `center`, looking at it."""
+    angles = np.linspace(0, 2 * np.pi, num_frames, endpoint=False)
+    positions = np.array(center, dtype=np.float32) + radius * np.stack([np.sin(angles), np.full_like(angles, height), np.cos(angles)],
+                                                                       axis=-1)
+    matrices = np.zeros((num_frames, 4, 4), dtype=np.float32)
+    z_axes = positions - center
+    z_axes /= np.linalg.norm(z_axes, axis=1)[:,np.newaxis]
+    x_axes = np.cross([0, 1, 0], z_axes)
+    x_axes /= np.linalg.norm(x_axes, axis=1)[:,np.newaxis]
+    matrices[:,0,:3] = x_axes
+    matrices[:,1,:3] = np.cross(z_axes, x_axes)
+    matrices[:,2,:3] = z_axes
+    matrices[:,3,:3] = positions
+    matrices[:,3,3] = 1
+    return matrices
+
+
+def load_camera_path(filename):
+    """Loads a camera path recorded by gltfview.py (a JSON list of row-major camera world matrices)."""
+    with open(filename) as f:
+        return np.array(json.load(f), dtype=np.float32).reshape(-1, 4, 4)
+
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000
+    return {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)), 'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+
+def run_benchmark(filename, num_frames=300, warmup_frames=10, window_size=(800, 600), camera_path=None,
+                  stereo=False, finish=False, streaming=False):
+    """Loads and renders the given glTF file in an offscreen context, returning a dict of results.
+
+    Unless a `camera_path` of (N,4,4) camera world matrices is given, the camera orbits the scene's bounds.
+    If `stereo` is True, frames are rendered through `FakeHMDRenderer` (with the camera path as head poses).
+    If `finish` is True, each frame's time includes waiting for the GPU (glFinish).
+    The scene's animations (if any) are played at 60 frames per second.
+    If `streaming` is True, the resources are uploaded progressively during the frames (see `gltfloader.StreamingLoader`),
+    whose time to first frame, load time and load timeline are included in the results."""
+    framebuffer = create_context(*window_size)
+    gltf = gltfu.load_gltf(filename, object_hook=jsobject)
+    loader = None
+    if streaming:
+        loader = gltfloader.StreamingLoader(gltf, os.path.dirname(filename))
+        load_timings = loader.timings
+    else:
+        load_timings = gltfloader.load_resources(gltf, os.path.dirname(filename))
+    t = time.perf_counter()
+    hierarchy = gltfu.NodeHierarchy(gltf, gltf.scenes[gltf['scene']].nodes)
+    hierarchy.update()
+    draw_list = gltfu.compile_draw_list(gltf, hierarchy)
+    if loader is not None:
+        loader.attach(draw_list)
+    load_timings['compile draw list'] = time.perf_counter() - t
+    animation_engine = None
+    if gltf.get('animations'):
+        t = time.perf_counter()
+        animation_engine = gltfanim.AnimationEngine(gltf, hierarchy)
+        load_timings['setup animations'] = time.perf_counter() - t
+    if camera_path is None:
+        draw_list.update_world_bounds()
+        lower = (draw_list.world_centers - draw_list.world_extents).min(axis=0)
+        upper = (draw_list.world_centers + draw_list.world_extents).max(axis=0)
+        camera_path = calc_orbit_camera_path(0.5 * (lower + upper), 0.6 * np.linalg.norm(upper - lower),
+                                             num_frames + warmup_frames)
+    projection_matrix = np.array(matrix44.create_perspective_projection_matrix(np.rad2deg(55), window_size[0] / window_size[1],
+                                                                               0.1, 1000),
+                                 dtype=np.float32)
+    renderer = None
+    if stereo:
+        renderer = FakeHMDRenderer(render_target_size=window_size, poses=camera_path, mirror=False)
+    gl.glClearColor(0.01, 0.01, 0.17, 1.0)
+    counters = ('num_draw_calls', 'num_visible', 'num_culled', 'num_triangles', 'num_triangles_full',
+                'num_program_changes', 'num_material_changes', 'num_texture_binds')
+    frame_times = []
+    frame_counters = {counter: [] for counter in counters + ('gl_calls_issued', 'gl_calls_skipped', 'animated_nodes')}
+    for frame in range(num_frames + warmup_frames):
+        for counter in counters:
+            setattr(gltfu, counter, 0)
+        glstate.reset_counts()
+        t = time.perf_counter()
+        animated_nodes = animation_engine.update(frame / 60.0) if animation_engine is not None else 0
+        hierarchy.update()
+        view_matrix = np.linalg.inv(camera_path[frame % len(camera_path)])
+        if loader is not None:
+            loader.update(projection_matrix, view_matrix)
+        if renderer is not None:
+            renderer.render(gltf, draw_list, window_size)
+        else:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer)
+            glstate.viewport(0, 0, window_size[0], window_size[1])
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+            gltfu.render_draw_list(draw_list, gltf,
+                                   projection_matrix=projection_matrix,
+                                   view_matrix=view_matrix)
+            if loader is not None:
+                loader.draw_placeholders(projection_matrix, view_matrix)
+        if finish:
+            gl.glFinish()
+        dt = time.perf_counter() - t
+        if loader is not None:
+            loader.end_frame()
+        if frame >= warmup_frames:
+            frame_times.append(dt)
+            for counter in counters:
+                frame_counters[counter].append(getattr(gltfu, counter))
+            frame_counters['gl_calls_issued'].append(glstate.num_issued)
+            frame_counters['gl_calls_skipped'].append(glstate.num_skipped)
+            frame_counters['animated_nodes'].append(animated_nodes)
+    if renderer is not None:
+        renderer.shutdown()
+    streaming_results = None
+    if loader is not None:
+        streaming_results = {'time_to_first_frame': loader.time_to_first_frame, 'load_time': loader.load_time,
+                             'timeline': loader.timeline}
+    return {'filename': filename,
+            'renderer': gl.glGetString(gl.GL_RENDERER).decode(),
+            'num_frames': num_frames,
+            'stereo': stereo,
+            'load_timings': dict(load_timings),
+            'buffer_arenas': [dict(stats, target=target, group=group) for target, group, stats in glarena.pool.get_stats()],
+            'frame_time_ms': _percentiles(frame_times),
+            'per_frame': {(counter[len('num_'):] if counter.startswith('num_') else counter): float(np.mean(values))
+                          for counter, values in frame_counters.items()},
+            'streaming': streaming_results}
+
+
+def print_results(results, file=sys.stdout):
+    print('%s (%s, %d frames%s)' % (results['filename'], results['renderer'], results['num_frames'],
+                                    ', stereo' if results['stereo'] else ''), file=file)
+    print('load timings (ms):', file=file)
+    for stage, dt in sorted(results['load_timings'].items()):
+        print('  %-24s %10.3f' % (stage, 1000 * dt), file=file)
+    if results['buffer_arenas']:
+        print('buffer arenas:', file=file)
+        for stats in results['buffer_arenas']:
+            print('  %-24s %10d / %d bytes used (%.1f%%), %d padding, %.1f%% fragmented'
+                  % ('index' if stats['target'] == gl.GL_ELEMENT_ARRAY_BUFFER else 'vertex (alignment %d)' % stats['group'],
+                     stats['used'], stats['capacity'], 100 * stats['utilization'], stats['padding'], 100 * stats['fragmentation']),
+                  file=file)
+    print('CPU frame time (ms):', file=file)
+    for key, value in results['frame_time_ms'].items():
+        print('  %-24s %10.3f' % (key, value), file=file)
+    print('per frame:', file=file)
+    for key, value in results['per_frame'].items():
+        print('  %-24s %10.1f' % (key, value), file=file)
+    if results.get('streaming'):
+        streaming = results['streaming']
+        print('streaming load:', file=file)
+        print('  %-24s %10.3f' % ('time to first frame (ms)', 1000 * streaming['time_to_first_frame']), file=file)
+        print('  %-24s %10s' % ('load time (ms)', '%.3f' % (1000 * streaming['load_time'])
+                                if streaming['load_time'] is not None else 'incomplete'), file=file)
+        for t, uploaded_bytes, num_uploaded in streaming['timeline']:
+            print('  %10.3f ms: %12d bytes, %6d resources uploaded' % (1000 * t, uploaded_bytes, num_uploaded), file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='command')
+    generate_parser = subparsers.add_parser('generate', help='generate a synthetic glTF scene')
+    generate_parser.add_argument('path', help='output directory')
+    generate_parser.add_argument('--nodes', type=int, default=1000, help='number of nodes')
+    generate_parser.add_argument('--depth', type=int, default=1, help='hierarchy depth (length of the node chains)')
+    generate_parser.add_argument('--meshes', type=int, default=10, help='number of meshes (shared by the nodes)')
+    generate_parser.add_argument('--materials', type=int, default=10, help='number of materials')
+    generate_parser.add_argument('--texture-size', type=int, default=256, help='texture width and height (0: no textures)')
+    generate_parser.add_argument('--segments', type=int, default=16, help='number of segments of the sphere meshes')
+    generate_parser.add_argument('--animated', type=int, default=0,
+                                 help='number of animated nodes (with rotation, translation and scale channels)')
+    generate_parser.add_argument('--seed', type=int, default=0, help='random seed')
+    run_parser = subparsers.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('filename', help='path of glTF (.gltf or .glb) file to render')
+    run_parser.add_argument('--frames', type=int, default=300, help='number of measured frames')
+    run_parser.add_argument('--warmup', type=int, default=10, help='number of unmeasured frames rendered first')
+    run_parser.add_argument('--size', default='800x600', help='framebuffer size (WIDTHxHEIGHT)')
+    run_parser.add_argument('--camera-path', help='camera path recorded by gltfview.py --record-camera-path '
+                                                  '(default: orbit the scene)')
+    run_parser.add_argument('--stereo', help='render both eyes of a simulated HMD', action='store_true')
+    run_parser.add_argument('--finish', help='include GPU time (glFinish) in the frame times', action='store_true')
+    run_parser.add_argument('--streaming', help='upload the resources progressively while rendering (reports the time to '
+                                                'first frame and the load timeline)', action='store_true')
+    run_parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('-v', help='enable verbose logging', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.v else logging.WARNING)
+    if args.command == 'generate':
+        filename = generate_scene(args.path, num_nodes=args.nodes, depth=args.depth, num_meshes=args.meshes,
+                                  num_materials=args.materials, texture_size=args.texture_size,
+                                  segments=args.segments, seed=args.seed, num_animated=args.animated)
+        print('wrote %s' % filename)
+    elif args.command == 'run':
+        width, height = map(int, args.size.split('x'))
+        camera_path = load_camera_path(args.camera_path) if args.camera_path else None
+        results = run_benchmark(args.filename, num_frames=args.frames, warmup_frames=args.warmup,
+                                window_size=(width, height), camera_path=camera_path,
+                                stereo=args.stereo, finish=args.finish, streaming=args.streaming)
+        print_results(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
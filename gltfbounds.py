@@ -0,0 +1,314 @@
+"""Bounding volume utilities: transformation of axis-aligned bounding boxes, view-frustum tests,
+a bounding volume hierarchy for culling large numbers of boxes, and ray tests of boxes and of triangles
+(through a bounding volume hierarchy over the triangles of a mesh, for picking).
+
+Boxes are represented by (N,3) arrays of centers and half-extents, and matrices use the
+row-vector convention of gltfutils (i.e. they are the transposes of the usual column-vector matrices)."""
+import numpy as np
+
+
+def transform_boxes(centers, extents, matrices):
+    """Transforms boxes by the corresponding (N,4,4) matrices,
+    returning the centers and half-extents of the axis-aligned boxes which bound the results."""
+    rotations = matrices[:,:3,:3]
+    world_centers = np.einsum('ni,nij->nj', centers, rotations) + matrices[:,3,:3]
+    world_extents = np.einsum('ni,nij->nj', extents, np.abs(rotations))
+    return world_centers, world_extents
+
+
+def calc_frustum_planes(view_projection_matrix):
+    """Returns the (6,4) array of planes (a, b, c, d) of the view frustum of the given (view x projection) matrix,
+    oriented so that a*x + b*y + c*z + d >= 0 inside the frustum.  The planes are not normalized."""
+    m = view_projection_matrix
+    return np.array([m[:,3] + m[:,0], m[:,3] - m[:,0],
+                     m[:,3] + m[:,1], m[:,3] - m[:,1],
+                     m[:,3] + m[:,2], m[:,3] - m[:,2]], dtype=np.float32)
+
+
+def test_frustum(planes, centers, extents, return_inside=False):
+    """Tests boxes against the given frustum planes, returning a boolean array which is False
+    for boxes lying entirely outside the frustum.  If `return_inside` is True, a second array is returned
+    which is True for boxes lying entirely inside the frustum."""
+    distances = centers.dot(planes[:,:3].T) + planes[:,3]
+    radii = extents.dot(np.abs(planes[:,:3].T))
+    intersecting = (distances + radii >= 0).all(axis=1)
+    if return_inside:
+        return intersecting, (distances - radii >= 0).all(axis=1)
+    return intersecting
+
+
+class BoxTree(object):
+    """Bounding volume hierarchy over a set of boxes, built by recursive median splits of the box centers
+    along the longest axis of their bounds.
+
+    The tree is stored as flat arrays: node i covers the boxes `order[starts[i]:starts[i]+counts[i]]`,
+    and `lefts[i]`, `rights[i]` are the indices of its children (-1 for leaves).
+    When the boxes move, `refit` updates the node bounds without changing the topology."""
+    def __init__(self, centers, extents, leaf_size=32):
+        num_boxes = len(centers)
+        self.order = np.arange(num_boxes)
+        starts, counts, lefts, rights, depths = [0], [num_boxes], [-1], [-1], [0]
+        stack = [0] if num_boxes > leaf_size else []
+        while stack:
+            node = stack.pop()
+            start, count = starts[node], counts[node]
+            indices = self.order[start:start+count]
+            node_centers = centers[indices]
+            axis = np.argmax(node_centers.max(axis=0) - node_centers.min(axis=0))
+            half = count // 2
+            self.order[start:start+count] = indices[np.argpartition(node_centers[:,axis], half)]
+            for child_start, child_count in ((start, half), (start + half, count - half)):
+                child = len(starts)
+                starts.append(child_start)
+                counts.append(child_count)
+                lefts.append(-1)
+                rights.append(-1)
+                depths.append(depths[node] + 1)
+                if child_count > leaf_size:
+                    stack.append(child)
+            lefts[node], rights[node] = len(starts) - 2, len(starts) - 1
+        self.starts = np.array(starts)
+        self.counts = np.array(counts)
+        self.lefts = np.array(lefts)
+        self.rights = np.array(rights)
+        depths = np.array(depths)
+        self._levels = [np.flatnonzero((depths == depth) & (self.lefts != -1))
+                        for depth in range(depths.max() - 1, -1, -1)]
+        leaves = np.flatnonzero(self.lefts == -1)
+        self._leaves = leaves[np.argsort(self.starts[leaves])]
+        self.mins = np.empty((len(starts), 3), dtype=np.float32)
+        self.maxs = np.empty((len(starts), 3), dtype=np.float32)
+        self.refit(centers, extents)
+    def __len__(self):
+        return len(self.starts)
+    def refit(self, centers, extents):
+        """Recomputes the bounds of all tree nodes from the (moved) boxes."""
+        if not len(self.order):
+            self.mins[:] = np.inf
+            self.maxs[:] = -np.inf
+            return
+        ordered_centers, ordered_extents = centers[self.order], extents[self.order]
+        leaf_starts = self.starts[self._leaves]
+        self.mins[self._leaves] = np.minimum.reduceat(ordered_centers - ordered_extents, leaf_starts, axis=0)
+        self.maxs[self._leaves] = np.maximum.reduceat(ordered_centers + ordered_extents, leaf_starts, axis=0)
+        for nodes in self._levels:
+            lefts, rights = self.lefts[nodes], self.rights[nodes]
+            self.mins[nodes] = np.minimum(self.mins[lefts], self.mins[rights])
+            self.maxs[nodes] = np.maximum(self.maxs[lefts], self.maxs[rights])
+    def query_frustum(self, planes, centers, extents):
+        """Returns the (sorted) indices of the boxes which are not entirely outside the frustum with the given planes.
+
+        The tree is traversed breadth-first, testing all nodes of each level at once:
+        nodes entirely inside the frustum contribute all of their boxes without further tests,
+        and the boxes of intersecting leaves are tested individually."""
+        if not len(self.order):
+            return np.zeros(0, dtype=np.intp)
+        accepted = []
+        frontier = np.zeros(1, dtype=np.intp)
+        while len(frontier):
+            node_centers = 0.5 * (self.mins[frontier] + self.maxs[frontier])
+            node_extents = 0.5 * (self.maxs[frontier] - self.mins[frontier])
+            intersecting, inside = test_frustum(planes, node_centers, node_extents, return_inside=True)
+            for node in frontier[inside]:
+                accepted.append(self.order[self.starts[node]:self.starts[node]+self.counts[node]])
+            frontier = frontier[intersecting & ~inside]
+            is_leaf = self.lefts[frontier] == -1
+            for node in frontier[is_leaf]:
+                indices = self.order[self.starts[node]:self.starts[node]+self.counts[node]]
+                accepted.append(indices[test_frustum(planes, centers[indices], extents[indices])])
+            frontier = frontier[~is_leaf]
+            frontier = np.concatenate([self.lefts[frontier], self.rights[frontier]])
+        if not accepted:
+            return np.zeros(0, dtype=np.intp)
+        return np.sort(np.concatenate(accepted))
+
+
+def intersect_ray_boxes(origin, direction, centers, extents):
+    """Returns the distances (in units of the length of `direction`) along the ray from `origin` at which it enters
+    each of the given boxes (0 for boxes containing the origin), or inf for boxes which the ray misses."""
+    entries, exits = _intersect_ray_bounds(_setup_ray(origin, direction),
+                                           np.concatenate([centers - extents, centers + extents], axis=1))
+    return np.where(entries <= exits, entries, np.inf)
+
+
+def _setup_ray(origin, direction):
+    """Returns the columns of (N,6) box bounds (min corners, then max corners) which bound the slabs of each axis
+    on the near and far side of the ray, and the ray's origin and inverse direction components for those columns."""
+    direction = np.asarray(direction, dtype=np.float32)
+    # zero components are replaced by tiny ones, so that slab distances are huge rather than NaN:
+    inverse_direction = 1 / np.where(direction == 0, np.float32(1e-30), direction)
+    near_columns = np.where(direction >= 0, [0, 1, 2], [3, 4, 5])
+    return (np.concatenate([near_columns, (near_columns + 3) % 6]),
+            np.tile(np.asarray(origin, dtype=np.float32), 2), np.tile(inverse_direction, 2))
+
+
+def _intersect_ray_bounds(ray, bounds):
+    """Slab test of (N,6) box bounds: returns the entry and exit distances of the ray set up by `_setup_ray`
+    (entries being clamped to 0), the ray missing the boxes whose exit precedes their entry."""
+    columns, origins, inverse_directions = ray
+    t = (bounds[:,columns] - origins) * inverse_directions
+    entries = np.maximum(np.maximum(t[:,0], t[:,1]), np.maximum(t[:,2], 0))
+    exits = np.minimum(np.minimum(t[:,3], t[:,4]), t[:,5])
+    return entries, exits
+
+
+def intersect_ray_triangles(origin, direction, v0, v1, v2):
+    """Returns the distances (in units of the length of `direction`) along the ray from `origin` at which it hits
+    each of the triangles with (N,3) vertices v0, v1, v2 (from either side), or inf for triangles which it misses.
+
+    This is the Moller-Trumbore test, with the cross products taken with the (fixed) direction, as products with its
+    cross product matrix, and the distances found from the barycentric coordinates of the hits."""
+    direction = np.asarray(direction, dtype=np.float32)
+    dx, dy, dz = direction.tolist()
+    direction_cross = np.array([[0, dz, -dy], [-dz, 0, dx], [dy, -dx, 0]], dtype=np.float32)
+    e1 = v1 - v0
+    e2 = v2 - v0
+    s = origin - v0
+    p = e2.dot(direction_cross)
+    determinants = (e1 * p).sum(axis=1)
+    inverse_determinants = 1 / np.where(determinants == 0, np.float32(np.inf), determinants)
+    u = (s * p).sum(axis=1) * inverse_determinants
+    v = (e1 * s.dot(direction_cross)).sum(axis=1) * inverse_determinants
+    t = (u * e1.dot(direction) + v * e2.dot(direction) - s.dot(direction)) / direction.dot(direction)
+    hit = (determinants != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+
+def _calc_morton_codes(points):
+    """Returns the 63-bit Morton codes of (N,3) points, quantized to a cubic grid of 2**21 cells per side over their bounds."""
+    if not len(points):
+        return np.zeros(0, dtype=np.uint64)
+    mins = points.min(axis=0).astype(np.float64)
+    extent = (points.max(axis=0) - mins).max()
+    scale = (2**21 - 1) / extent if extent > 0 else 0.0
+    cells = ((points - mins) * scale).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for axis in range(3):
+        x = cells[:,axis]
+        # spreads the 21 bits of x to every third bit:
+        for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                            (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+            x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+        codes |= x << np.uint64(axis)
+    return codes
+
+
+class TriangleTree(object):
+    """Bounding volume hierarchy over the triangles of a mesh, for ray queries (see `intersect_ray`).
+
+    The triangles are sorted by the Morton codes of their centroids (on a cubic grid over the centroid bounds),
+    and each node is split at the highest bit in which the codes of its triangles differ, i.e. at the midpoint of
+    the smallest grid cell containing all of its centroids (or at its median triangle, if their codes are all equal).
+    Since the codes are sorted, the splits of all nodes of a level are found at once by a binary search.
+
+    As in `BoxTree`, node i covers the triangles `triangles[starts[i]:starts[i]+counts[i]]`
+    (`order` holds their indices in the original (T,3) index array), and has the children `lefts[i]` and
+    `lefts[i] + 1` (`lefts[i]` is -1 for leaves).
+
+    Queries expand only the inner nodes at depths which are multiples of `wide_levels`, each into the row
+    `wide_rows[i]` of `wide_children`: its (up to 2**wide_levels) descendants `wide_levels` levels below,
+    or its leaves above that level (-1 padded), so that they take a fraction of the steps of a binary traversal."""
+    def __init__(self, positions, triangles, leaf_size=8, wide_levels=4):
+        positions = np.ascontiguousarray(positions, dtype=np.float32)
+        triangles = np.asarray(triangles).reshape(-1, 3).astype(np.intp)
+        num_triangles = len(triangles)
+        p0, p1, p2 = (np.take(positions, triangles[:,k], axis=0) for k in range(3))
+        triangle_mins = np.minimum(np.minimum(p0, p1), p2)
+        triangle_maxs = np.maximum(np.maximum(p0, p1), p2)
+        del p0, p1, p2
+        codes = _calc_morton_codes(0.5 * (triangle_mins + triangle_maxs))
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        starts, counts = [np.zeros(1, dtype=np.intp)], [np.array([num_triangles], dtype=np.intp)]
+        levels = []
+        num_nodes = 1
+        is_split = counts[0] > leaf_size
+        nodes, node_starts, node_counts = np.zeros(1, dtype=np.intp)[is_split], starts[0][is_split], counts[0][is_split]
+        while len(nodes):
+            node_ends = node_starts + node_counts
+            differences = codes[node_starts] ^ codes[node_ends - 1]
+            # highest differing bits (correcting the rounding of the float64 logarithms):
+            bits = np.floor(np.log2(np.maximum(differences, 1).astype(np.float64))).astype(np.uint64)
+            bits[((differences >> bits) == 0) & (differences != 0)] -= np.uint64(1)
+            bits[(differences >> bits) > 1] += np.uint64(1)
+            splits = np.where(differences == 0, node_starts + node_counts // 2,
+                              np.searchsorted(codes, (codes[node_ends - 1] >> bits) << bits))
+            children = num_nodes + 2 * np.arange(len(nodes))
+            levels.append((nodes, children))
+            child_starts = np.stack([node_starts, splits], axis=1).ravel()
+            child_counts = np.stack([splits - node_starts, node_ends - splits], axis=1).ravel()
+            starts.append(child_starts)
+            counts.append(child_counts)
+            is_split = child_counts > leaf_size
+            nodes = np.arange(num_nodes, num_nodes + len(child_starts))[is_split]
+            node_starts, node_counts = child_starts[is_split], child_counts[is_split]
+            num_nodes += len(child_starts)
+        self.starts = np.concatenate(starts)
+        self.counts = np.concatenate(counts)
+        depths = np.repeat(np.arange(len(counts)), [len(level_counts) for level_counts in counts])
+        self.lefts = np.full(num_nodes, -1, dtype=np.intp)
+        for parents, children in levels:
+            self.lefts[parents] = children
+        self.order = order
+        self.positions = positions
+        self.triangles = np.take(triangles, order, axis=0)
+        # node bounds: those of the leaves are reduced over their triangles, then merged up the levels:
+        self.bounds = np.empty((num_nodes, 6), dtype=np.float32)
+        self.mins, self.maxs = self.bounds[:,:3], self.bounds[:,3:]
+        if num_triangles:
+            leaves = np.flatnonzero(self.lefts == -1)
+            leaves = leaves[np.argsort(self.starts[leaves])]
+            self.mins[leaves] = np.minimum.reduceat(np.take(triangle_mins, order, axis=0), self.starts[leaves], axis=0)
+            self.maxs[leaves] = np.maximum.reduceat(np.take(triangle_maxs, order, axis=0), self.starts[leaves], axis=0)
+        else:
+            self.mins[:] = np.inf
+            self.maxs[:] = -np.inf
+        for parents, children in reversed(levels):
+            self.mins[parents] = np.minimum(self.mins[children], self.mins[children + 1])
+            self.maxs[parents] = np.maximum(self.maxs[children], self.maxs[children + 1])
+        # the children of each node (a leaf standing for itself), with a final row of -1 for missing children:
+        child_pairs = np.full((num_nodes + 1, 2), -1, dtype=np.int32)
+        is_leaf = self.lefts == -1
+        child_pairs[:-1,0] = np.where(is_leaf, np.arange(num_nodes), self.lefts)
+        child_pairs[:-1,1] = np.where(is_leaf, -1, self.lefts + 1)
+        wide_nodes = np.flatnonzero(~is_leaf & (depths % wide_levels == 0))
+        wide_children = child_pairs[wide_nodes]
+        for level in range(2, wide_levels + 1):
+            wide_children = child_pairs[wide_children].reshape(len(wide_nodes), 2**level)
+        self.wide_rows = np.full(num_nodes, -1, dtype=np.int32)
+        self.wide_rows[wide_nodes] = np.arange(len(wide_nodes))
+        self.wide_children = wide_children
+    def __len__(self):
+        return len(self.starts)
+    def intersect_ray(self, origin, direction, max_distance=np.inf):
+        """Returns the (distance, triangle index) of the nearest hit of the ray from `origin` along `direction`
+        (distances being in units of its length), or None if it hits no triangle closer than `max_distance`.
+
+        The tree is traversed breadth-first, testing the boxes of all nodes reached at once, and the triangles
+        of all leaves reached at once; nodes farther than the nearest hit found so far are skipped."""
+        origin = np.asarray(origin, dtype=np.float32)
+        direction = np.asarray(direction, dtype=np.float32)
+        ray = _setup_ray(origin, direction)
+        nearest, nearest_triangle = max_distance, -1
+        nodes = np.zeros(min(len(self.order), 1), dtype=np.intp)
+        while len(nodes):
+            entries, exits = _intersect_ray_bounds(ray, self.bounds[nodes])
+            nodes = nodes[(entries <= exits) & (entries <= nearest)]
+            rows = self.wide_rows[nodes]
+            is_leaf = rows < 0
+            if is_leaf.any():
+                leaves = nodes[is_leaf]
+                leaf_counts = self.counts[leaves]
+                triangles = (np.repeat(self.starts[leaves] - np.cumsum(leaf_counts) + leaf_counts, leaf_counts)
+                             + np.arange(leaf_counts.sum()))
+                corners = self.positions[self.triangles[triangles]]
+                distances = intersect_ray_triangles(origin, direction, corners[:,0], corners[:,1], corners[:,2])
+                i = np.argmin(distances)
+                if distances[i] < nearest:
+                    nearest, nearest_triangle = float(distances[i]), triangles[i]
+                rows = rows[~is_leaf]
+            nodes = self.wide_children[rows].ravel()
+            nodes = nodes[nodes >= 0]
+        if nearest_triangle < 0:
+            return None
+        return nearest, int(self.order[nearest_triangle])
@@ -0,0 +1,428 @@
+"""Loader pipeline for the resources (shaders, images and buffers) of a glTF.
+
+Loading and decoding (file I/O, base64 decoding, image decompression and hashing) is done concurrently
+by a pool of worker threads - PIL and zlib release the GIL while decoding - and each decoded
+item is put on a queue.  The calling thread, which must be the thread owning the GL context,
+consumes the queue and creates the GL objects for each item as soon as it is ready.
+
+`StreamingLoader` instead spreads the uploads over the frames of a render loop, which starts right away."""
+import os
+import time
+import hashlib
+import queue
+from ctypes import c_void_p
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import numpy as np
+import OpenGL.GL as gl
+
+import gltfutils as gltfu
+import glarena
+from glstate import state as glstate
+
+
+_logger = logging.getLogger(__name__)
+
+# default budgets of the uploads which a StreamingLoader does per frame (at least one upload is done per frame):
+STREAMING_FRAME_BYTES = 8 * 2**20
+STREAMING_FRAME_SECONDS = 0.004
+# bufferViews are uploaded in chunks of at most this many bytes, so that large bufferViews are spread over several frames:
+STREAMING_CHUNK_SIZE = 2**20
+# color of the bounding boxes which are drawn in place of records whose data has not been uploaded yet:
+PLACEHOLDER_COLOR = (0.6, 0.6, 0.6, 1.0)
+
+
+def _decode(results, kind, name, load, *args):
+    t = time.perf_counter()
+    try:
+        results.put((kind, name, load(*args), time.perf_counter() - t, None))
+    except Exception as err:
+        results.put((kind, name, None, time.perf_counter() - t, err))
+
+
+def _load_texture_pixels(gltf, image_name, uri_path, texture_names):
+    pil_image = gltfu.load_image(gltf, image_name, uri_path)
+    texture_pixels = {}
+    for texture_name in texture_names:
+        pixels = gltfu.get_texture_pixels(gltf, texture_name, pil_image)
+        texture_pixels[texture_name] = (pixels, hashlib.sha1(pixels).digest())
+    return texture_pixels
+
+
+def load_resources(gltf, uri_path, max_workers=None):
+    """Loads, decodes and uploads all shaders, programs, textures and buffers of the given gltf.
+
+    Equivalent to calling `gltfutils.load_shaders`, `setup_programs`, `setup_textures` and `setup_buffers`,
+    with all decoding overlapped with the GL uploads.
+    Returns a dict of per-stage timings (in seconds): the decode times are the total time spent by
+    the worker threads, the remaining stages are measured on the calling thread
+    ('wait' being the time it spent waiting for decoded items)."""
+    t0 = time.perf_counter()
+    timings = defaultdict(float)
+    programs = gltf.get('programs', {})
+    programs_by_shader = defaultdict(list)
+    for program_name, program in programs.items():
+        programs_by_shader[program['vertexShader']].append(program_name)
+        programs_by_shader[program['fragmentShader']].append(program_name)
+    textures_by_image = defaultdict(list)
+    for texture_name, texture in gltf.get('textures', {}).items():
+        textures_by_image[texture['source']].append(texture_name)
+    bufferViews_by_buffer = defaultdict(list)
+    for bufferView_name, bufferView in gltf.get('bufferViews', {}).items():
+        if 'target' in bufferView:
+            bufferViews_by_buffer[bufferView['buffer']].append(bufferView_name)
+    shader_sources = {}
+    results = queue.Queue()
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        num_pending = 0
+        for image_name in gltf.get('images', {}).keys():
+            executor.submit(_decode, results, 'images', image_name, _load_texture_pixels, gltf, image_name, uri_path,
+                            textures_by_image[image_name])
+            num_pending += 1
+        for shader_name in gltf.get('shaders', {}).keys():
+            executor.submit(_decode, results, 'shaders', shader_name, gltfu.load_shader_source, gltf, shader_name, uri_path)
+            num_pending += 1
+        for buffer_name in gltf.get('buffers', {}).keys():
+            executor.submit(_decode, results, 'buffers', buffer_name, gltfu.load_buffer, gltf, buffer_name, uri_path)
+            num_pending += 1
+        while num_pending:
+            t = time.perf_counter()
+            kind, name, result, decode_time, err = results.get()
+            num_pending -= 1
+            timings['wait'] += time.perf_counter() - t
+            if err is not None:
+                raise Exception('failed to load %s "%s": %s' % (kind[:-1], name, err))
+            timings['%s: decode' % kind] += decode_time
+            t = time.perf_counter()
+            if kind == 'shaders':
+                shader_sources[name] = result
+                for program_name in programs_by_shader[name]:
+                    program = programs[program_name]
+                    if program['vertexShader'] in shader_sources and program['fragmentShader'] in shader_sources:
+                        gltfu.setup_program(gltf, program_name, shader_sources)
+                timings['programs: setup'] += time.perf_counter() - t
+            elif kind == 'images':
+                for texture_name, (pixels, content_hash) in result.items():
+                    gltfu.setup_texture(gltf, texture_name, pixels, content_hash=content_hash)
+                timings['textures: upload'] += time.perf_counter() - t
+            elif kind == 'buffers':
+                for bufferView_name in bufferViews_by_buffer[name]:
+                    gltfu.setup_buffer(gltf, bufferView_name)
+                timings['buffers: upload'] += time.perf_counter() - t
+    timings['total'] = time.perf_counter() - t0
+    return timings
+
+
+_placeholder_vertex_shader = """uniform mat4 u_viewMatrix;
+uniform mat4 u_projectionMatrix;
+attribute vec3 a_position;
+void main(void) {
+  gl_Position = u_projectionMatrix * (u_viewMatrix * vec4(a_position, 1.0));
+}"""
+
+
+_placeholder_fragment_shader = """uniform vec4 u_color;
+void main(void) {
+  gl_FragColor = u_color;
+}"""
+
+
+# the corners of a box (as signs of its extents) and the pairs of corners of its 12 edges:
+_BOX_CORNERS = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+_BOX_EDGES = np.array([0, 1, 2, 3, 4, 5, 6, 7, 0, 2, 1, 3, 4, 6, 5, 7, 0, 4, 1, 5, 2, 6, 3, 7])
+
+
+class PlaceholderDrawer(object):
+    """Draws the edges of world-space bounding boxes with a single draw call (streaming their vertices each time)."""
+    def __init__(self):
+        shader_ids = []
+        for shader_type, shader_str in ((gl.GL_VERTEX_SHADER, _placeholder_vertex_shader),
+                                        (gl.GL_FRAGMENT_SHADER, _placeholder_fragment_shader)):
+            shader_id = gl.glCreateShader(shader_type)
+            gl.glShaderSource(shader_id, shader_str)
+            gl.glCompileShader(shader_id)
+            if not gl.glGetShaderiv(shader_id, gl.GL_COMPILE_STATUS):
+                raise Exception('failed to compile placeholder shader:\n%s' % gl.glGetShaderInfoLog(shader_id).decode())
+            shader_ids.append(shader_id)
+        program_id = gl.glCreateProgram()
+        for shader_id in shader_ids:
+            gl.glAttachShader(program_id, shader_id)
+        gl.glLinkProgram(program_id)
+        for shader_id in shader_ids:
+            gl.glDetachShader(program_id, shader_id)
+        if not gl.glGetProgramiv(program_id, gl.GL_LINK_STATUS):
+            raise Exception('failed to link placeholder program')
+        self._program_id = program_id
+        self._position_location = gl.glGetAttribLocation(program_id, 'a_position')
+        self._uniform_locations = {uniform: gl.glGetUniformLocation(program_id, uniform)
+                                   for uniform in ['u_viewMatrix', 'u_projectionMatrix', 'u_color']}
+        self._buffer = gl.glGenBuffers(1)
+        self._vao = gl.glGenVertexArrays(1)
+        glstate.bind_vertex_array(self._vao)
+        glstate.bind_buffer(gl.GL_ARRAY_BUFFER, self._buffer)
+        gl.glEnableVertexAttribArray(self._position_location)
+        gl.glVertexAttribPointer(self._position_location, 3, gl.GL_FLOAT, False, 12, c_void_p(0))
+        glstate.bind_vertex_array(0)
+    def draw_boxes(self, centers, extents, projection_matrix, view_matrix, color=PLACEHOLDER_COLOR):
+        """Draws the edges of the boxes with the given (N,3) centers and extents (half sizes)."""
+        if not len(centers):
+            return
+        vertices = (centers[:,np.newaxis] + extents[:,np.newaxis] * _BOX_CORNERS)[:,_BOX_EDGES].astype(np.float32)
+        glstate.use_program(self._program_id)
+        gl.glUniformMatrix4fv(self._uniform_locations['u_viewMatrix'], 1, False, view_matrix)
+        gl.glUniformMatrix4fv(self._uniform_locations['u_projectionMatrix'], 1, False, projection_matrix)
+        gl.glUniform4f(self._uniform_locations['u_color'], *color)
+        glstate.bind_vertex_array(self._vao)
+        glstate.bind_buffer(gl.GL_ARRAY_BUFFER, self._buffer)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, vertices.nbytes, vertices, gl.GL_STREAM_DRAW)
+        glstate.enable(gl.GL_DEPTH_TEST)
+        gl.glDrawArrays(gl.GL_LINES, 0, vertices.size // 3)
+        glstate.bind_vertex_array(0)
+
+
+def _get_placeholder_pixels(texture):
+    # a single opaque light grey pixel of the texture's format and type
+    mode = gltfu.GLTF_TEXTURE_FORMAT_MODES[texture.get('format', gl.GL_RGBA)]
+    dtype = np.ushort if texture.get('type', gl.GL_UNSIGNED_BYTE) == gl.GL_UNSIGNED_SHORT else np.ubyte
+    return np.full((1, 1, len(mode)) if len(mode) > 1 else (1, 1), np.iinfo(dtype).max * 3 // 4, dtype=dtype)
+
+
+class StreamingLoader(object):
+    """Loads the resources of a glTF progressively, so that it can be rendered while it loads.
+
+    On construction, the shaders are loaded and the programs linked, the buffers are mapped (see
+    `gltfutils.load_buffer`), buffer objects (or arena ranges) are allocated for all bufferViews without uploading
+    their data, each texture is created with a placeholder image of a single grey pixel, and the images are
+    decoded by a pool of worker threads.  The vertex array objects, binding plans and draw list can thus be created
+    at once; the draw list is then passed to `attach`.
+
+    Each frame, `update` uploads bufferView chunks and decoded images, in order of priority, until the frame's byte
+    or time budget is spent: resources used by records in view come first, then those of records with the largest
+    projected size of their bounds (i.e. near and large ones).  Data is written to a `glarena.StagingBuffer`
+    and copied from it by the GL (as the GL_PIXEL_UNPACK_BUFFER of texture uploads), so that uploads do not stall.
+    Records are `enabled` (drawn) as soon as all of their vertex and index data has been uploaded (with placeholder
+    textures until theirs are uploaded); `draw_placeholders` draws the bounding boxes of the others.
+    Decoded images are deduplicated like those of `gltfutils.setup_texture`: a texture whose content has already
+    been uploaded reuses that texture object instead of its placeholder.
+
+    Metrics: `time_to_first_frame` and `load_time` (seconds from construction to the end of the first frame, as
+    marked by `end_frame`, and to the completion of all uploads), and `timeline`, a list of (seconds since construction,
+    bytes uploaded, resources uploaded) tuples, one per frame."""
+    def __init__(self, gltf, uri_path, max_workers=None,
+                 frame_bytes=STREAMING_FRAME_BYTES, frame_seconds=STREAMING_FRAME_SECONDS):
+        self.start_time = time.perf_counter()
+        self.gltf = gltf
+        self.frame_bytes = frame_bytes
+        self.frame_seconds = frame_seconds
+        self.timings = defaultdict(float)
+        t = time.perf_counter()
+        gltfu.load_buffers(gltf, uri_path)
+        self.timings['buffers: map'] = time.perf_counter() - t
+        t = time.perf_counter()
+        shader_sources = gltfu.load_shaders(gltf, uri_path)
+        gltfu.setup_programs(gltf, shader_sources)
+        self.timings['programs: setup'] = time.perf_counter() - t
+        t = time.perf_counter()
+        self.bufferView_names = [bufferView_name for bufferView_name, bufferView in gltf.get('bufferViews', {}).items()
+                                 if 'target' in bufferView]
+        for bufferView_name in self.bufferView_names:
+            gltfu.allocate_buffer(gltf, bufferView_name)
+        self.bufferView_sizes = np.array([gltf['bufferViews'][bufferView_name]['byteLength']
+                                          for bufferView_name in self.bufferView_names], dtype=np.int64)
+        self.bufferView_uploaded = np.zeros(len(self.bufferView_names), dtype=np.int64)
+        self.timings['buffers: allocate'] = time.perf_counter() - t
+        t = time.perf_counter()
+        textures = gltf.get('textures', {})
+        self.texture_names = list(textures.keys())
+        for texture_name in self.texture_names:
+            gltfu.create_texture(gltf, texture_name)
+            gltfu.upload_texture_image(gltf, texture_name, _get_placeholder_pixels(textures[texture_name]))
+        self.texture_uploaded = np.zeros(len(self.texture_names), dtype=np.bool_)
+        self.timings['textures: placeholders'] = time.perf_counter() - t
+        self._texture_indices = {texture_name: i for i, texture_name in enumerate(self.texture_names)}
+        self._decoded = {}
+        self._results = queue.Queue()
+        textures_by_image = defaultdict(list)
+        for texture_name, texture in textures.items():
+            textures_by_image[texture['source']].append(texture_name)
+        self._num_pending_images = len(textures_by_image)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        for image_name, texture_names in textures_by_image.items():
+            self._executor.submit(_decode, self._results, 'images', image_name, _load_texture_pixels,
+                                  gltf, image_name, uri_path, texture_names)
+        self._staging_buffer = glarena.StagingBuffer()
+        self._placeholder_drawer = None
+        self.draw_list = None
+        self.uploaded_bytes = 0
+        self.time_to_first_frame = None
+        self.load_time = None
+        self.timeline = []
+        self.timings['setup'] = time.perf_counter() - self.start_time
+    @property
+    def num_resources(self):
+        return len(self.bufferView_names) + len(self.texture_names)
+    @property
+    def num_uploaded(self):
+        return (int(np.count_nonzero(self.bufferView_uploaded == self.bufferView_sizes))
+                + int(np.count_nonzero(self.texture_uploaded)))
+    @property
+    def complete(self):
+        return self.load_time is not None
+    def attach(self, draw_list):
+        """Sets the draw list (compiled from the gltf) whose records prioritize the uploads and are enabled
+        once their data is uploaded."""
+        gltf = self.gltf
+        bufferView_indices = {bufferView_name: i for i, bufferView_name in enumerate(self.bufferView_names)}
+        num_bufferViews = len(self.bufferView_names)
+        # (record, resource) pairs, where resources are the bufferViews followed by the textures:
+        pair_records, pair_resources = [], []
+        for i, primitive in enumerate(draw_list.primitives):
+            accessor_names = (list(primitive['attributes'].values()) + [primitive['indices']] +
+                              [lod['indices'] for lod in primitive.get('extras', {}).get('lods', [])])
+            resources = {bufferView_indices[gltf['accessors'][accessor_name]['bufferView']]
+                         for accessor_name in accessor_names}
+            material = gltf['materials'][primitive['material']]
+            technique = gltf['techniques'][material['technique']]
+            for parameter_name, parameter in technique['parameters'].items():
+                if parameter['type'] == gl.GL_SAMPLER_2D:
+                    texture_name = material.get('values', {}).get(parameter_name, parameter.get('value'))
+                    if texture_name in self._texture_indices:
+                        resources.add(num_bufferViews + self._texture_indices[texture_name])
+            pair_records.extend([i] * len(resources))
+            pair_resources.extend(sorted(resources))
+        self._pair_records = np.array(pair_records, dtype=np.intp)
+        self._pair_resources = np.array(pair_resources, dtype=np.intp)
+        self._buffer_pairs = self._pair_resources < num_bufferViews
+        self.draw_list = draw_list
+        self._update_enabled()
+    def _update_enabled(self):
+        complete = self.bufferView_uploaded == self.bufferView_sizes
+        missing = np.zeros(len(self.draw_list), dtype=np.intp)
+        np.add.at(missing, self._pair_records[self._buffer_pairs], ~complete[self._pair_resources[self._buffer_pairs]])
+        self.draw_list.enabled[:] = missing == 0
+    def _calc_priorities(self, projection_matrix, view_matrix):
+        # returns the priority of each resource: the largest priority of the records using it, which is the projected
+        # size of their bounding sphere (see `gltfutils.DrawList.select_lods`), raised above all others for records in view
+        draw_list = self.draw_list
+        in_view = np.zeros(len(draw_list), dtype=np.bool_)
+        in_view[draw_list.cull(projection_matrix, view_matrix)] = True
+        if view_matrix.ndim == 3:
+            projection_matrix, view_matrix = projection_matrix[0], view_matrix.mean(axis=0)
+        radii = np.linalg.norm(draw_list.world_extents, axis=1)
+        depths = -(draw_list.world_centers.dot(view_matrix[:3,2]) + view_matrix[3,2])
+        sizes = np.where(depths > radii, radii * abs(projection_matrix[1,1]) / np.maximum(depths, 1e-6), 1.0)
+        record_priorities = np.minimum(sizes, 1.0) + 2.0 * in_view
+        priorities = np.full(self.num_resources, -1.0)
+        np.maximum.at(priorities, self._pair_resources, record_priorities[self._pair_records])
+        return priorities
+    def _receive_images(self):
+        # collects the images which have been decoded since the last call
+        while self._num_pending_images:
+            try:
+                kind, name, result, decode_time, err = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._num_pending_images -= 1
+            if err is not None:
+                raise Exception('failed to load %s "%s": %s' % (kind[:-1], name, err))
+            self.timings['images: decode'] += decode_time
+            self._decoded.update(result)
+    def _reuse_texture(self, texture_name, texture_id):
+        # replaces the placeholder texture by an uploaded texture with the same content (see `gltfutils.setup_texture`),
+        # in the binding plans which were compiled from the placeholder:
+        texture = self.gltf['textures'][texture_name]
+        placeholder_id = texture['id']
+        texture['id'] = texture_id
+        binding_plans = [material['binding_plan'] for material in self.gltf.get('materials', {}).values()
+                         if 'binding_plan' in material]
+        if self.draw_list is not None:
+            binding_plans.extend(self.draw_list.binding_plans)
+        for binding_plan in binding_plans:
+            binding_plan.texture_bindings[:] = [(unit, target, texture_id if bound_id == placeholder_id else bound_id, sampler_id)
+                                                for unit, target, bound_id, sampler_id in binding_plan.texture_bindings]
+        glstate.delete_texture(placeholder_id)
+        _logger.debug('* reused texture for "%s"', texture_name)
+    def update(self, projection_matrix, view_matrix):
+        """Uploads pending data, in order of priority for the given view(s), until the frame's budget is spent.
+        Returns the number of bytes uploaded."""
+        if self.complete:
+            return 0
+        t0 = time.perf_counter()
+        self._receive_images()
+        num_bufferViews = len(self.bufferView_names)
+        if self.draw_list is not None:
+            priorities = self._calc_priorities(projection_matrix, view_matrix)
+        else:
+            priorities = np.zeros(self.num_resources)
+        pending = np.concatenate([self.bufferView_uploaded < self.bufferView_sizes,
+                                  [texture_name in self._decoded for texture_name in self.texture_names]])
+        candidates = np.flatnonzero(pending)
+        candidates = candidates[np.argsort(-priorities[candidates], kind='stable')]
+        uploaded_bytes = 0
+        completed_bufferViews = False
+        for resource in candidates.tolist():
+            if uploaded_bytes and (uploaded_bytes >= self.frame_bytes or time.perf_counter() - t0 >= self.frame_seconds):
+                break
+            if resource < num_bufferViews:
+                bufferView_name = self.bufferView_names[resource]
+                bufferView = self.gltf['bufferViews'][bufferView_name]
+                data = gltfu.get_bufferView_data(self.gltf, bufferView_name)
+                while self.bufferView_uploaded[resource] < self.bufferView_sizes[resource]:
+                    start = int(self.bufferView_uploaded[resource])
+                    chunk = data[start:start+min(STREAMING_CHUNK_SIZE, max(self.frame_bytes - uploaded_bytes, 1))]
+                    self._staging_buffer.copy_to(bufferView['id'], bufferView.get('arena_offset', 0) + start, chunk)
+                    self.bufferView_uploaded[resource] += len(chunk)
+                    uploaded_bytes += len(chunk)
+                    if uploaded_bytes >= self.frame_bytes or time.perf_counter() - t0 >= self.frame_seconds:
+                        break
+                completed_bufferViews |= bool(self.bufferView_uploaded[resource] == self.bufferView_sizes[resource])
+            else:
+                texture_name = self.texture_names[resource - num_bufferViews]
+                pixels, content_hash = self._decoded.pop(texture_name)
+                key = gltfu.get_texture_key(self.gltf, texture_name, pixels, content_hash=content_hash)
+                if key in gltfu.setup_texture.texture_ids:
+                    self._reuse_texture(texture_name, gltfu.setup_texture.texture_ids[key])
+                else:
+                    offset = self._staging_buffer.stage(pixels)
+                    glstate.bind_buffer(gl.GL_PIXEL_UNPACK_BUFFER, self._staging_buffer.id)
+                    gltfu.upload_texture_image(self.gltf, texture_name, pixels, unpack_offset=offset)
+                    glstate.bind_buffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+                    gltfu.setup_texture.texture_ids[key] = self.gltf['textures'][texture_name]['id']
+                    uploaded_bytes += pixels.nbytes
+                self.texture_uploaded[resource - num_bufferViews] = True
+        self.uploaded_bytes += uploaded_bytes
+        if completed_bufferViews and self.draw_list is not None:
+            self._update_enabled()
+        self.timings['uploads'] += time.perf_counter() - t0
+        if self.num_uploaded == self.num_resources:
+            self.load_time = time.perf_counter() - self.start_time
+            self._executor.shutdown(wait=False)
+            _logger.info('* streaming load complete: %d bytes uploaded in %.3f seconds (first frame after %.3f seconds)',
+                         self.uploaded_bytes, self.load_time, self.time_to_first_frame or 0.0)
+        return uploaded_bytes
+    def draw_placeholders(self, projection_matrix, view_matrix):
+        """Draws the bounding boxes of the bounded records which are not enabled yet."""
+        draw_list = self.draw_list
+        if self.complete or draw_list is None:
+            return
+        pending = np.flatnonzero(~draw_list.enabled & draw_list.bounded)
+        if not len(pending):
+            return
+        if self._placeholder_drawer is None:
+            self._placeholder_drawer = PlaceholderDrawer()
+        draw_list.update_world_bounds()
+        self._placeholder_drawer.draw_boxes(draw_list.world_centers[pending], draw_list.world_extents[pending],
+                                            projection_matrix, view_matrix)
+    def end_frame(self):
+        """Marks the end of a frame, adding it to the `timeline` (and setting `time_to_first_frame` for the first)."""
+        t = time.perf_counter() - self.start_time
+        if self.time_to_first_frame is None:
+            self.time_to_first_frame = t
+        if self.timeline and self.timeline[-1][2] == self.num_resources:
+            # (the timeline ends with the frame which completed the load)
+            return
+        self.timeline.append((t, self.uploaded_bytes, self.num_uploaded))
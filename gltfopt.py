@@ -0,0 +1,497 @@
+"""Optimizes the triangle meshes of a glTF file for rendering.
+
+Duplicate vertices are welded, triangles are reordered for the post-transform vertex cache (following Tom Forsyth's
+"Linear-Speed Vertex Cache Optimisation") and vertices for fetch locality (in order of first use), the attributes
+of each primitive are interleaved into a single strided bufferView and indices are narrowed to 16 bits where possible.
+Optionally, simplified index buffers (levels of detail) are generated for each primitive by quadric error metric
+edge collapses (Garland and Heckbert, "Surface Simplification Using Quadric Error Metrics"), sharing the
+primitive's vertices.  The optimized glTF is written with a single binary buffer:
+
+    python gltfopt.py scene.gltf -o scene_opt.gltf --lod 0.5 0.25 0.125
+"""
+import os.path
+import copy
+import json
+import argparse
+import logging
+from collections import deque
+
+import numpy as np
+import OpenGL.GL as gl
+
+import gltfutils as gltfu
+
+
+_logger = logging.getLogger(__name__)
+
+# parameters of the vertex scoring function of Forsyth's algorithm:
+FORSYTH_CACHE_SIZE = 32
+FORSYTH_LAST_TRIANGLE_SCORE = 0.75
+FORSYTH_CACHE_DECAY_POWER = 1.5
+FORSYTH_VALENCE_BOOST_SCALE = 2.0
+FORSYTH_VALENCE_BOOST_POWER = 0.5
+# size of the FIFO vertex cache with which the average cache miss ratios (ACMR) are measured:
+ACMR_CACHE_SIZE = 16
+# largest vertex index which may be stored in 16 bits (the largest value is reserved for primitive restart):
+MAX_UINT16_INDEX = 0xfffe
+# weight (relative to the squared edge length) of the quadrics which keep boundary edges in place:
+QEM_BOUNDARY_WEIGHT = 100.0
+# collapses which rotate the normal of any of the triangles they change by more than this (cosine) are rejected:
+QEM_MIN_NORMAL_COSINE = 0.2
+
+
+def weld_vertices(attributes, indices):
+    """Merges vertices whose attributes are bitwise identical and removes the triangles which become degenerate.
+
+    `attributes` is a dict of (N, ...) arrays.  Returns the welded attributes and the remapped triangle indices."""
+    num_vertices = len(next(iter(attributes.values())))
+    keys = np.concatenate([np.ascontiguousarray(data).reshape(num_vertices, -1).view(np.ubyte).reshape(num_vertices, -1)
+                           for data in attributes.values()], axis=1)
+    keys = np.ascontiguousarray(keys).view(np.dtype((np.void, keys.shape[1]))).ravel()
+    _, first, remap = np.unique(keys, return_index=True, return_inverse=True)
+    triangles = remap.ravel()[indices].reshape(-1, 3)
+    triangles = triangles[(triangles[:,0] != triangles[:,1]) &
+                          (triangles[:,1] != triangles[:,2]) &
+                          (triangles[:,2] != triangles[:,0])]
+    return {name: data[first] for name, data in attributes.items()}, triangles.ravel()
+
+
+def optimize_vertex_cache(indices, num_vertices, cache_size=FORSYTH_CACHE_SIZE):
+    """Reorders triangles for the post-transform vertex cache, using Forsyth's greedy algorithm:
+    the next triangle is the highest scoring one which uses a vertex of the (simulated LRU) cache,
+    where vertices score higher the more recently they were used and the fewer triangles remain to use them.
+
+    The adjacency and initial scores are computed with NumPy; the emission itself is inherently sequential."""
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    num_triangles = len(triangles)
+    if num_triangles == 0:
+        return triangles.ravel()
+    corners = triangles.ravel()
+    valences = np.bincount(corners, minlength=num_vertices)
+    adjacent = [a.tolist() for a in np.split(np.argsort(corners, kind='stable') // 3, np.cumsum(valences)[:-1])]
+    positions = np.arange(3, cache_size)
+    cache_scores = np.concatenate([np.full(3, FORSYTH_LAST_TRIANGLE_SCORE),
+                                   (1 - (positions - 3) / (cache_size - 3)) ** FORSYTH_CACHE_DECAY_POWER]).tolist()
+    valence_scores = np.zeros(valences.max() + 1)
+    valence_scores[1:] = FORSYTH_VALENCE_BOOST_SCALE * np.arange(1, len(valence_scores)) ** -FORSYTH_VALENCE_BOOST_POWER
+    vertex_scores = valence_scores[valences]
+    best = int(vertex_scores[triangles].sum(axis=1).argmax())
+    vertex_scores = vertex_scores.tolist()
+    valence_scores = valence_scores.tolist()
+    tris = triangles.tolist()
+    emitted = bytearray(num_triangles)
+    next_unemitted = 0
+    order = []
+    cache = []
+    for _ in range(num_triangles):
+        if best < 0:
+            # dead end: continue with the next triangle (in input order) which has not been emitted
+            while emitted[next_unemitted]:
+                next_unemitted += 1
+            best = next_unemitted
+        order.append(best)
+        emitted[best] = 1
+        tri = tris[best]
+        for v in tri:
+            adjacent[v].remove(best)
+        cache = tri + [v for v in cache if v not in tri]
+        for v in cache[cache_size:]:
+            vertex_scores[v] = valence_scores[len(adjacent[v])]
+        del cache[cache_size:]
+        for i, v in enumerate(cache):
+            vertex_scores[v] = cache_scores[i] + valence_scores[len(adjacent[v])]
+        best, best_score = -1, -1.0
+        for v in cache:
+            for t in adjacent[v]:
+                a, b, c = tris[t]
+                score = vertex_scores[a] + vertex_scores[b] + vertex_scores[c]
+                if score > best_score:
+                    best, best_score = t, score
+    return triangles[order].ravel()
+
+
+def optimize_vertex_fetch(attributes, indices):
+    """Reorders vertices by their first use in `indices` (dropping unused vertices).
+    Returns the reordered attributes and the remapped indices."""
+    used, first_use = np.unique(indices, return_index=True)
+    order = used[np.argsort(first_use)]
+    remap = np.empty(order.max() + 1 if len(order) else 0, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return {name: data[order] for name, data in attributes.items()}, remap[indices]
+
+
+def calc_cache_misses(indices, cache_size=ACMR_CACHE_SIZE):
+    """Returns the number of vertex transforms needed to draw `indices` with a FIFO post-transform cache."""
+    cache = deque()
+    cached = set()
+    misses = 0
+    for v in np.asarray(indices).tolist():
+        if v not in cached:
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+    return misses
+
+
+# the (symmetric) 4x4 quadrics are stored as their 10 upper triangular coefficients:
+_QUADRIC_ROWS, _QUADRIC_COLUMNS = np.triu_indices(4)
+
+
+def _plane_quadrics(normals, points, weights):
+    # returns the weighted quadrics of the planes with the given unit normals through the given points
+    planes = np.concatenate([normals, -(normals * points).sum(axis=1, keepdims=True)], axis=1)
+    return weights[:,np.newaxis] * planes[:,_QUADRIC_ROWS] * planes[:,_QUADRIC_COLUMNS]
+
+
+def _quadric_monomials(positions):
+    # returns the terms which multiply the quadric coefficients in the error v^T Q v of the homogeneous positions v
+    homogeneous = np.concatenate([positions, np.ones((len(positions), 1))], axis=1)
+    return np.where(_QUADRIC_ROWS == _QUADRIC_COLUMNS, 1, 2) * homogeneous[:,_QUADRIC_ROWS] * homogeneous[:,_QUADRIC_COLUMNS]
+
+
+def simplify_indices(positions, indices, target_ratio):
+    """Simplifies a triangle mesh to about `target_ratio` of its triangles by half-edge collapses (each collapse moves
+    a vertex onto a neighbour, so that the simplified triangles index the original vertices), chosen by the quadric
+    error metric of Garland and Heckbert.  Boundary edges are preserved by additional perpendicular quadrics.
+
+    The collapses are done in passes: each pass evaluates the costs of all edges at once and applies every collapse
+    which is the cheapest among the candidates of both of its vertices (so that no vertex takes part in two collapses),
+    rejecting (for good) those which would flip triangles.  Returns the simplified indices and the geometric error, in model
+    units: the largest, over the applied collapses, of the root mean square distance (weighted like the quadrics, by area)
+    of the destination to the planes accumulated in the two vertices' quadrics.  The error is informative only:
+    `gltfutils.DrawList.select_lods` chooses levels by projected size (see `gltfutils.LOD_SCREEN_SIZES`)."""
+    positions = np.asarray(positions, dtype=np.float64).reshape(len(positions), -1)[:,:3]
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    num_vertices = len(positions)
+    target = int(len(triangles) * target_ratio)
+    normals = np.cross(positions[triangles[:,1]] - positions[triangles[:,0]], positions[triangles[:,2]] - positions[triangles[:,0]])
+    areas = 0.5 * np.linalg.norm(normals, axis=1)
+    normals /= np.maximum(2 * areas, 1e-30)[:,np.newaxis]
+    plane_quadrics = _plane_quadrics(normals, positions[triangles[:,0]], areas)
+    quadrics = np.zeros((num_vertices, len(_QUADRIC_ROWS)))
+    # the sums of the weights of the quadrics, which normalize the errors to squared distances:
+    quadric_weights = np.zeros(num_vertices)
+    for corner in range(3):
+        np.add.at(quadrics, triangles[:,corner], plane_quadrics)
+        np.add.at(quadric_weights, triangles[:,corner], areas)
+    # boundary edges (which belong to a single triangle) get the quadric of the plane through the edge
+    # which is perpendicular to the triangle:
+    edges = np.concatenate([triangles[:,[0,1]], triangles[:,[1,2]], triangles[:,[2,0]]])
+    edge_triangles = np.tile(np.arange(len(triangles)), 3)
+    # (edges are identified by single integer keys, which are much faster to sort than rows)
+    _, edge_ids, edge_counts = np.unique(edges.min(axis=1) * num_vertices + edges.max(axis=1),
+                                         return_inverse=True, return_counts=True)
+    boundary = edge_counts[edge_ids] == 1
+    if boundary.any():
+        a, b = positions[edges[boundary,0]], positions[edges[boundary,1]]
+        plane_normals = np.cross(b - a, normals[edge_triangles[boundary]])
+        lengths = np.linalg.norm(plane_normals, axis=1)
+        plane_normals /= np.maximum(lengths, 1e-30)[:,np.newaxis]
+        boundary_weights = QEM_BOUNDARY_WEIGHT * lengths**2
+        boundary_quadrics = _plane_quadrics(plane_normals, a, boundary_weights)
+        for corner in range(2):
+            np.add.at(quadrics, edges[boundary,corner], boundary_quadrics)
+            np.add.at(quadric_weights, edges[boundary,corner], boundary_weights)
+    monomials = _quadric_monomials(positions)
+    max_error = 0.0
+    # the (source * num_vertices + destination) keys of collapses which were rejected for flipping triangles:
+    blocked = np.zeros(0, dtype=np.int64)
+    while len(triangles) > target:
+        edges = np.concatenate([triangles[:,[0,1]], triangles[:,[1,2]], triangles[:,[2,0]]])
+        keys = np.sort(edges.min(axis=1) * num_vertices + edges.max(axis=1))
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        # both directions of each edge are candidate collapses (source -> destination):
+        sources = np.concatenate([keys // num_vertices, keys % num_vertices])
+        destinations = np.concatenate([keys % num_vertices, keys // num_vertices])
+        # the error of a collapse is that of the destination for the sum of the two vertices' quadrics:
+        vertex_errors = (quadrics * monomials).sum(axis=1)
+        costs = (quadrics[sources] * monomials[destinations]).sum(axis=1) + vertex_errors[destinations]
+        costs[np.isin(sources * num_vertices + destinations, blocked)] = np.inf
+        ranks = np.empty(len(costs), dtype=np.int64)
+        ranks[np.argsort(costs, kind='stable')] = np.arange(len(costs))
+        vertex_ranks = np.full(num_vertices, len(costs), dtype=np.int64)
+        np.minimum.at(vertex_ranks, sources, ranks)
+        np.minimum.at(vertex_ranks, destinations, ranks)
+        selected = np.flatnonzero((vertex_ranks[sources] == ranks) & (vertex_ranks[destinations] == ranks)
+                                  & np.isfinite(costs))
+        if not len(selected):
+            break
+        # each collapse removes about two triangles:
+        selected = selected[np.argsort(ranks[selected])][:(len(triangles) - target) // 2 + 1]
+        while len(selected):
+            remap = np.arange(num_vertices)
+            remap[sources[selected]] = destinations[selected]
+            collapsed = remap[triangles]
+            changed = (collapsed != triangles).any(axis=1)
+            kept = (collapsed[:,0] != collapsed[:,1]) & (collapsed[:,1] != collapsed[:,2]) & (collapsed[:,2] != collapsed[:,0])
+            check = changed & kept
+            old_normals = np.cross(positions[triangles[check,1]] - positions[triangles[check,0]],
+                                   positions[triangles[check,2]] - positions[triangles[check,0]])
+            new_normals = np.cross(positions[collapsed[check,1]] - positions[collapsed[check,0]],
+                                   positions[collapsed[check,2]] - positions[collapsed[check,0]])
+            flipped = ((old_normals * new_normals).sum(axis=1) <
+                       QEM_MIN_NORMAL_COSINE * np.linalg.norm(old_normals, axis=1) * np.linalg.norm(new_normals, axis=1))
+            if not flipped.any():
+                break
+            rejected = np.zeros(num_vertices, dtype=np.bool_)
+            rejected[triangles[check][flipped]] = True
+            rejected = rejected[sources[selected]]
+            blocked = np.concatenate([blocked, sources[selected[rejected]] * num_vertices + destinations[selected[rejected]]])
+            selected = selected[~rejected]
+        if not len(selected):
+            continue
+        selected_weights = quadric_weights[sources[selected]] + quadric_weights[destinations[selected]]
+        max_error = max(max_error, (costs[selected] / np.maximum(selected_weights, 1e-30)).max())
+        np.add.at(quadrics, destinations[selected], quadrics[sources[selected]])
+        np.add.at(quadric_weights, destinations[selected], quadric_weights[sources[selected]])
+        triangles = collapsed[kept]
+    return triangles.ravel(), float(np.sqrt(max(max_error, 0.0)))
+
+
+def interleave_vertices(attributes):
+    """Interleaves (N, ...) attribute arrays into an array of N records,
+    the fields of which (named by the dict's keys) are aligned to 4 bytes."""
+    names, formats, offsets = [], [], []
+    itemsize = 0
+    for name, data in attributes.items():
+        names.append(name)
+        formats.append((data.dtype, data.shape[1:]))
+        offsets.append(itemsize)
+        itemsize += -(-data.dtype.itemsize * int(np.prod(data.shape[1:])) // 4) * 4
+    records = np.zeros(len(next(iter(attributes.values()))),
+                       dtype=np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize}))
+    for name, data in attributes.items():
+        records[name] = data
+    return records
+
+
+def _accessor_nbytes(accessor):
+    element_size = gltfu.GLTF_BUFFERVIEW_TYPE_SIZES[accessor['type']] * np.dtype(gltfu.GLTF_COMPONENT_TYPES[accessor['componentType']]).itemsize
+    return accessor['count'] * element_size
+
+
+def optimize_primitive(gltf, primitive, cache_size=FORSYTH_CACHE_SIZE, lod_ratios=()):
+    """Optimizes the vertex and index data of a triangles primitive (see the module docstring).
+
+    Returns a dict of interleaved vertex `records`, the optimized `indices`, a list of (indices, error) pairs
+    of the levels of detail simplified to each of `lod_ratios` (see `simplify_indices`) and before/after statistics."""
+    accessors = gltf['accessors']
+    attributes = {semantic: np.array(gltfu.get_accessor_data(gltf, accessor_name))
+                  for semantic, accessor_name in primitive['attributes'].items()}
+    num_vertices = len(next(iter(attributes.values())))
+    if 'indices' in primitive:
+        indices = gltfu.get_accessor_data(gltf, primitive['indices']).astype(np.int64)
+        index_bytes = _accessor_nbytes(accessors[primitive['indices']])
+    else:
+        indices = np.arange(num_vertices)
+        index_bytes = 0
+    indices = indices[:len(indices) - len(indices) % 3]
+    stats = {'triangles': len(indices) // 3,
+             'vertices': num_vertices,
+             'acmr': calc_cache_misses(indices) / max(1, len(indices) // 3),
+             'vertex_bytes': sum(_accessor_nbytes(accessors[accessor_name])
+                                 for accessor_name in primitive['attributes'].values()),
+             'index_bytes': index_bytes}
+    attributes, indices = weld_vertices(attributes, indices)
+    if len(indices):
+        indices = optimize_vertex_cache(indices, len(next(iter(attributes.values()))), cache_size=cache_size)
+        attributes, indices = optimize_vertex_fetch(attributes, indices)
+    else:
+        attributes = {name: data[:0] for name, data in attributes.items()}
+    records = interleave_vertices(attributes)
+    index_dtype = np.uint16 if len(records) <= MAX_UINT16_INDEX + 1 else np.uint32
+    lods = []
+    if len(indices) and 'POSITION' in attributes:
+        for ratio in lod_ratios:
+            lod_indices, error = simplify_indices(attributes['POSITION'], indices, ratio)
+            lods.append((lod_indices.astype(index_dtype), error))
+    indices = indices.astype(index_dtype)
+    stats_after = {'triangles': len(indices) // 3,
+                   'vertices': len(records),
+                   'acmr': calc_cache_misses(indices) / max(1, len(indices) // 3),
+                   'vertex_bytes': records.nbytes,
+                   'index_bytes': indices.nbytes + sum(lod_indices.nbytes for lod_indices, _ in lods),
+                   'lod_triangles': [len(lod_indices) // 3 for lod_indices, _ in lods]}
+    return {'records': records, 'indices': indices, 'lods': lods, 'before': stats, 'after': stats_after}
+
+
+def _referenced_accessors(gltf):
+    names = set()
+    for mesh in gltf.get('meshes', {}).values():
+        for primitive in mesh['primitives']:
+            names.update(primitive['attributes'].values())
+            if 'indices' in primitive:
+                names.add(primitive['indices'])
+            names.update(lod['indices'] for lod in primitive.get('extras', {}).get('lods', []))
+    for skin in gltf.get('skins', {}).values():
+        if 'inverseBindMatrices' in skin:
+            names.add(skin['inverseBindMatrices'])
+    for animation in gltf.get('animations', {}).values():
+        names.update(animation.get('parameters', {}).values())
+    return names
+
+
+def optimize_gltf(gltf, uri_path, output_uri_path, buffer_uri, cache_size=FORSYTH_CACHE_SIZE, lod_ratios=()):
+    """Optimizes the triangle primitives of the given gltf (primitives which share their accessors are optimized once).
+    The levels of detail generated for `lod_ratios` are listed (finest first) as {'indices': accessor name,
+    'error': geometric error in model units (see `simplify_indices`)} objects in the `lods` list of each primitive's `extras`.
+
+    Returns an optimized copy of the gltf, whose bufferViews all refer to a single buffer (with the given uri),
+    the list of (4-byte aligned) pieces which make up that buffer, and a list of
+    (mesh name, primitive index, before statistics, after statistics) tuples."""
+    gltf = copy.deepcopy(gltf)
+    gltfu.load_buffers(gltf, uri_path)
+    accessors = gltf.setdefault('accessors', {})
+    bufferViews = gltf.setdefault('bufferViews', {})
+    buffer_name = os.path.splitext(os.path.basename(buffer_uri))[0]
+    pieces = []
+    body_length = 0
+    def append(data):
+        nonlocal body_length
+        offset = body_length
+        pieces.append(data)
+        body_length += len(data)
+        if body_length % 4:
+            pieces.append(b'\0' * (4 - body_length % 4))
+            body_length += 4 - body_length % 4
+        return offset
+    optimized = {}
+    stats = []
+    index_pieces = []
+    index_length = 0
+    for mesh_name, mesh in sorted(gltf.get('meshes', {}).items()):
+        for i, primitive in enumerate(mesh['primitives']):
+            if primitive.get('mode', 4) != 4:
+                _logger.info('* skipping primitive %d of mesh "%s" (mode %d)', i, mesh_name, primitive['mode'])
+                continue
+            key = (tuple(sorted(primitive['attributes'].items())), primitive.get('indices'))
+            if key not in optimized:
+                result = optimize_primitive(gltf, primitive, cache_size=cache_size, lod_ratios=lod_ratios)
+                records, indices = result['records'], result['indices']
+                prefix = 'opt_%s_%d' % (mesh_name, i)
+                bufferView_name = 'bufferView_%s' % prefix
+                bufferViews[bufferView_name] = {'buffer': buffer_name,
+                                                'byteOffset': append(records.tobytes()),
+                                                'byteLength': records.nbytes,
+                                                'target': gl.GL_ARRAY_BUFFER}
+                attribute_accessors = {}
+                for semantic, accessor_name in primitive['attributes'].items():
+                    accessor = accessors[accessor_name]
+                    data = records[semantic]
+                    new_accessor = {'bufferView': bufferView_name,
+                                    'byteOffset': records.dtype.fields[semantic][1],
+                                    'byteStride': records.dtype.itemsize,
+                                    'componentType': accessor['componentType'],
+                                    'count': len(records),
+                                    'type': accessor['type']}
+                    if len(data):
+                        new_accessor['min'] = data.reshape(len(data), -1).min(axis=0).tolist()
+                        new_accessor['max'] = data.reshape(len(data), -1).max(axis=0).tolist()
+                    attribute_accessors[semantic] = 'accessor_%s_%s' % (prefix, semantic)
+                    accessors[attribute_accessors[semantic]] = new_accessor
+                # the indices of all primitives and their levels of detail share one bufferView:
+                def append_indices(accessor_name, indices):
+                    nonlocal index_length
+                    accessors[accessor_name] = {'bufferView': 'bufferView_opt_indices',
+                                                'byteOffset': index_length,
+                                                'byteStride': 0,
+                                                'componentType': (gl.GL_UNSIGNED_SHORT if indices.dtype == np.uint16
+                                                                  else gl.GL_UNSIGNED_INT),
+                                                'count': len(indices),
+                                                'type': 'SCALAR',
+                                                'min': [int(indices.min())] if len(indices) else [0],
+                                                'max': [int(indices.max())] if len(indices) else [0]}
+                    index_pieces.append(indices.tobytes() + b'\0' * (-indices.nbytes % 4))
+                    index_length += len(index_pieces[-1])
+                append_indices('accessor_%s_indices' % prefix, indices)
+                lods = []
+                for level, (lod_indices, error) in enumerate(result['lods']):
+                    append_indices('accessor_%s_lod%d' % (prefix, level + 1), lod_indices)
+                    lods.append({'indices': 'accessor_%s_lod%d' % (prefix, level + 1), 'error': error})
+                optimized[key] = (attribute_accessors, 'accessor_%s_indices' % prefix, lods)
+                stats.append((mesh_name, i, result['before'], result['after']))
+            primitive['attributes'], primitive['indices'] = (dict(optimized[key][0]), optimized[key][1])
+            extras = primitive.setdefault('extras', {})
+            extras.pop('lods', None)
+            if optimized[key][2]:
+                extras['lods'] = [dict(lod) for lod in optimized[key][2]]
+            elif not extras:
+                del primitive['extras']
+    if index_pieces:
+        bufferViews['bufferView_opt_indices'] = {'buffer': buffer_name,
+                                                 'byteOffset': append(b''.join(index_pieces)),
+                                                 'byteLength': index_length,
+                                                 'target': gl.GL_ELEMENT_ARRAY_BUFFER}
+    referenced = _referenced_accessors(gltf)
+    for accessor_name in list(accessors.keys()):
+        if accessor_name not in referenced:
+            del accessors[accessor_name]
+    referenced = {accessor['bufferView'] for accessor in accessors.values()}
+    for resource in list(gltf.get('shaders', {}).values()) + list(gltf.get('images', {}).values()):
+        if 'KHR_binary_glTF' in resource.get('extensions', {}):
+            referenced.add(resource['extensions']['KHR_binary_glTF']['bufferView'])
+        elif not resource['uri'].startswith('data:'):
+            resource['uri'] = os.path.relpath(os.path.join(uri_path, resource['uri']), output_uri_path).replace(os.path.sep, '/')
+    for bufferView_name, bufferView in list(bufferViews.items()):
+        if bufferView_name not in referenced:
+            del bufferViews[bufferView_name]
+        elif bufferView['buffer'] != buffer_name:
+            data = gltfu.get_bufferView_data(gltf, bufferView_name).tobytes()
+            bufferView['byteOffset'] = append(data)
+            bufferView['buffer'] = buffer_name
+    gltf['buffers'] = {buffer_name: {'byteLength': body_length,
+                                     'type': 'arraybuffer',
+                                     'uri': buffer_uri}}
+    return gltf, pieces, stats
+
+
+def print_stats(stats):
+    print('%-32s %9s %19s %15s %27s' % ('primitive', 'triangles', 'vertices', 'ACMR', 'bytes (vertex + index)'))
+    totals = {'before': np.zeros(3), 'after': np.zeros(3)}
+    for mesh_name, i, before, after in stats:
+        print('%-32s %9d %9d -> %7d %6.3f -> %5.3f %12d -> %12d' % ('%s[%d]' % (mesh_name, i), after['triangles'],
+                                                                   before['vertices'], after['vertices'],
+                                                                   before['acmr'], after['acmr'],
+                                                                   before['vertex_bytes'] + before['index_bytes'],
+                                                                   after['vertex_bytes'] + after['index_bytes']))
+        if after.get('lod_triangles'):
+            print('%-32s %9s' % ('  LOD triangles', ' / '.join('%d' % n for n in after['lod_triangles'])))
+        for key, values in (('before', before), ('after', after)):
+            totals[key] += (values['triangles'], values['triangles'] * values['acmr'], values['vertex_bytes'] + values['index_bytes'])
+    before, after = totals['before'], totals['after']
+    print('%-32s %9d %19s %6.3f -> %5.3f %12d -> %12d' % ('total', after[0], '',
+                                                          before[1] / max(1, before[0]), after[1] / max(1, after[0]),
+                                                          before[2], after[2]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename', help='path of glTF (or binary glTF) file to optimize')
+    parser.add_argument('-o', '--output', help='path of glTF file to write (default: the input path with an _opt suffix)')
+    parser.add_argument('--cache-size', type=int, default=FORSYTH_CACHE_SIZE,
+                        help='size of the vertex cache for which triangles are ordered (default: %d)' % FORSYTH_CACHE_SIZE)
+    parser.add_argument('--lod', type=float, nargs='+', default=[], metavar='RATIO',
+                        help='generate simplified levels of detail with these fractions of the triangles (e.g. 0.5 0.25 0.125)')
+    parser.add_argument("-v", help="enable verbose logging", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=(logging.DEBUG if args.v else logging.INFO))
+    output = args.output or os.path.splitext(args.filename)[0] + '_opt.gltf'
+    output_path = os.path.dirname(output)
+    buffer_uri = os.path.splitext(os.path.basename(output))[0] + '.bin'
+    gltf = gltfu.load_gltf(args.filename)
+    input_bytes = sum(buffer['byteLength'] for buffer in gltf.get('buffers', {}).values())
+    gltf, pieces, stats = optimize_gltf(gltf, os.path.dirname(args.filename), output_path, buffer_uri,
+                                        cache_size=args.cache_size, lod_ratios=sorted(args.lod, reverse=True))
+    with open(os.path.join(output_path, buffer_uri), 'wb') as f:
+        for piece in pieces:
+            f.write(piece)
+    with open(output, 'w') as f:
+        json.dump(gltf, f, indent=2, sort_keys=True)
+    print_stats(stats)
+    _logger.info('* wrote %s (buffer bytes: %d -> %d)', output, input_bytes, gltf['buffers'][os.path.splitext(buffer_uri)[0]]['byteLength'])
+
+
+if __name__ == "__main__":
+    main()
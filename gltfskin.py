@@ -0,0 +1,140 @@
+"""Skinning: joint matrix palettes of skinned nodes, and CPU skinning of vertex data.
+
+Like `gltfutils.NodeHierarchy`, joint matrices use the row-vector convention (they are the transposes of the
+usual column-vector matrices), so that a joint matrix of the palette of a node whose skin has the bind shape matrix
+BSM, and whose joint j has the inverse bind matrix IBM_j and world matrix W_j, is
+(inverse(W_node) * W_j * IBM_j * BSM)^T."""
+import logging
+
+import numpy as np
+
+import gltfutils as gltfu
+
+
+_logger = logging.getLogger(__name__)
+
+
+def get_joint_names(gltf, node):
+    """Returns the names of the joint nodes of the given skinned node, in the order of its skin's joints.
+
+    glTF 1.0 joints are identified by `jointName` within the subtrees of the node's `skeletons`
+    (or of all nodes, if it has none); skins may also list their joint nodes directly (`joints`)."""
+    skin = gltf['skins'][node['skin']]
+    if 'joints' in skin:
+        return list(skin['joints'])
+    nodes = gltf['nodes']
+    root_names = node.get('skeletons') or list(nodes.keys())
+    joint_nodes = {}
+    stack = list(root_names)
+    while stack:
+        name = stack.pop()
+        if 'jointName' in nodes[name]:
+            joint_nodes.setdefault(nodes[name]['jointName'], name)
+        stack.extend(nodes[name].get('children', []))
+    missing = [joint_name for joint_name in skin['jointNames'] if joint_name not in joint_nodes]
+    if missing:
+        raise Exception('joints of skin "%s" not found: %s' % (node['skin'], ', '.join(missing)))
+    return [joint_nodes[joint_name] for joint_name in skin['jointNames']]
+
+
+def get_bind_matrices(gltf, skin_name):
+    """Returns the (J,4,4) products of the inverse bind matrices and the bind shape matrix of the given skin
+    (read once and stored as the skin's 'bind_matrices' property)."""
+    skin = gltf['skins'][skin_name]
+    if 'bind_matrices' not in skin:
+        if 'inverseBindMatrices' in skin:
+            inverse_bind_matrices = np.array(gltfu.get_accessor_data(gltf, skin['inverseBindMatrices']), dtype=np.float32)
+        else:
+            inverse_bind_matrices = np.tile(np.eye(4, dtype=np.float32), (len(skin.get('joints', skin.get('jointNames'))), 1, 1))
+        bind_shape_matrix = np.array(skin.get('bindShapeMatrix', np.eye(4).ravel()), dtype=np.float32).reshape((4, 4))
+        skin['bind_matrices'] = np.matmul(bind_shape_matrix, inverse_bind_matrices)
+    return skin['bind_matrices']
+
+
+class SkinPalettes(object):
+    """The joint matrix palettes of the given skinned nodes of a `NodeHierarchy`, stored contiguously in the
+    (J,4,4) float32 array `matrices`: the palette of the i-th node is `matrices[offsets[i]:offsets[i]+counts[i]]`.
+
+    `update` recomputes all palettes at once (with one stacked matmul) whenever the hierarchy's world matrices
+    have been updated."""
+    def __init__(self, gltf, hierarchy, node_names):
+        self.hierarchy = hierarchy
+        self.node_names = list(node_names)
+        joint_nodes = []
+        bind_matrices = []
+        self.nodes = np.array([hierarchy.node_indices[node_name] for node_name in self.node_names], dtype=np.intp)
+        for node_name in self.node_names:
+            joint_names = get_joint_names(gltf, gltf['nodes'][node_name])
+            for joint_name in joint_names:
+                if joint_name not in hierarchy.node_indices:
+                    raise Exception('joint "%s" of node "%s" is not part of the node hierarchy' % (joint_name, node_name))
+            joint_nodes.append([hierarchy.node_indices[joint_name] for joint_name in joint_names])
+            skin_bind_matrices = get_bind_matrices(gltf, gltf['nodes'][node_name]['skin'])
+            if len(skin_bind_matrices) != len(joint_names):
+                raise Exception('skin of node "%s" has %d joints but %d inverse bind matrices'
+                                % (node_name, len(joint_names), len(skin_bind_matrices)))
+            bind_matrices.append(skin_bind_matrices)
+        self.counts = np.array([len(joints) for joints in joint_nodes], dtype=np.intp)
+        self.offsets = np.cumsum(self.counts) - self.counts
+        self.joint_nodes = np.array([joint for joints in joint_nodes for joint in joints], dtype=np.intp)
+        # index (into `nodes`) of the skinned node of each joint matrix:
+        self.joint_skins = np.repeat(np.arange(len(self.node_names)), self.counts)
+        self.bind_matrices = np.concatenate(bind_matrices) if bind_matrices else np.zeros((0, 4, 4), dtype=np.float32)
+        self.matrices = np.empty((len(self.joint_nodes), 4, 4), dtype=np.float32)
+        self._version = None
+        _logger.debug('* skin palettes: %d skinned nodes, %d joint matrices', len(self.node_names), len(self.joint_nodes))
+    def __len__(self):
+        return len(self.node_names)
+    def update(self):
+        """Recomputes the palettes if the world matrices of the hierarchy have changed."""
+        hierarchy = self.hierarchy
+        if self._version == hierarchy.version or not len(self.joint_nodes):
+            return
+        world_matrices = hierarchy.world_matrices
+        inverse_node_matrices = np.linalg.inv(world_matrices[self.nodes])
+        np.matmul(np.matmul(self.bind_matrices, world_matrices[self.joint_nodes]),
+                  inverse_node_matrices[self.joint_skins], out=self.matrices)
+        self._version = hierarchy.version
+    def get_palette(self, i):
+        return self.matrices[self.offsets[i]:self.offsets[i]+self.counts[i]]
+
+
+def calc_joint_matrices(gltf, node):
+    """Returns the (J,4,4) joint matrix palette of a single skinned node, from the `world_matrix` properties
+    of the node and its joints (as set by `gltfutils.NodeHierarchy` or `gltfutils.update_world_matrices`)."""
+    nodes = gltf['nodes']
+    joint_world_matrices = np.array([nodes[joint_name]['world_matrix'] for joint_name in get_joint_names(gltf, node)],
+                                    dtype=np.float32).reshape(-1, 4, 4)
+    return np.matmul(np.matmul(get_bind_matrices(gltf, node['skin']), joint_world_matrices),
+                     np.linalg.inv(np.asarray(node['world_matrix'], dtype=np.float32)))
+
+
+def skin_vertices(positions, joints, weights, palette, normals=None):
+    """Blends (N,3) positions (and optionally normals) by the (N,K) joint indices and weights of each vertex,
+    given a (J,4,4) joint matrix palette.  Returns the skinned positions, or (positions, normals) if normals are given."""
+    joints = np.asarray(joints).astype(np.intp)
+    skin_matrices = np.einsum('nk,nkij->nij', np.asarray(weights, dtype=np.float32), palette[joints])
+    skinned_positions = (np.einsum('ni,nij->nj', np.asarray(positions, dtype=np.float32), skin_matrices[:,:3,:3])
+                         + skin_matrices[:,3,:3])
+    if normals is None:
+        return skinned_positions
+    # normals are transformed by the inverse transpose of the blended matrices, which in the row-vector convention
+    # is the transpose of their inverse:
+    skinned_normals = np.einsum('nij,nj->ni', np.linalg.inv(skin_matrices[:,:3,:3]), np.asarray(normals, dtype=np.float32))
+    skinned_normals /= np.maximum(np.linalg.norm(skinned_normals, axis=1, keepdims=True), 1e-12)
+    return skinned_positions, skinned_normals
+
+
+def skin_primitive(gltf, primitive, palette):
+    """Returns the skinned POSITION (and NORMAL, if present) data of a primitive with JOINT and WEIGHT attributes,
+    e.g. for exporting a posed mesh.  Returns a dict mapping the semantics to (N,3) arrays."""
+    attributes = primitive['attributes']
+    positions = gltfu.get_accessor_data(gltf, attributes['POSITION'])[:,:3]
+    normals = gltfu.get_accessor_data(gltf, attributes['NORMAL'])[:,:3] if 'NORMAL' in attributes else None
+    joints = gltfu.get_accessor_data(gltf, attributes.get('JOINT', attributes.get('JOINTS_0')))
+    weights = gltfu.get_accessor_data(gltf, attributes.get('WEIGHT', attributes.get('WEIGHTS_0')))
+    skinned = skin_vertices(positions, joints.reshape(len(positions), -1), weights.reshape(len(positions), -1),
+                            palette, normals=normals)
+    if normals is None:
+        return {'POSITION': skinned}
+    return {'POSITION': skinned[0], 'NORMAL': skinned[1]}
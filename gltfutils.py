@@ -1,22 +1,64 @@
 import os.path
 import base64
+import json
+import struct
+import io
+import hashlib
+import re
 from ctypes import c_void_p
 try: # python 3.3 or later
     from types import MappingProxyType
 except ImportError as err:
     MappingProxyType = dict
 import logging
+import functools
+import math
+from collections import defaultdict
 
 import numpy as np
 import OpenGL.GL as gl
 import PIL.Image as Image
 from pyrr import matrix44
 
+import gltfbounds
+import gltfskin
+import glarena
+from glstate import state as glstate
+
 
 _logger = logging.getLogger(__name__)
 
 CHECK_GL_ERRORS = False
 
+# directory in which linked program binaries are cached (set to None to disable caching):
+PROGRAM_BINARY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gltfview', 'programs')
+
+# if True, the PROJECTION and VIEW uniforms of programs are moved into a uniform block
+# which is shared by all programs and uploaded once per frame (see update_frame_uniforms):
+USE_FRAME_UNIFORM_BLOCK = True
+FRAME_UNIFORM_BLOCK_NAME = 'FrameUniforms'
+FRAME_UNIFORM_BLOCK_BINDING = 0
+FRAME_UNIFORM_BLOCK_SEMANTICS = ('PROJECTION', 'VIEW')
+# if True, the vertex and index data of all bufferViews is placed in a few large buffer objects (see glarena)
+# rather than in one buffer object per bufferView:
+USE_BUFFER_ARENAS = True
+# draw lists with at least this many records are culled by traversing a bounding volume hierarchy
+# rather than by testing every record's bounding box:
+CULLING_BVH_MIN_RECORDS = 2048
+# primitives which are drawn for at least this many nodes are drawn with a single instanced draw call
+# (when their program supports it, see `setup_instanced_program`); set to None to disable instancing:
+INSTANCING_MIN_INSTANCES = 2
+# if True (and glMultiDrawElementsIndirect is available), opaque primitives whose programs have an instanced variant
+# are drawn with one multi-draw indirect call per (program, material, vertex format) group:
+USE_MULTI_DRAW_INDIRECT = True
+# primitives with levels of detail (the `lods` of their extras, see gltfopt.py) are drawn at level i + 1 when the
+# projected diameter of their bounding sphere is less than LOD_SCREEN_SIZES[i] of the viewport height
+# (set to None to always draw full detail):
+LOD_SCREEN_SIZES = (0.25, 0.125, 0.0625)
+# a record only switches to a coarser level when its size is (1 - LOD_HYSTERESIS) times below the threshold, and back
+# to a finer level when it is (1 + LOD_HYSTERESIS) times above it, so that levels do not flicker near the thresholds:
+LOD_HYSTERESIS = 0.2
+
 GLTF_BUFFERVIEW_TYPE_SIZES = MappingProxyType({
     'SCALAR': 1,
     'VEC2': 2,
@@ -27,241 +69,924 @@ GLTF_BUFFERVIEW_TYPE_SIZES = MappingProxyType({
     'MAT4': 16
 })
 
+GLTF_TEXTURE_FORMAT_MODES = MappingProxyType({
+    gl.GL_ALPHA: 'A',
+    gl.GL_RGB: 'RGB',
+    gl.GL_RGBA: 'RGBA',
+    gl.GL_LUMINANCE: 'L',
+    gl.GL_LUMINANCE_ALPHA: 'LA'
+})
+
+GLTF_TEXTURE_16BIT_INTERNAL_FORMATS = MappingProxyType({
+    gl.GL_ALPHA: gl.GL_ALPHA16,
+    gl.GL_RGB: gl.GL_RGB16,
+    gl.GL_RGBA: gl.GL_RGBA16,
+    gl.GL_LUMINANCE: gl.GL_LUMINANCE16,
+    gl.GL_LUMINANCE_ALPHA: gl.GL_LUMINANCE16_ALPHA16
+})
 
-def setup_shaders(gltf, uri_path):
-    """Loads and compiles all shaders defined or referenced in the given gltf."""
-    shader_ids = {}
-    for shader_name, shader in gltf['shaders'].items():
-        uri = shader['uri']
-        if uri.startswith('data:text/plain;base64,'):
-            shader_str = base64.urlsafe_b64decode(uri.split(',')[1]).decode()
-            _logger.debug('* decoded shader "%s":\n%s', shader_name, shader_str)
-        else:
-            filename = os.path.join(uri_path, shader['uri'])
-            shader_str = open(filename).read()
-            _logger.debug('* loaded shader "%s" (from %s):\n%s', shader_name, filename, shader_str)
-        shader_id = gl.glCreateShader(shader['type'])
-        gl.glShaderSource(shader_id, shader_str)
-        gl.glCompileShader(shader_id)
-        if not gl.glGetShaderiv(shader_id, gl.GL_COMPILE_STATUS):
-            raise Exception('failed to compile shader "%s":\n%s' % (shader_name, gl.glGetShaderInfoLog(shader_id).decode()))
-        _logger.debug('* compiled shader "%s"', shader_name)
-        shader_ids[shader_name] = shader_id
-    return shader_ids
-
-
-def setup_programs(gltf, shader_ids):
-    for program_name, program in gltf['programs'].items():
+GLTF_UNIFORM_VECTOR_SETTERS = MappingProxyType({
+    gl.GL_FLOAT: (gl.glUniform1fv, np.float32),
+    gl.GL_FLOAT_VEC2: (gl.glUniform2fv, np.float32),
+    gl.GL_FLOAT_VEC3: (gl.glUniform3fv, np.float32),
+    gl.GL_FLOAT_VEC4: (gl.glUniform4fv, np.float32),
+    gl.GL_INT: (gl.glUniform1iv, np.int32),
+    gl.GL_INT_VEC2: (gl.glUniform2iv, np.int32),
+    gl.GL_INT_VEC3: (gl.glUniform3iv, np.int32),
+    gl.GL_INT_VEC4: (gl.glUniform4iv, np.int32),
+    gl.GL_BOOL: (gl.glUniform1iv, np.int32),
+    gl.GL_BOOL_VEC2: (gl.glUniform2iv, np.int32),
+    gl.GL_BOOL_VEC3: (gl.glUniform3iv, np.int32),
+    gl.GL_BOOL_VEC4: (gl.glUniform4iv, np.int32)
+})
+
+GLTF_UNIFORM_MATRIX_SETTERS = MappingProxyType({
+    gl.GL_FLOAT_MAT2: gl.glUniformMatrix2fv,
+    gl.GL_FLOAT_MAT3: gl.glUniformMatrix3fv,
+    gl.GL_FLOAT_MAT4: gl.glUniformMatrix4fv
+})
+
+# per-instance attributes which replace the uniforms with these semantics in instanced program variants:
+INSTANCE_ATTRIBUTE_TYPES = MappingProxyType({
+    'MODELVIEW': 'mat4',
+    'MODELVIEWINVERSETRANSPOSE': 'mat3'
+})
+
+INSTANCE_DTYPE = np.dtype([('MODELVIEW', np.float32, (4,4)),
+                           ('MODELVIEWINVERSETRANSPOSE', np.float32, (3,3))])
+# layout of the commands of an indirect buffer for glMultiDrawElementsIndirect:
+DRAW_ELEMENTS_INDIRECT_COMMAND_DTYPE = np.dtype([('count', np.uint32),
+                                                 ('instanceCount', np.uint32),
+                                                 ('firstIndex', np.uint32),
+                                                 ('baseVertex', np.int32),
+                                                 ('baseInstance', np.uint32)])
+
+# the capabilities which may be enabled by the states of a technique (all others are disabled):
+GLTF_TECHNIQUE_STATES = (gl.GL_BLEND, gl.GL_CULL_FACE, gl.GL_DEPTH_TEST, gl.GL_POLYGON_OFFSET_FILL,
+                         gl.GL_SAMPLE_ALPHA_TO_COVERAGE, gl.GL_SCISSOR_TEST)
+GLTF_COMPONENT_TYPES = MappingProxyType({
+    5120: np.byte,
+    5121: np.ubyte,
+    5122: np.short,
+    5123: np.ushort,
+    5125: np.uint32,
+    5126: np.float32
+})
+
+
+GLB_MAGIC = b'glTF'
+GLB_CHUNK_TYPE_JSON = 0x4E4F534A
+GLB_CHUNK_TYPE_BIN = 0x004E4942
+GLB_BINARY_BUFFER_NAME = 'binary_glTF'
+
+
+def load_glb(filename, object_hook=None):
+    """Parses a binary glTF (.glb) file, which is memory-mapped rather than read.
+
+    Both the KHR_binary_glTF container (version 1: header, JSON content, binary body) and the chunked
+    container (version 2: header, JSON chunk, BIN chunk) are supported.
+    Returns the parsed JSON (with its objects constructed by `object_hook`, if given) and the binary body
+    (as a uint8 NumPy view of the mapping, or None if absent)."""
+    data = np.memmap(filename, dtype=np.ubyte, mode='r')
+    magic, version, length = struct.unpack_from('<4sII', data, 0)
+    if magic != GLB_MAGIC:
+        raise Exception('%s is not a binary glTF file' % filename)
+    if length > len(data):
+        raise Exception('%s is truncated (expected %d bytes, found %d)' % (filename, length, len(data)))
+    body = None
+    if version == 1:
+        content_length, content_format = struct.unpack_from('<II', data, 12)
+        if content_format != 0:
+            raise Exception('unsupported binary glTF content format: %d' % content_format)
+        content = data[20:20+content_length]
+        body = data[20+content_length:length]
+    elif version == 2:
+        content = None
+        offset = 12
+        while offset < length:
+            chunk_length, chunk_type = struct.unpack_from('<II', data, offset)
+            chunk = data[offset+8:offset+8+chunk_length]
+            if chunk_type == GLB_CHUNK_TYPE_JSON and content is None:
+                content = chunk
+            elif chunk_type == GLB_CHUNK_TYPE_BIN and body is None:
+                body = chunk
+            offset += 8 + chunk_length
+        if content is None:
+            raise Exception('%s has no JSON chunk' % filename)
+    else:
+        raise Exception('unsupported binary glTF version: %d' % version)
+    return json.loads(content.tobytes().decode(), object_hook=object_hook), body
+
+
+def load_gltf(filename, object_hook=None):
+    """Loads the JSON of a glTF (.gltf) or binary glTF (.glb) file, constructing its objects with `object_hook`
+    (e.g. `jsobject.JSobject`) if given.
+
+    For binary glTF files, the (memory-mapped) binary body is attached as the 'data' property
+    of the 'binary_glTF' buffer, so that it is served directly by `load_buffers`."""
+    with open(filename, 'rb') as f:
+        magic = f.read(len(GLB_MAGIC))
+    if magic != GLB_MAGIC:
+        with open(filename) as f:
+            return json.loads(f.read(), object_hook=object_hook)
+    gltf, body = load_glb(filename, object_hook=object_hook)
+    buffers = gltf.get('buffers', {})
+    if GLB_BINARY_BUFFER_NAME in buffers:
+        if body is None:
+            raise Exception('%s has no binary body' % filename)
+        buffers[GLB_BINARY_BUFFER_NAME]['data'] = body
+    return gltf
+
+
+def load_shader_source(gltf, shader_name, uri_path):
+    """Returns the source of the given shader, loaded from its file, data URI or binary bufferView."""
+    shader = gltf['shaders'][shader_name]
+    uri = shader['uri']
+    if 'KHR_binary_glTF' in shader.get('extensions', {}):
+        bufferView_name = shader['extensions']['KHR_binary_glTF']['bufferView']
+        shader_str = get_bufferView_data(gltf, bufferView_name).tobytes().decode()
+        _logger.debug('* loaded shader "%s" (from binary bufferView "%s"):\n%s', shader_name, bufferView_name, shader_str)
+    elif uri.startswith('data:text/plain;base64,'):
+        shader_str = base64.urlsafe_b64decode(uri.split(',')[1]).decode()
+        _logger.debug('* decoded shader "%s":\n%s', shader_name, shader_str)
+    else:
+        filename = os.path.join(uri_path, shader['uri'])
+        with open(filename) as f:
+            shader_str = f.read()
+        _logger.debug('* loaded shader "%s" (from %s):\n%s', shader_name, filename, shader_str)
+    return shader_str
+
+
+def load_shaders(gltf, uri_path):
+    """Loads the sources of all shaders defined or referenced in the given gltf.
+
+    Shaders are compiled on demand by `setup_programs`."""
+    return {shader_name: load_shader_source(gltf, shader_name, uri_path)
+            for shader_name in gltf['shaders'].keys()}
+
+
+def compile_shader(gltf, shader_name, shader_str):
+    """Compiles the given shader source.  Byte-identical shaders of the same type are only compiled once."""
+    shader_type = gltf['shaders'][shader_name]['type']
+    key = (shader_type, hashlib.sha1(shader_str.encode()).digest())
+    if key in compile_shader.shader_ids:
+        return compile_shader.shader_ids[key]
+    shader_id = gl.glCreateShader(shader_type)
+    gl.glShaderSource(shader_id, shader_str)
+    gl.glCompileShader(shader_id)
+    if not gl.glGetShaderiv(shader_id, gl.GL_COMPILE_STATUS):
+        raise Exception('failed to compile shader "%s":\n%s' % (shader_name, gl.glGetShaderInfoLog(shader_id).decode()))
+    _logger.debug('* compiled shader "%s"', shader_name)
+    compile_shader.shader_ids[key] = shader_id
+    return shader_id
+compile_shader.shader_ids = {}
+
+
+def _get_program_binary_filename(program_hash):
+    if _get_program_binary_filename.driver_string is None:
+        _get_program_binary_filename.driver_string = b'\0'.join(gl.glGetString(name) or b''
+                                                                for name in (gl.GL_VENDOR, gl.GL_RENDERER, gl.GL_VERSION))
+    key = hashlib.sha1(program_hash + _get_program_binary_filename.driver_string).hexdigest()
+    return os.path.join(PROGRAM_BINARY_CACHE_DIR, '%s.bin' % key)
+_get_program_binary_filename.driver_string = None
+
+
+def _load_program_binary(program_hash):
+    filename = _get_program_binary_filename(program_hash)
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    binary_format, = struct.unpack_from('<I', data, 0)
+    binary = np.frombuffer(data, dtype=np.ubyte, offset=4)
+    program_id = gl.glCreateProgram()
+    gl.glProgramBinary(program_id, binary_format, binary, len(binary))
+    if not gl.glGetProgramiv(program_id, gl.GL_LINK_STATUS):
+        # e.g. the driver was updated without changing its version string:
+        gl.glDeleteProgram(program_id)
+        _logger.debug('* rejected cached program binary %s', filename)
+        return None
+    return program_id
+
+
+def _save_program_binary(program_hash, program_id):
+    length = gl.glGetProgramiv(program_id, gl.GL_PROGRAM_BINARY_LENGTH)
+    if not length:
+        return
+    binary_length, binary_format = gl.GLsizei(), gl.GLenum()
+    binary = np.empty(length, dtype=np.ubyte)
+    gl.glGetProgramBinary(program_id, length, binary_length, binary_format, binary)
+    filename = _get_program_binary_filename(program_hash)
+    try:
+        if not os.path.exists(PROGRAM_BINARY_CACHE_DIR):
+            os.makedirs(PROGRAM_BINARY_CACHE_DIR)
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            f.write(struct.pack('<I', binary_format.value))
+            f.write(binary[:binary_length.value])
+        os.replace(tmp_filename, filename)
+    except (IOError, OSError) as err:
+        _logger.warning('failed to save program binary %s: %s', filename, err)
+
+
+def _create_program(gltf, program_name, vertex_str, fragment_str):
+    program = gltf['programs'][program_name]
+    program_hash = hashlib.sha1(b'\0'.join([vertex_str.encode(), fragment_str.encode()] +
+                                           [attribute_name.encode() for attribute_name in sorted(program['attributes'])])).digest()
+    if program_hash in setup_program.program_ids:
+        _logger.debug('* reused program for "%s"', program_name)
+        return setup_program.program_ids[program_hash]
+    program_id = None
+    if PROGRAM_BINARY_CACHE_DIR is not None:
+        program_id = _load_program_binary(program_hash)
+        if program_id is not None:
+            _logger.debug('* loaded program binary for "%s"', program_name)
+    if program_id is None:
+        vertex_shader_id = compile_shader(gltf, program['vertexShader'], vertex_str)
+        fragment_shader_id = compile_shader(gltf, program['fragmentShader'], fragment_str)
         program_id = gl.glCreateProgram()
-        gl.glAttachShader(program_id, shader_ids[program['vertexShader']])
-        gl.glAttachShader(program_id, shader_ids[program['fragmentShader']])
+        if PROGRAM_BINARY_CACHE_DIR is not None:
+            gl.glProgramParameteri(program_id, gl.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, gl.GL_TRUE)
+        gl.glAttachShader(program_id, vertex_shader_id)
+        gl.glAttachShader(program_id, fragment_shader_id)
         gl.glLinkProgram(program_id)
-        gl.glDetachShader(program_id, shader_ids[program['vertexShader']])
-        gl.glDetachShader(program_id, shader_ids[program['fragmentShader']])
+        gl.glDetachShader(program_id, vertex_shader_id)
+        gl.glDetachShader(program_id, fragment_shader_id)
         if not gl.glGetProgramiv(program_id, gl.GL_LINK_STATUS):
             raise Exception('failed to link program "%s"' % program_name)
-        program['id'] = program_id
-        program['attribute_locations'] = {attribute_name: gl.glGetAttribLocation(program_id, attribute_name)
-                                          for attribute_name in program['attributes']}
-        program['uniform_locations'] = {}
-        _logger.debug('* linked program "%s"\n  attribute locations: %s', program_name, program['attribute_locations'])
+        if PROGRAM_BINARY_CACHE_DIR is not None:
+            _save_program_binary(program_hash, program_id)
+    setup_program.program_ids[program_hash] = program_id
+    return program_id
 
 
-def setup_textures(gltf, uri_path):
+def _get_frame_uniform_names(gltf, program_name):
+    uniform_names = {}
+    for technique in gltf.get('techniques', {}).values():
+        if technique['program'] != program_name:
+            continue
+        for uniform_name, parameter_name in technique['uniforms'].items():
+            parameter = technique['parameters'][parameter_name]
+            if parameter.get('semantic') in FRAME_UNIFORM_BLOCK_SEMANTICS:
+                if 'node' in parameter or uniform_names.setdefault(parameter['semantic'], uniform_name) != uniform_name:
+                    return None
+    return uniform_names
+
+
+def _use_frame_uniform_block(shader_str, uniform_names):
+    """Replaces the declarations of the given uniforms (a dict mapping semantics to uniform names)
+    in a shader source with a declaration of the frame uniform block."""
+    declaration_re = re.compile(r'^[ \t]*uniform\s+(?:(?:highp|mediump|lowp)\s+)?mat4\s+(?:%s)\s*;[ \t]*$'
+                                % '|'.join(re.escape(uniform_name) for uniform_name in uniform_names.values()),
+                                re.MULTILINE)
+    if not declaration_re.search(shader_str):
+        return shader_str
+    block = 'layout(std140) uniform %s {\n%s};' % (FRAME_UNIFORM_BLOCK_NAME,
+                                                   ''.join('    mat4 %s;\n' % uniform_names.get(semantic, 'frameUniforms_%s' % semantic.lower())
+                                                           for semantic in FRAME_UNIFORM_BLOCK_SEMANTICS))
+    declarations = iter([block])
+    shader_str = declaration_re.sub(lambda match: next(declarations, ''), shader_str)
+    extension = '#extension GL_ARB_uniform_buffer_object : enable\n'
+    version_match = re.match(r'\s*#version[^\n]*\n', shader_str)
+    if version_match:
+        return shader_str[:version_match.end()] + extension + shader_str[version_match.end():]
+    return extension + shader_str
+
+
+def setup_program(gltf, program_name, shader_sources):
+    """Creates the program object of the given program from the sources of its shaders.
+
+    Programs are deduplicated by a hash of their shader sources and attributes, so that
+    byte-identical programs share a single program object.  If `PROGRAM_BINARY_CACHE_DIR` is set,
+    linked program binaries are cached there (keyed by that hash and the GL vendor, renderer and version strings)
+    and restored on subsequent runs, falling back to compiling from source when no usable binary is found.
+
+    If `USE_FRAME_UNIFORM_BLOCK` is set, the declarations of the program's PROJECTION and VIEW uniforms
+    are replaced by the frame uniform block (falling back to the unmodified sources if that fails)."""
+    program = gltf['programs'][program_name]
+    vertex_str, fragment_str = shader_sources[program['vertexShader']], shader_sources[program['fragmentShader']]
+    program['shader_sources'] = (vertex_str, fragment_str)
+    program['id'] = _create_program_variant(gltf, program_name, vertex_str, fragment_str)
+    program['attribute_locations'] = {attribute_name: gl.glGetAttribLocation(program['id'], attribute_name)
+                                      for attribute_name in program['attributes']}
+    program['uniform_locations'] = {}
+    _logger.debug('* linked program "%s"\n  attribute locations: %s', program_name, program['attribute_locations'])
+setup_program.program_ids = {}
+
+
+def _create_program_variant(gltf, program_name, vertex_str, fragment_str):
+    program_id = None
+    if USE_FRAME_UNIFORM_BLOCK:
+        uniform_names = _get_frame_uniform_names(gltf, program_name)
+        if uniform_names:
+            try:
+                program_id = _create_program(gltf, program_name,
+                                             _use_frame_uniform_block(vertex_str, uniform_names),
+                                             _use_frame_uniform_block(fragment_str, uniform_names))
+            except Exception as err:
+                _logger.warning('failed to use the frame uniform block in program "%s", falling back to plain uniforms:\n%s',
+                                program_name, err)
+    if program_id is None:
+        program_id = _create_program(gltf, program_name, vertex_str, fragment_str)
+    if USE_FRAME_UNIFORM_BLOCK:
+        block_index = gl.glGetUniformBlockIndex(program_id, FRAME_UNIFORM_BLOCK_NAME)
+        if block_index != gl.GL_INVALID_INDEX:
+            gl.glUniformBlockBinding(program_id, block_index, FRAME_UNIFORM_BLOCK_BINDING)
+    return program_id
+
+
+def setup_programs(gltf, shader_sources):
+    for program_name in gltf['programs'].keys():
+        setup_program(gltf, program_name, shader_sources)
+
+
+def _get_instance_uniform_names(gltf, program_name):
+    uniform_names = {}
+    for technique in gltf.get('techniques', {}).values():
+        if technique['program'] != program_name:
+            continue
+        for uniform_name, parameter_name in technique['uniforms'].items():
+            parameter = technique['parameters'][parameter_name]
+            semantic = parameter.get('semantic')
+            if semantic is None or semantic in FRAME_UNIFORM_BLOCK_SEMANTICS and 'node' not in parameter:
+                continue
+            if semantic not in INSTANCE_ATTRIBUTE_TYPES or 'node' in parameter:
+                return None
+            if uniform_names.setdefault(semantic, uniform_name) != uniform_name:
+                return None
+    return uniform_names
+
+
+def _use_instance_attributes(vertex_str, fragment_str, uniform_names):
+    """Replaces the declarations of the given uniforms (a dict mapping semantics to uniform names)
+    in a vertex shader source with declarations of per-vertex attributes of the same names.
+    Returns None if the fragment shader also declares any of them."""
+    version_match = re.match(r'\s*#version\s+(\d+)', vertex_str)
+    qualifier = 'in' if version_match and int(version_match.group(1)) >= 130 else 'attribute'
+    for semantic, uniform_name in uniform_names.items():
+        if re.search(r'\buniform\b[^;]*\b%s\b' % re.escape(uniform_name), fragment_str):
+            return None
+        declaration_re = re.compile(r'^([ \t]*)uniform(\s+(?:(?:highp|mediump|lowp)\s+)?%s\s+%s\s*;)'
+                                    % (INSTANCE_ATTRIBUTE_TYPES[semantic], re.escape(uniform_name)), re.MULTILINE)
+        vertex_str = declaration_re.sub(lambda match: match.group(1) + qualifier + match.group(2), vertex_str)
+    return vertex_str
+
+
+def setup_instanced_program(gltf, program_name):
+    """Returns the instanced variant of the given program, creating it on first use, or None if the program
+    does not support instancing.
+
+    Programs whose techniques only use the MODELVIEW, MODELVIEWINVERSETRANSPOSE, PROJECTION and VIEW semantics
+    (without node properties) are supported: in the variant, the MODELVIEW and MODELVIEWINVERSETRANSPOSE uniforms
+    of the vertex shader are replaced by per-instance attributes of the same names, laid out as in `INSTANCE_DTYPE`.
+    The variant is a dict with the program `id` and the `instance_locations` of those attributes
+    (keyed by semantic, -1 for inactive attributes)."""
+    program = gltf['programs'][program_name]
+    if 'instanced' in program:
+        return program['instanced']
+    program['instanced'] = None
+    uniform_names = _get_instance_uniform_names(gltf, program_name)
+    if uniform_names is None or 'shader_sources' not in program:
+        return None
+    vertex_str, fragment_str = program['shader_sources']
+    instanced_vertex_str = _use_instance_attributes(vertex_str, fragment_str, uniform_names)
+    if instanced_vertex_str is None:
+        return None
+    try:
+        program_id = _create_program_variant(gltf, program_name, instanced_vertex_str, fragment_str)
+    except Exception as err:
+        _logger.warning('failed to create an instanced variant of program "%s":\n%s', program_name, err)
+        return None
+    program['instanced'] = {'id': program_id,
+                            'attribute_locations': {attribute_name: gl.glGetAttribLocation(program_id, attribute_name)
+                                                    for attribute_name in program['attributes']},
+                            'instance_locations': {semantic: (gl.glGetAttribLocation(program_id, uniform_names[semantic])
+                                                              if semantic in uniform_names else -1)
+                                                   for semantic in INSTANCE_ATTRIBUTE_TYPES}}
+    _logger.debug('* linked instanced variant of program "%s"\n  instance attribute locations: %s',
+                  program_name, program['instanced']['instance_locations'])
+    return program['instanced']
+
+
+def load_image(gltf, image_name, uri_path):
+    """Loads and decodes the given image, returning a PIL image."""
     # TODO: support data URIs
-    pil_images = {}
-    for image_name, image in gltf.get('images', {}).items():
+    image = gltf['images'][image_name]
+    if 'KHR_binary_glTF' in image.get('extensions', {}):
+        bufferView_name = image['extensions']['KHR_binary_glTF']['bufferView']
+        pil_image = Image.open(io.BytesIO(get_bufferView_data(gltf, bufferView_name)))
+        _logger.debug('* loaded image "%s" (from binary bufferView "%s")', image_name, bufferView_name)
+    else:
         filename = os.path.join(uri_path, image['uri'])
         pil_image = Image.open(filename)
-        pil_images[image_name] = pil_image
         _logger.debug('* loaded image "%s" (from %s)', image_name, filename)
+    pil_image.load()
+    return pil_image
+
+
+def get_texture_pixels(gltf, texture_name, pil_image):
+    """Returns the pixel data of a (decoded) PIL image as a contiguous NumPy array
+    matching the format and type of the given texture, without creating any per-pixel Python objects."""
+    texture = gltf['textures'][texture_name]
+    texture_format = texture.get('format', gl.GL_RGBA)
+    texture_type = texture.get('type', gl.GL_UNSIGNED_BYTE)
+    if texture_format not in GLTF_TEXTURE_FORMAT_MODES:
+        raise Exception('unhandled texture format: %s' % texture_format)
+    if texture_type not in (gl.GL_UNSIGNED_BYTE, gl.GL_UNSIGNED_SHORT):
+        raise Exception('unhandled texture type: %s' % texture_type)
+    mode = GLTF_TEXTURE_FORMAT_MODES[texture_format]
+    if texture_type == gl.GL_UNSIGNED_SHORT and mode == 'L' and pil_image.mode.startswith('I'):
+        # 16-bit grayscale image:
+        return np.ascontiguousarray(np.asarray(pil_image), dtype=np.ushort)
+    if mode == 'A':
+        pil_image = pil_image.getchannel('A') if 'A' in pil_image.getbands() else pil_image.convert('L')
+    elif pil_image.mode != mode:
+        pil_image = pil_image.convert(mode)
+    pixels = np.asarray(pil_image)
+    if texture_type == gl.GL_UNSIGNED_SHORT:
+        # expand 8-bit components to 16 bits:
+        pixels = pixels.astype(np.ushort) * 257
+    return np.ascontiguousarray(pixels)
+
+
+def _get_texture_formats(texture):
+    # returns the target, internal format, format and type of a texture
+    target = texture.get('target', gl.GL_TEXTURE_2D)
+    texture_format = texture.get('format', gl.GL_RGBA)
+    texture_type = texture.get('type', gl.GL_UNSIGNED_BYTE)
+    internal_format = texture.get('internalFormat', texture_format)
+    if texture_type == gl.GL_UNSIGNED_SHORT:
+        internal_format = GLTF_TEXTURE_16BIT_INTERNAL_FORMATS.get(internal_format, internal_format)
+    return target, internal_format, texture_format, texture_type
+
+
+def _setup_sampler(gltf, texture):
+    sampler = gltf['samplers'][texture['sampler']]
+    sampler_id = gl.glGenSamplers(1)
+    gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_MIN_FILTER, sampler.get('minFilter', 9986))
+    gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_MAG_FILTER, sampler.get('magFilter', 9729))
+    gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_WRAP_S, sampler.get('wrapS', 10497))
+    gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_WRAP_T, sampler.get('wrapT', 10497))
+    sampler['id'] = sampler_id
+
+
+def create_texture(gltf, texture_name):
+    """Creates the sampler and texture objects of the given texture, without specifying its image
+    (see `upload_texture_image`)."""
+    texture = gltf['textures'][texture_name]
+    _setup_sampler(gltf, texture)
+    texture['id'] = gl.glGenTextures(1)
+    return texture['id']
+
+
+def upload_texture_image(gltf, texture_name, pixels, unpack_offset=None):
+    """Specifies the image of a texture created by `create_texture` from its pixel data (see `get_texture_pixels`)
+    and generates its mipmaps.  If `unpack_offset` is given, the pixel data is read from that offset
+    of the bound GL_PIXEL_UNPACK_BUFFER (and `pixels` only provides its shape)."""
+    texture = gltf['textures'][texture_name]
+    target, internal_format, texture_format, texture_type = _get_texture_formats(texture)
+    glstate.bind_texture(0, target, texture['id'])
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+    gl.glTexImage2D(target, 0,
+                    internal_format,
+                    pixels.shape[1], pixels.shape[0], 0,
+                    texture_format,
+                    texture_type,
+                    pixels if unpack_offset is None else c_void_p(unpack_offset))
+    gl.glGenerateMipmap(target)
+    if gl.glGetError() != gl.GL_NO_ERROR:
+        raise Exception('failed to upload image of texture "%s"' % texture_name)
+
+
+def get_texture_key(gltf, texture_name, pixels, content_hash=None):
+    """Returns the key of the given texture's pixel data in `setup_texture.texture_ids`, which maps the
+    content of each uploaded texture (its hash, which is computed if not provided, shape and formats) to its id."""
+    if content_hash is None:
+        content_hash = hashlib.sha1(pixels).digest()
+    return (content_hash, pixels.shape, pixels.dtype.str) + _get_texture_formats(gltf['textures'][texture_name])
+
+
+def setup_texture(gltf, texture_name, pixels, content_hash=None):
+    """Creates the texture and sampler objects of the given texture from its pixel data (see `get_texture_pixels`).
+
+    Textures are deduplicated by a hash of their content (see `get_texture_key`):
+    identical images are only uploaded once, even when they belong to different glTFs."""
+    texture = gltf['textures'][texture_name]
+    _setup_sampler(gltf, texture)
+    key = get_texture_key(gltf, texture_name, pixels, content_hash=content_hash)
+    if key in setup_texture.texture_ids:
+        texture['id'] = setup_texture.texture_ids[key]
+        _logger.debug('* reused texture for "%s"', texture_name)
+        return
+    texture['id'] = gl.glGenTextures(1)
+    upload_texture_image(gltf, texture_name, pixels)
+    setup_texture.texture_ids[key] = texture['id']
+    _logger.debug('* created texture "%s"', texture_name)
+setup_texture.texture_ids = {}
+
+
+def setup_textures(gltf, uri_path):
+    pil_images = {}
+    for image_name in gltf.get('images', {}).keys():
+        pil_images[image_name] = load_image(gltf, image_name, uri_path)
     for texture_name, texture in gltf.get('textures', {}).items():
-        sampler = gltf['samplers'][texture['sampler']]
-        texture_id = gl.glGenTextures(1)
-        gl.glBindTexture(texture['target'], texture_id)
-        sampler_id = gl.glGenSamplers(1)
-        gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_MIN_FILTER, sampler.get('minFilter', 9986))
-        gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_MAG_FILTER, sampler.get('magFilter', 9729))
-        gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_WRAP_S, sampler.get('wrapS', 10497))
-        gl.glSamplerParameteri(sampler_id, gl.GL_TEXTURE_WRAP_T, sampler.get('wrapT', 10497))
-        sampler['id'] = sampler_id
-        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
-        if texture['type'] != gl.GL_UNSIGNED_BYTE:
+        setup_texture(gltf, texture_name, get_texture_pixels(gltf, texture_name, pil_images[texture['source']]))
+
+
+def load_buffer(gltf, buffer_name, uri_path):
+    """Loads the data of the given buffer, storing it as the buffer's 'data' property.
+
+    External buffer files are memory-mapped rather than read, and data URIs are decoded,
+    so that the data of each buffer is a flat uint8 NumPy array."""
+    buffer = gltf['buffers'][buffer_name]
+    if 'data' in buffer:
+        return buffer['data']
+    uri = buffer['uri']
+    if uri.startswith('data:application/octet-stream;base64,'):
+        buffer['data'] = np.frombuffer(base64.b64decode(uri.split(',')[1]), dtype=np.ubyte)
+        _logger.debug('* decoded buffer "%s"', buffer_name)
+    else:
+        filename = os.path.join(uri_path, buffer['uri'])
+        if buffer.get('type', 'arraybuffer') == 'arraybuffer':
+            buffer['data'] = np.memmap(filename, dtype=np.ubyte, mode='r')
+        elif buffer['type'] == 'text':
             raise Exception('TODO')
-        gl.glTexImage2D(texture['target'], 0,
-                        texture['internalFormat'],
-                        pil_image.width, pil_image.height, 0,
-                        gl.GL_RGB, #texture['format'], # INVESTIGATE
-                        texture['type'],
-                        np.array(list(pil_image.getdata()), dtype=(np.ubyte if texture['type'] == gl.GL_UNSIGNED_BYTE else np.ushort)))
-        gl.glGenerateMipmap(texture['target'])
-        if gl.glGetError() != gl.GL_NO_ERROR:
-            raise Exception('failed to create texture "%s"' % texture_name)
-        texture['id'] = texture_id
-        _logger.debug('* created texture "%s"', texture_name)
+        _logger.debug('* mapped buffer "%s" (from %s)', buffer_name, filename)
+    return buffer['data']
 
 
-def setup_buffers(gltf, uri_path):
-    buffers = gltf['buffers']
-    data_buffers = {}
-    for buffer_name, buffer in buffers.items():
-        uri = buffer['uri']
-        if uri.startswith('data:application/octet-stream;base64,'):
-            data_buffers[buffer_name] = base64.b64decode(uri.split(',')[1])
+def load_buffers(gltf, uri_path):
+    """Loads the data of all buffers of the given gltf (see `load_buffer`)."""
+    for buffer_name in gltf.get('buffers', {}).keys():
+        load_buffer(gltf, buffer_name, uri_path)
+
+
+def get_bufferView_data(gltf, bufferView_name):
+    """Returns the data of the given bufferView as a uint8 NumPy view (of exactly byteLength bytes)
+    of its buffer's data.  The buffer's data must have been loaded by `load_buffers`."""
+    bufferView = gltf['bufferViews'][bufferView_name]
+    byteOffset = bufferView.get('byteOffset', 0)
+    return gltf['buffers'][bufferView['buffer']]['data'][byteOffset:byteOffset+bufferView['byteLength']]
+
+
+def get_accessor_data(gltf, accessor_name):
+    """Returns the elements of the given accessor as a typed, strided NumPy view of its buffer's data,
+    without copying.  The buffer's data must have been loaded by `load_buffers`.
+
+    The shape of the returned array is (count,) for SCALAR accessors, (count, n) for VECn accessors
+    and (count, n, n) for MATn accessors (the rows of which are the columns of the glTF matrices)."""
+    accessor = gltf['accessors'][accessor_name]
+    dtype = np.dtype(GLTF_COMPONENT_TYPES[accessor['componentType']])
+    num_components = GLTF_BUFFERVIEW_TYPE_SIZES[accessor['type']]
+    byteStride = accessor.get('byteStride', 0) or num_components * dtype.itemsize
+    if accessor['type'] == 'SCALAR':
+        shape, strides = (accessor['count'],), (byteStride,)
+    elif accessor['type'].startswith('MAT'):
+        n = {4: 2, 9: 3, 16: 4}[num_components]
+        shape, strides = (accessor['count'], n, n), (byteStride, n * dtype.itemsize, dtype.itemsize)
+    else:
+        shape, strides = (accessor['count'], num_components), (byteStride, dtype.itemsize)
+    return np.ndarray(shape, dtype=dtype, buffer=get_bufferView_data(gltf, accessor['bufferView']),
+                      offset=accessor.get('byteOffset', 0), strides=strides)
+
+
+def reserve_buffer_arenas(gltf):
+    """Determines the arena alignment of each vertex and index bufferView of the given gltf and reserves arenas
+    (in `glarena.pool`) which fit all of them.
+
+    Vertex bufferViews whose accessors share a stride are aligned to (a multiple of 4 bytes of) that stride,
+    so that their vertices can be addressed by index relative to the start of the arena."""
+    strides = defaultdict(set)
+    for accessor in gltf.get('accessors', {}).values():
+        itemsize = np.dtype(GLTF_COMPONENT_TYPES[accessor['componentType']]).itemsize
+        strides[accessor['bufferView']].add(accessor.get('byteStride', 0) or GLTF_BUFFERVIEW_TYPE_SIZES[accessor['type']] * itemsize)
+    sizes = defaultdict(int)
+    for bufferView_name, bufferView in gltf.get('bufferViews', {}).items():
+        if 'target' not in bufferView or 'arena_alignment' in bufferView:
+            continue
+        if bufferView['target'] == gl.GL_ARRAY_BUFFER and len(strides[bufferView_name]) == 1:
+            stride = next(iter(strides[bufferView_name]))
+            alignment = stride * 4 // math.gcd(stride, 4)
         else:
-            filename = os.path.join(uri_path, buffer['uri'])
-            if buffer['type'] == 'arraybuffer':
-                data_buffers[buffer_name] = open(filename, 'rb').read()
-            elif buffer['type'] == 'text':
-                raise Exception('TODO')
-                #data_buffers[buffer_name] = open(filename, 'r').read()
-            _logger.debug('* loaded buffer "%s" (from %s)', buffer_name, filename)
-    for bufferView_name, bufferView in gltf['bufferViews'].items():
-        buffer_id = gl.glGenBuffers(1)
-        #byteLength = bufferView['byteLength']
-        byteOffset = bufferView['byteOffset']
-        gl.glBindBuffer(bufferView['target'], buffer_id)
-        gl.glBufferData(bufferView['target'], bufferView['byteLength'],
-                        data_buffers[bufferView['buffer']][byteOffset:], gl.GL_STATIC_DRAW)
-        if gl.glGetError() != gl.GL_NO_ERROR:
-            raise Exception('failed to create buffer "%s"' % bufferView_name)
-        bufferView['id'] = buffer_id
-        gl.glBindBuffer(bufferView['target'], 0)
-        _logger.debug('* created buffer "%s"' % bufferView_name)
+            alignment = 4
+        bufferView['arena_alignment'] = alignment
+        sizes[bufferView['target'], _get_arena_group(bufferView)] += bufferView['byteLength'] + alignment - 1
+    for (target, group), size in sizes.items():
+        glarena.pool.reserve(target, size, group=group)
 
 
-def set_technique_state(technique_name, gltf):
-    if set_technique_state.current_technique is not None and set_technique_state.current_technique == technique_name:
+def _get_arena_group(bufferView):
+    # all index data goes to the same arenas; vertex data is grouped by alignment
+    return None if bufferView['target'] == gl.GL_ELEMENT_ARRAY_BUFFER else bufferView['arena_alignment']
+
+
+def allocate_buffer(gltf, bufferView_name):
+    """Creates the buffer object of the given bufferView, or allocates space for its data in a buffer arena
+    (see `USE_BUFFER_ARENAS`), in which case its 'arena_offset' is the offset of its data in the arena's buffer.
+    The data is not uploaded (see `setup_buffer`), so the buffer's data need not have been loaded."""
+    bufferView = gltf['bufferViews'][bufferView_name]
+    if USE_BUFFER_ARENAS:
+        if 'arena_alignment' not in bufferView:
+            reserve_buffer_arenas(gltf)
+        arena, offset = glarena.pool.allocate(bufferView['target'], bufferView['byteLength'],
+                                              alignment=bufferView['arena_alignment'], group=_get_arena_group(bufferView))
+        bufferView['id'] = arena.id
+        bufferView['arena_offset'] = offset
+        _logger.debug('* allocated buffer "%s" in arena %d at offset %d', bufferView_name, arena.id, offset)
         return
-    set_technique_state.current_technique = technique_name
-    technique = gltf['techniques'][technique_name]
+    buffer_id = gl.glGenBuffers(1)
+    glstate.bind_buffer(gl.GL_COPY_WRITE_BUFFER, buffer_id)
+    gl.glBufferData(gl.GL_COPY_WRITE_BUFFER, bufferView['byteLength'], None, gl.GL_STATIC_DRAW)
+    if gl.glGetError() != gl.GL_NO_ERROR:
+        raise Exception('failed to create buffer "%s"' % bufferView_name)
+    bufferView['id'] = buffer_id
+    _logger.debug('* created buffer "%s"' % bufferView_name)
+
+
+def setup_buffer(gltf, bufferView_name):
+    """Creates the buffer object of the given bufferView (see `allocate_buffer`) and uploads its data.
+    The data of its buffer must have been loaded."""
+    allocate_buffer(gltf, bufferView_name)
+    bufferView = gltf['bufferViews'][bufferView_name]
+    glstate.bind_buffer(gl.GL_COPY_WRITE_BUFFER, bufferView['id'])
+    gl.glBufferSubData(gl.GL_COPY_WRITE_BUFFER, bufferView.get('arena_offset', 0), bufferView['byteLength'],
+                       get_bufferView_data(gltf, bufferView_name))
+    if gl.glGetError() != gl.GL_NO_ERROR:
+        raise Exception('failed to upload buffer "%s"' % bufferView_name)
+
+
+def setup_buffers(gltf, uri_path):
+    load_buffers(gltf, uri_path)
+    for bufferView_name, bufferView in gltf['bufferViews'].items():
+        if 'target' not in bufferView:
+            # not vertex or index data (e.g. the shaders and images of a binary glTF)
+            continue
+        setup_buffer(gltf, bufferView_name)
+
+
+def _get_attribute_offsets(primitive, gltf):
+    # absolute byte offsets (in their buffer objects) and strides of the attributes of a primitive
+    accessors = gltf['accessors']
+    bufferViews = gltf['bufferViews']
+    offsets = {}
+    for semantic, accessor_name in primitive['attributes'].items():
+        accessor = accessors[accessor_name]
+        bufferView = bufferViews[accessor['bufferView']]
+        stride = accessor['byteStride'] or (GLTF_BUFFERVIEW_TYPE_SIZES[accessor['type']]
+                                            * np.dtype(GLTF_COMPONENT_TYPES[accessor['componentType']]).itemsize)
+        offsets[semantic] = (bufferView.get('arena_offset', 0) + accessor['byteOffset'], stride)
+    return offsets
+
+
+def get_vertex_format(primitive, gltf):
+    """Returns a hashable description of the vertex format of the given primitive (the buffer object, stride, type and
+    offset relative to the base vertex of each attribute) and its base vertex, the largest vertex index relative
+    to which all attribute offsets are non-negative.  Primitives whose vertex data is interleaved in the same
+    buffer arena (see `USE_BUFFER_ARENAS`) with the same layout have the same vertex format."""
+    accessors = gltf['accessors']
+    offsets = _get_attribute_offsets(primitive, gltf)
+    base_vertex = min([offset // stride for offset, stride in offsets.values()] or [0])
+    vertex_format = tuple((semantic, gltf['bufferViews'][accessors[accessor_name]['bufferView']]['id'], offsets[semantic][1],
+                           accessors[accessor_name]['componentType'], accessors[accessor_name]['type'],
+                           offsets[semantic][0] - base_vertex * offsets[semantic][1])
+                          for semantic, accessor_name in sorted(primitive['attributes'].items()))
+    return vertex_format, base_vertex
+
+
+def _create_vao(primitive, gltf, attribute_locations, base_vertex=0):
+    material = gltf['materials'][primitive['material']]
+    technique = gltf['techniques'][material['technique']]
+    accessors = gltf['accessors']
+    bufferViews = gltf['bufferViews']
+    accessor_names = primitive['attributes']
+    enabled_locations = []
+    offsets = _get_attribute_offsets(primitive, gltf)
+    vao = gl.glGenVertexArrays(1)
+    glstate.bind_vertex_array(vao)
+    for attribute_name, parameter_name in technique['attributes'].items():
+        parameter = technique['parameters'][parameter_name]
+        if 'semantic' in parameter:
+            semantic = parameter['semantic']
+            if semantic in accessor_names:
+                accessor = accessors[accessor_names[semantic]]
+                bufferView = bufferViews[accessor['bufferView']]
+                location = attribute_locations[attribute_name]
+                gl.glEnableVertexAttribArray(location)
+                enabled_locations.append(location)
+                glstate.bind_buffer(bufferView['target'], bufferView['id'])
+                offset, stride = offsets[semantic]
+                gl.glVertexAttribPointer(location, GLTF_BUFFERVIEW_TYPE_SIZES[accessor['type']],
+                                         accessor['componentType'], False, accessor['byteStride'],
+                                         c_void_p(offset - base_vertex * stride))
+            else:
+                raise Exception('expected a semantic property for attribute "%s"' % attribute_name)
+    return vao, enabled_locations
+
+
+def setup_vao(primitive, gltf):
+    """Creates the vertex array object which binds the attributes of the given primitive
+    to the attribute locations of its material's program."""
+    material = gltf['materials'][primitive['material']]
+    technique = gltf['techniques'][material['technique']]
     program = gltf['programs'][technique['program']]
-    gl.glUseProgram(program['id'])
+    vao, enabled_locations = _create_vao(primitive, gltf, program['attribute_locations'])
+    primitive['vao'] = vao
+    glstate.bind_vertex_array(0)
+    for location in enabled_locations:
+        gl.glDisableVertexAttribArray(location)
+    return primitive['vao']
+
+
+def setup_instanced_vao(primitive, gltf, instanced_program, instance_buffer, first_instance, base_vertex=0):
+    """Creates a vertex array object which binds the attributes of the given primitive to the attribute locations
+    of the instanced variant of its material's program, and its per-instance attributes to the `INSTANCE_DTYPE` records
+    of `instance_buffer`, starting with record `first_instance`.
+
+    If a `base_vertex` (see `get_vertex_format`) is given, vertex 0 of the vertex array object is that vertex
+    of the primitive, so that the vertex array object can be shared by all primitives of the same vertex format."""
+    vao, enabled_locations = _create_vao(primitive, gltf, instanced_program['attribute_locations'], base_vertex=base_vertex)
+    glstate.bind_buffer(gl.GL_ARRAY_BUFFER, instance_buffer)
+    for semantic, location in instanced_program['instance_locations'].items():
+        if location == -1:
+            continue
+        num_columns = INSTANCE_DTYPE[semantic].shape[0]
+        byte_offset = first_instance * INSTANCE_DTYPE.itemsize + INSTANCE_DTYPE.fields[semantic][1]
+        for i in range(num_columns):
+            gl.glEnableVertexAttribArray(location + i)
+            enabled_locations.append(location + i)
+            gl.glVertexAttribPointer(location + i, num_columns, gl.GL_FLOAT, False, INSTANCE_DTYPE.itemsize,
+                                     c_void_p(byte_offset + 4 * num_columns * i))
+            gl.glVertexAttribDivisor(location + i, 1)
+    glstate.bind_vertex_array(0)
+    glstate.bind_buffer(gl.GL_ARRAY_BUFFER, 0)
+    for location in enabled_locations:
+        gl.glDisableVertexAttribArray(location)
+    return vao
+
+
+def set_technique_state(technique_name, gltf, program_id=None):
+    """Sets the program (by default, the technique's program) and the enabled states of the given technique."""
+    technique = gltf['techniques'][technique_name]
+    if program_id is None:
+        program_id = gltf['programs'][technique['program']]['id']
+    if glstate.use_program(program_id):
+        global num_program_changes
+        num_program_changes += 1
     enabled_states = technique.get('states', {}).get('enable', [])
-    for state, is_enabled in list(set_technique_state.states.items()):
-        if state in enabled_states:
-            if not is_enabled:
-                gl.glEnable(state)
-                set_technique_state.states[state] = True
-        elif is_enabled:
-            gl.glDisable(state)
-            set_technique_state.states[state] = False
-    for state in enabled_states:
-        if state not in set_technique_state.states:
-            gl.glEnable(state)
-            set_technique_state.states[state] = True
-set_technique_state.current_technique = None
-set_technique_state.states = {}
+    for state in GLTF_TECHNIQUE_STATES:
+        glstate.set_enabled(state, state in enabled_states)
+num_program_changes = 0
 
 
-def set_material_state(material_name, gltf):
-    if set_material_state.current_material == material_name:
-        return
-    set_material_state.current_material = material_name
+class BindingPlan(object):
+    """Precompiled state of a material and its technique, as produced by `compile_binding_plan`.
+
+    `uniform_calls` is a list of (setter, args) pairs, where each setter is a GL uniform function
+    and its args include the resolved location and the pre-packed value; `texture_bindings` is a list of
+    (texture unit, target, texture id, sampler id) tuples; `semantic_uniforms` is a list of
+    (semantic, location, node name or None) tuples for the technique's semantic uniforms."""
+    __slots__ = ('technique_name', 'program_id', 'uniform_calls', 'texture_bindings', 'semantic_uniforms')
+    def __init__(self, technique_name, program_id, uniform_calls, texture_bindings, semantic_uniforms):
+        self.technique_name = technique_name
+        self.program_id = program_id
+        self.uniform_calls = uniform_calls
+        self.texture_bindings = texture_bindings
+        self.semantic_uniforms = semantic_uniforms
+
+
+def compile_binding_plan(gltf, material_name, program_id=None):
+    """Compiles the given material and its technique into a `BindingPlan`: uniform locations are resolved once,
+    parameter values are packed into NumPy arrays and each sampler uniform is assigned its own texture unit.
+    If `program_id` is given, it replaces the technique's program (e.g. by its instanced variant)."""
     material = gltf['materials'][material_name]
-    set_technique_state(material['technique'], gltf)
     technique = gltf['techniques'][material['technique']]
-    program = gltf['programs'][technique['program']]
+    if program_id is None:
+        program_id = gltf['programs'][technique['program']]['id']
     textures = gltf.get('textures', {})
     samplers = gltf.get('samplers', {})
     material_values = material.get('values', {})
-    for uniform_name, parameter_name in technique['uniforms'].items():
+    uniform_calls = []
+    texture_bindings = []
+    semantic_uniforms = []
+    for uniform_name, parameter_name in sorted(technique['uniforms'].items()):
         parameter = technique['parameters'][parameter_name]
+        location = gl.glGetUniformLocation(program_id, uniform_name)
         if 'semantic' in parameter:
+            semantic_uniforms.append((parameter['semantic'], location, parameter.get('node')))
             continue
         value = material_values.get(parameter_name, parameter.get('value'))
-        if value:
-            if uniform_name in program['uniform_locations']:
-                location = program['uniform_locations'][uniform_name]
-            else:
-                location = gl.glGetUniformLocation(program['id'], uniform_name)
-                program['uniform_locations'][uniform_name] = location
-            if parameter['type'] == gl.GL_SAMPLER_2D:
-                texture = textures[value]
-                gl.glActiveTexture(gl.GL_TEXTURE0+0)
-                gl.glBindTexture(texture['target'], texture['id'])
-                gl.glBindSampler(0, samplers[texture['sampler']]['id'])
-                gl.glUniform1i(location, 0)
-            elif parameter['type'] == gl.GL_FLOAT:
-                gl.glUniform1f(location, value)
-            elif parameter['type'] == gl.GL_FLOAT_VEC2:
-                gl.glUniform2f(location, *value)
-            elif parameter['type'] == gl.GL_FLOAT_VEC3:
-                gl.glUniform3f(location, *value)
-            elif parameter['type'] == gl.GL_FLOAT_VEC4:
-                gl.glUniform4f(location, *value)
-            else:
-                raise Exception('unhandled parameter type: %s' % parameter['type'])
-        else:
+        if value is None:
             raise Exception('no value provided for parameter "%s"' % parameter_name)
+        if location == -1:
+            # inactive uniform
+            continue
+        if parameter['type'] == gl.GL_SAMPLER_2D:
+            texture = textures[value]
+            unit = len(texture_bindings)
+            texture_bindings.append((unit, texture.get('target', gl.GL_TEXTURE_2D), texture['id'], samplers[texture['sampler']]['id']))
+            uniform_calls.append((gl.glUniform1i, (location, unit)))
+        elif parameter['type'] in GLTF_UNIFORM_VECTOR_SETTERS:
+            setter, dtype = GLTF_UNIFORM_VECTOR_SETTERS[parameter['type']]
+            uniform_calls.append((setter, (location, 1, np.array(value, dtype=dtype).ravel())))
+        elif parameter['type'] in GLTF_UNIFORM_MATRIX_SETTERS:
+            setter = GLTF_UNIFORM_MATRIX_SETTERS[parameter['type']]
+            uniform_calls.append((setter, (location, 1, False, np.array(value, dtype=np.float32).ravel())))
+        else:
+            raise Exception('unhandled parameter type: %s' % parameter['type'])
+    return BindingPlan(material['technique'], program_id, uniform_calls, texture_bindings, semantic_uniforms)
+
+
+def apply_binding_plan(binding_plan, gltf):
+    """Applies a `BindingPlan`.  Textures which are already bound to their units and uniform values which were
+    already set on the program by the same plan (see `glstate`) are skipped."""
+    global num_material_changes, num_texture_binds
+    set_technique_state(binding_plan.technique_name, gltf, program_id=binding_plan.program_id)
+    for unit, target, texture_id, sampler_id in binding_plan.texture_bindings:
+        if glstate.bind_texture(unit, target, texture_id):
+            num_texture_binds += 1
+        glstate.bind_sampler(unit, sampler_id)
+    glstate.set_uniforms(binding_plan.program_id, binding_plan, binding_plan.uniform_calls)
+    num_material_changes += 1
     if CHECK_GL_ERRORS:
         if gl.glGetError() != gl.GL_NO_ERROR:
             raise Exception('error setting material state')
-set_material_state.current_material = None
+num_material_changes = 0
+num_texture_binds = 0
+
+
+def get_binding_plan(gltf, material_name):
+    """Returns the `BindingPlan` of the given material, compiling it on first use."""
+    material = gltf['materials'][material_name]
+    if 'binding_plan' not in material:
+        material['binding_plan'] = compile_binding_plan(gltf, material_name)
+    return material['binding_plan']
+
+
+def set_material_state(material_name, gltf):
+    apply_binding_plan(get_binding_plan(gltf, material_name), gltf)
+
+
+def update_frame_uniforms(projection_matrix=None, view_matrix=None):
+    """Uploads the per-frame matrices shared by all programs to the frame uniform buffer
+    (see `USE_FRAME_UNIFORM_BLOCK`), creating it and binding it on first use.
+    `render_draw_list` calls this itself; it must be called before drawing with `draw_node`."""
+    if update_frame_uniforms.buffer_id is None:
+        update_frame_uniforms.buffer_id = gl.glGenBuffers(1)
+        glstate.bind_buffer(gl.GL_UNIFORM_BUFFER, update_frame_uniforms.buffer_id)
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, update_frame_uniforms.data.nbytes, update_frame_uniforms.data, gl.GL_DYNAMIC_DRAW)
+        glstate.bind_buffer_base(gl.GL_UNIFORM_BUFFER, FRAME_UNIFORM_BLOCK_BINDING, update_frame_uniforms.buffer_id)
+    if projection_matrix is not None:
+        update_frame_uniforms.data[0] = projection_matrix
+    if view_matrix is not None:
+        update_frame_uniforms.data[1] = view_matrix
+    glstate.bind_buffer(gl.GL_UNIFORM_BUFFER, update_frame_uniforms.buffer_id)
+    gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, 0, update_frame_uniforms.data.nbytes, update_frame_uniforms.data)
+update_frame_uniforms.buffer_id = None
+update_frame_uniforms.data = np.zeros((len(FRAME_UNIFORM_BLOCK_SEMANTICS), 4, 4), dtype=np.float32)
 
 
 def set_draw_state(primitive, gltf,
                    modelview_matrix=None,
                    projection_matrix=None,
                    view_matrix=None,
-                   normal_matrix=None):
+                   normal_matrix=None,
+                   joint_matrices=None):
     set_material_state(primitive['material'], gltf)
-    material = gltf['materials'][primitive['material']]
-    technique = gltf['techniques'][material['technique']]
-    program = gltf['programs'][technique['program']]
-    accessors = gltf['accessors']
-    bufferViews = gltf['bufferViews']
-    accessor_names = primitive['attributes']
-    for uniform_name, parameter_name in technique['uniforms'].items():
-        parameter = technique['parameters'][parameter_name]
-        if 'semantic' in parameter:
-            location = gl.glGetUniformLocation(program['id'], uniform_name)
-            if parameter['semantic'] == 'MODELVIEW':
-                if 'node' in parameter and view_matrix is not None:
-                    world_matrix = gltf['nodes'][parameter['node']]['world_matrix']
-                    world_matrix.dot(view_matrix, out=set_draw_state.modelview_matrix)
-                    gl.glUniformMatrix4fv(location, 1, False, set_draw_state.modelview_matrix)
-                elif modelview_matrix is not None:
-                    gl.glUniformMatrix4fv(location, 1, False, modelview_matrix)
-            elif parameter['semantic'] == 'PROJECTION':
-                if 'node' in parameter:
-                    raise Exception('TODO')
-                elif projection_matrix is not None:
-                    gl.glUniformMatrix4fv(location, 1, False, projection_matrix)
-            elif parameter['semantic'] == 'MODELVIEWINVERSETRANSPOSE':
-                if 'node' in parameter:
-                    raise Exception('TODO')
-                elif normal_matrix is not None:
-                    gl.glUniformMatrix3fv(location, 1, True, normal_matrix)
-            else:
-                raise Exception('unhandled semantic: %s' % parameter['semantic'])
+    binding_plan = get_binding_plan(gltf, primitive['material'])
+    for semantic, location, node_name in binding_plan.semantic_uniforms:
+        if location == -1:
+            continue
+        if semantic == 'MODELVIEW':
+            if node_name is not None and view_matrix is not None:
+                world_matrix = gltf['nodes'][node_name]['world_matrix']
+                world_matrix.dot(view_matrix, out=set_draw_state.modelview_matrix)
+                gl.glUniformMatrix4fv(location, 1, False, set_draw_state.modelview_matrix)
+            elif modelview_matrix is not None:
+                gl.glUniformMatrix4fv(location, 1, False, modelview_matrix)
+        elif semantic == 'PROJECTION':
+            if node_name is not None:
+                raise Exception('TODO')
+            elif projection_matrix is not None:
+                gl.glUniformMatrix4fv(location, 1, False, projection_matrix)
+        elif semantic == 'VIEW':
+            if node_name is not None:
+                raise Exception('TODO')
+            elif view_matrix is not None:
+                gl.glUniformMatrix4fv(location, 1, False, view_matrix)
+        elif semantic == 'MODELVIEWINVERSETRANSPOSE':
+            if node_name is not None:
+                raise Exception('TODO')
+            elif normal_matrix is not None:
+                gl.glUniformMatrix3fv(location, 1, True, normal_matrix)
+        elif semantic == 'JOINTMATRIX':
+            if joint_matrices is not None:
+                gl.glUniformMatrix4fv(location, len(joint_matrices), False, joint_matrices)
+        else:
+            raise Exception('unhandled semantic: %s' % semantic)
     if 'vao' not in primitive:
-        enabled_locations = []
-        buffer_id = None
-        vao = gl.glGenVertexArrays(1)
-        gl.glBindVertexArray(vao)
-        for attribute_name, parameter_name in technique['attributes'].items():
-            parameter = technique['parameters'][parameter_name]
-            if 'semantic' in parameter:
-                semantic = parameter['semantic']
-                if semantic in accessor_names:
-                    accessor = accessors[accessor_names[semantic]]
-                    bufferView = bufferViews[accessor['bufferView']]
-                    location = program['attribute_locations'][attribute_name]
-                    gl.glEnableVertexAttribArray(location)
-                    enabled_locations.append(location)
-                    if buffer_id != bufferView['id']:
-                        buffer_id = bufferView['id']
-                        gl.glBindBuffer(bufferView['target'], buffer_id)
-                    gl.glVertexAttribPointer(location, GLTF_BUFFERVIEW_TYPE_SIZES[accessor['type']],
-                                             accessor['componentType'], False, accessor['byteStride'], c_void_p(accessor['byteOffset']))
-                else:
-                    raise Exception('expected a semantic property for attribute "%s"' % attribute_name)
-        primitive['vao'] = vao
-        gl.glBindVertexArray(0)
-        for location in enabled_locations:
-            gl.glDisableVertexAttribArray(location)
-    gl.glBindVertexArray(primitive['vao'])
+        setup_vao(primitive, gltf)
+    glstate.bind_vertex_array(primitive['vao'])
     if CHECK_GL_ERRORS:
         if gl.glGetError() != gl.GL_NO_ERROR:
             raise Exception('error setting draw state')
@@ -273,17 +998,19 @@ def draw_primitive(primitive, gltf,
                    modelview_matrix=None,
                    projection_matrix=None,
                    view_matrix=None,
-                   normal_matrix=None):
+                   normal_matrix=None,
+                   joint_matrices=None):
     set_draw_state(primitive, gltf,
                    modelview_matrix=modelview_matrix,
                    projection_matrix=projection_matrix,
                    view_matrix=view_matrix,
-                   normal_matrix=normal_matrix)
+                   normal_matrix=normal_matrix,
+                   joint_matrices=joint_matrices)
     index_accessor = gltf['accessors'][primitive['indices']]
     index_bufferView = gltf['bufferViews'][index_accessor['bufferView']]
-    gl.glBindBuffer(index_bufferView['target'], index_bufferView['id'])
+    glstate.bind_buffer(index_bufferView['target'], index_bufferView['id'])
     gl.glDrawElements(primitive['mode'], index_accessor['count'], index_accessor['componentType'],
-                      c_void_p(index_accessor['byteOffset']))
+                      c_void_p(index_bufferView.get('arena_offset', 0) + index_accessor['byteOffset']))
     global num_draw_calls
     num_draw_calls += 1
     if CHECK_GL_ERRORS:
@@ -296,13 +1023,15 @@ def draw_mesh(mesh, gltf,
               modelview_matrix=None,
               projection_matrix=None,
               view_matrix=None,
-              normal_matrix=None):
+              normal_matrix=None,
+              joint_matrices=None):
     for i, primitive in enumerate(mesh['primitives']):
         draw_primitive(primitive, gltf,
                        modelview_matrix=(modelview_matrix if i == 0 else None),
                        projection_matrix=(projection_matrix if i == 0 else None),
                        view_matrix=(view_matrix if i == 0 else None),
-                       normal_matrix=(normal_matrix if i == 0 else None))
+                       normal_matrix=(normal_matrix if i == 0 else None),
+                       joint_matrices=(joint_matrices if i == 0 else None))
 
 
 def draw_node(node, gltf,
@@ -310,16 +1039,721 @@ def draw_node(node, gltf,
     node['world_matrix'].dot(view_matrix, out=draw_node.modelview_matrix)
     normal_matrix = np.linalg.inv(draw_node.modelview_matrix[:3,:3])
     meshes = node.get('meshes', [])
+    joint_matrices = gltfskin.calc_joint_matrices(gltf, node) if 'skin' in node and meshes else None
     for mesh_name in meshes:
         draw_mesh(gltf['meshes'][mesh_name], gltf,
                   modelview_matrix=draw_node.modelview_matrix,
-                  projection_matrix=projection_matrix, view_matrix=view_matrix, normal_matrix=normal_matrix)
+                  projection_matrix=projection_matrix, view_matrix=view_matrix, normal_matrix=normal_matrix,
+                  joint_matrices=joint_matrices)
     for child in node['children']:
         draw_node(gltf['nodes'][child], gltf,
                   projection_matrix=projection_matrix, view_matrix=view_matrix)
 draw_node.modelview_matrix = np.empty((4,4), dtype=np.float32)
 
 
+DRAW_RECORD_DTYPE = np.dtype([('program', np.uint32),
+                              ('vao', np.uint32),
+                              ('index_buffer', np.uint32),
+                              ('mode', np.uint32),
+                              ('count', np.int32),
+                              ('component_type', np.uint32),
+                              ('byte_offset', np.int64),
+                              ('material', np.int32),
+                              ('node', np.int32),
+                              ('modelview_location', np.int32),
+                              ('projection_location', np.int32),
+                              ('view_location', np.int32),
+                              ('normal_location', np.int32),
+                              ('joint_matrix_location', np.int32),
+                              ('skin', np.int32),
+                              ('instance_count', np.int32)])
+
+
+def get_primitive_bounds(gltf, primitive):
+    """Returns the (min, max) corners of the local bounding box of a primitive, or None if it has no POSITION attribute.
+
+    The min and max properties of the POSITION accessor are used when present,
+    otherwise the bounds are computed from the position data."""
+    if 'bounds' not in primitive:
+        accessor_name = primitive['attributes'].get('POSITION')
+        if accessor_name is None:
+            primitive['bounds'] = None
+        else:
+            accessor = gltf['accessors'][accessor_name]
+            if 'min' in accessor and 'max' in accessor:
+                primitive['bounds'] = (np.array(accessor['min'][:3], dtype=np.float32),
+                                       np.array(accessor['max'][:3], dtype=np.float32))
+            else:
+                positions = get_accessor_data(gltf, accessor_name)[:,:3]
+                primitive['bounds'] = (positions.min(axis=0).astype(np.float32),
+                                       positions.max(axis=0).astype(np.float32))
+    return primitive['bounds']
+
+
+def get_primitive_triangle_tree(gltf, primitive):
+    """Returns the `gltfbounds.TriangleTree` of a primitive (built from its POSITION and index data once, and stored as
+    its 'triangle_tree' property, so that it is shared by all nodes of its mesh), or None if it does not consist of
+    triangles (GL_TRIANGLES) or has no POSITION attribute."""
+    if 'triangle_tree' not in primitive:
+        accessor_name = primitive['attributes'].get('POSITION')
+        if accessor_name is None or primitive.get('mode', gl.GL_TRIANGLES) != gl.GL_TRIANGLES:
+            primitive['triangle_tree'] = None
+        else:
+            primitive['triangle_tree'] = gltfbounds.TriangleTree(get_accessor_data(gltf, accessor_name)[:,:3],
+                                                                 get_accessor_data(gltf, primitive['indices']))
+    return primitive['triangle_tree']
+
+
+def get_primitive_lods(gltf, primitive):
+    """Returns the (index buffer, count, byte offset) of each level of detail of a primitive, finest first, as listed
+    in the `lods` of its extras (see gltfopt.py).  Levels whose indices differ in type from the primitive's are ignored."""
+    if 'lod_ranges' not in primitive:
+        index_accessor = gltf['accessors'][primitive['indices']]
+        lod_ranges = []
+        for lod in primitive.get('extras', {}).get('lods', []):
+            accessor = gltf['accessors'][lod['indices']]
+            if accessor['componentType'] != index_accessor['componentType']:
+                _logger.warning('* ignoring level of detail "%s" (its index type differs from "%s")',
+                                lod['indices'], primitive['indices'])
+                continue
+            bufferView = gltf['bufferViews'][accessor['bufferView']]
+            if 'id' not in bufferView:
+                setup_buffer(gltf, accessor['bufferView'])
+            lod_ranges.append((bufferView['id'], accessor['count'],
+                               bufferView.get('arena_offset', 0) + accessor.get('byteOffset', 0)))
+        primitive['lod_ranges'] = lod_ranges
+    return primitive['lod_ranges']
+
+
+class DrawList(object):
+    """Flattened form of a scene, as produced by `compile_draw_list`.
+
+    `records` holds one `DRAW_RECORD_DTYPE` record per primitive, in traversal order.
+    The `material` field of a record indexes into `material_names` and `binding_plans`, and the `node` field
+    indexes into the arrays of the `NodeHierarchy` the draw list was compiled against.
+
+    `centers` and `extents` hold the local bounding box of each record's primitive, and `world_centers`,
+    `world_extents` its world-space bounding box, which is recomputed from the hierarchy's world matrices
+    whenever they have been updated.  Records whose primitive has no bounds (`bounded` is False) are never culled.
+
+    Records which are drawn by instancing have the index of their instance group in `instance_groups` (-1 otherwise).
+    Each group is drawn with the record `instance_records[group]` (which uses the instanced program variant and
+    a vertex array object sourcing per-instance attributes from `instance_buffer`), in place of its first visible member.
+    The `INSTANCE_DTYPE` records of group g occupy `instance_data[instance_offsets[g]:]`.
+
+    Records which are drawn by multi-draw indirect calls have the index of their multi-draw group in `multi_draw_groups`
+    (-1 otherwise).  Each group is drawn with the record `multi_draw_records[group]`, whose vertex array object is shared
+    by the primitives of the group's vertex format and sources per-instance attributes from `multi_draw_instance_buffer`,
+    with one `DRAW_ELEMENTS_INDIRECT_COMMAND_DTYPE` command per visible primitive (`draw_commands` holds the static part
+    of the command of each record, and `multi_draw_primitives` identifies its primitive).
+
+    `sort_keys` holds the state part of each record's 64-bit sort key (see `sort`), and `blended` is True
+    for records whose technique enables blending.
+
+    `primitives` holds the primitive (dict) of each record.  Records whose `enabled` flag is False are not drawn
+    (e.g. while their data is still being loaded, see `gltfloader.StreamingLoader`).
+
+    The `skin` field of the records of skinned nodes indexes into the palettes of `skin_palettes`
+    (a `gltfskin.SkinPalettes`), which are uploaded to the records' JOINTMATRIX uniform arrays.
+    Skinned records are never culled, since their vertices may move beyond the bounds of their bind pose.
+
+    Records of primitives with levels of detail have their number of levels in `num_lods`; the (n,L) arrays
+    `lod_index_buffers`, `lod_counts` and `lod_byte_offsets` hold the index range of each level (level 0 being the
+    record's own, and unused levels repeating the last one), and `lod_levels` the level each record is drawn at,
+    as chosen by `select_lods`.
+
+    Records of (unskinned) triangle primitives with POSITION attributes are `pickable` (see `pick`);
+    `triangle_trees` holds the `gltfbounds.TriangleTree` of each record's primitive once it has been built."""
+    def __init__(self, records, material_names, binding_plans, hierarchy, bounds=None,
+                 instance_groups=None, instance_records=None, instance_buffer=None,
+                 sort_keys=None, blended=None,
+                 multi_draw_groups=None, multi_draw_records=None, multi_draw_instance_buffer=None,
+                 draw_commands=None, multi_draw_primitives=None, skin_palettes=None,
+                 num_lods=None, lod_index_buffers=None, lod_counts=None, lod_byte_offsets=None, primitives=None):
+        self.records = records
+        self.primitives = primitives
+        self.material_names = material_names
+        self.binding_plans = binding_plans
+        self.hierarchy = hierarchy
+        self._rows = records.tolist()
+        n = len(records)
+        self.bounded = np.zeros(n, dtype=np.bool_)
+        self.centers = np.zeros((n, 3), dtype=np.float32)
+        self.extents = np.zeros((n, 3), dtype=np.float32)
+        for i, primitive_bounds in enumerate(bounds or []):
+            if primitive_bounds is not None:
+                self.bounded[i] = True
+                self.centers[i] = 0.5 * (primitive_bounds[0] + primitive_bounds[1])
+                self.extents[i] = 0.5 * (primitive_bounds[1] - primitive_bounds[0])
+        self.world_centers = None
+        self.world_extents = None
+        self._bounds_version = None
+        self._bvh = None
+        if instance_groups is None:
+            instance_groups = np.full(n, -1, dtype=np.int32)
+        self.instance_groups = instance_groups
+        self.instance_records = instance_records if instance_records is not None else np.zeros(0, dtype=DRAW_RECORD_DTYPE)
+        self.instance_buffer = instance_buffer
+        group_sizes = np.bincount(instance_groups[instance_groups >= 0], minlength=len(self.instance_records))
+        self.instance_offsets = np.cumsum(group_sizes) - group_sizes
+        self.instance_data = np.zeros(group_sizes.sum(), dtype=INSTANCE_DTYPE)
+        self._instance_rows = self.instance_records.tolist()
+        self._instance_nodes = self._instance_destinations = None
+        self.sort_keys = sort_keys if sort_keys is not None else np.zeros(n, dtype=np.uint64)
+        self.blended = blended if blended is not None else np.zeros(n, dtype=np.bool_)
+        self.multi_draw_groups = multi_draw_groups if multi_draw_groups is not None else np.full(n, -1, dtype=np.int32)
+        self.multi_draw_records = multi_draw_records if multi_draw_records is not None else np.zeros(0, dtype=DRAW_RECORD_DTYPE)
+        self.multi_draw_instance_buffer = multi_draw_instance_buffer
+        self.draw_commands = draw_commands if draw_commands is not None else np.zeros(n, dtype=DRAW_ELEMENTS_INDIRECT_COMMAND_DTYPE)
+        self.multi_draw_primitives = multi_draw_primitives if multi_draw_primitives is not None else np.zeros(n, dtype=np.int32)
+        self.multi_draw_instance_data = np.zeros(np.count_nonzero(self.multi_draw_groups >= 0), dtype=INSTANCE_DTYPE)
+        self.indirect_buffer = None
+        self._multi_draw_rows = self.multi_draw_records.tolist()
+        self._multi_draw_nodes = self._multi_draw_commands = None
+        self.skin_palettes = skin_palettes
+        self.bounded[records['skin'] >= 0] = False
+        self.num_lods = num_lods if num_lods is not None else np.zeros(n, dtype=np.intp)
+        self.lod_index_buffers = lod_index_buffers if lod_index_buffers is not None else records['index_buffer'][:,np.newaxis]
+        self.lod_counts = lod_counts if lod_counts is not None else records['count'][:,np.newaxis]
+        self.lod_byte_offsets = lod_byte_offsets if lod_byte_offsets is not None else records['byte_offset'][:,np.newaxis]
+        self.lod_levels = np.zeros(n, dtype=np.intp)
+        self.enabled = np.ones(n, dtype=np.bool_)
+        self.is_triangles = records['mode'] == gl.GL_TRIANGLES
+        self._index_sizes = np.array([np.dtype(GLTF_COMPONENT_TYPES[component_type]).itemsize
+                                      for component_type in records['component_type'].tolist()], dtype=np.intp)
+        self.triangle_trees = [None] * n
+        # skinned vertices may move away from the triangles of the primitive:
+        self.pickable = self.is_triangles & (records['skin'] < 0)
+        if primitives is None:
+            self.pickable[:] = False
+        else:
+            self.pickable &= np.array(['POSITION' in primitive['attributes'] for primitive in primitives], dtype=np.bool_).reshape(n)
+    def __len__(self):
+        return len(self.records)
+    def update_world_bounds(self):
+        """Recomputes the world-space bounding boxes if the world matrices of the hierarchy have changed."""
+        if self._bounds_version == self.hierarchy.version:
+            return
+        self.world_centers, self.world_extents = gltfbounds.transform_boxes(
+            self.centers, self.extents, self.hierarchy.world_matrices[self.records['node']])
+        if len(self) >= CULLING_BVH_MIN_RECORDS:
+            if self._bvh is None:
+                self._bvh = gltfbounds.BoxTree(self.world_centers, self.world_extents)
+            else:
+                self._bvh.refit(self.world_centers, self.world_extents)
+        self._bounds_version = self.hierarchy.version
+    def cull(self, projection_matrix, view_matrix):
+        """Returns the (sorted) indices of the records whose bounding boxes are not entirely outside the view frustum.
+        If stacks of (V,4,4) projection and view matrices are given, the records visible in any of the views are returned."""
+        self.update_world_bounds()
+        if view_matrix.ndim == 2:
+            projection_matrix, view_matrix = projection_matrix[np.newaxis], view_matrix[np.newaxis]
+        planes = [gltfbounds.calc_frustum_planes(view.dot(projection))
+                  for projection, view in zip(projection_matrix, view_matrix)]
+        if self._bvh is not None:
+            visible = functools.reduce(np.union1d, [self._bvh.query_frustum(view_planes, self.world_centers, self.world_extents)
+                                                    for view_planes in planes])
+            if not self.bounded.all():
+                visible = np.union1d(visible, np.flatnonzero(~self.bounded))
+            return visible
+        visible = ~self.bounded
+        for view_planes in planes:
+            visible |= gltfbounds.test_frustum(view_planes, self.world_centers, self.world_extents)
+        return np.flatnonzero(visible)
+    def sort(self, visible, view_matrix):
+        """Returns the indices `visible` reordered by their 64-bit sort keys for the given view.
+
+        Opaque records are drawn first, sorted by program, then material, then view depth (front to back);
+        blended records are drawn last, sorted by view depth (back to front), then program, then material.
+        Depths are those of the centers of the world-space bounding boxes, quantized by taking the bit patterns
+        of their (non-negative) float32 values, which preserve their order."""
+        self.update_world_bounds()
+        depths = -(self.world_centers[visible].dot(view_matrix[:3,2]) + view_matrix[3,2])
+        depth_keys = np.maximum(depths, 0).astype(np.float32).view(np.uint32).astype(np.uint64)
+        keys = self.sort_keys[visible]
+        blended = self.blended[visible]
+        keys[~blended] |= depth_keys[~blended]
+        keys[blended] |= (np.uint64(0xffffffff) - depth_keys[blended]) << np.uint64(31)
+        return visible[np.argsort(keys, kind='stable')]
+    def select_lods(self, visible, projection_matrix, view_matrix):
+        """Chooses the level of detail of each of the records at the indices `visible` (see `LOD_SCREEN_SIZES`)
+        from the projected size of its world-space bounding sphere, and stores it in `lod_levels`.
+        For stacks of (V,4,4) projection and view matrices, the first projection and the mean view are used."""
+        if view_matrix.ndim == 3:
+            projection_matrix, view_matrix = projection_matrix[0], view_matrix.mean(axis=0)
+        visible = visible[self.num_lods[visible] > 0]
+        if not len(visible):
+            return
+        self.update_world_bounds()
+        radii = np.linalg.norm(self.world_extents[visible], axis=1)
+        if projection_matrix[3,3] == 0:
+            # perspective projection: sizes shrink with the view depth (records the camera is inside of are full size)
+            depths = -(self.world_centers[visible].dot(view_matrix[:3,2]) + view_matrix[3,2])
+            sizes = np.where(depths > radii, radii * projection_matrix[1,1] / np.maximum(depths, 1e-6), np.inf)
+        else:
+            sizes = radii * projection_matrix[1,1]
+        thresholds = np.array(LOD_SCREEN_SIZES)
+        # the levels to switch to when the size has shrunk or grown beyond the hysteresis band of a threshold:
+        coarser = (sizes[:,np.newaxis] < (1 - LOD_HYSTERESIS) * thresholds).sum(axis=1)
+        finer = (sizes[:,np.newaxis] < (1 + LOD_HYSTERESIS) * thresholds).sum(axis=1)
+        levels = self.lod_levels[visible]
+        levels = np.where(coarser > levels, coarser, np.minimum(levels, finer))
+        self.lod_levels[visible] = np.minimum(levels, self.num_lods[visible])
+    def pick(self, origin, direction, gltf):
+        """Returns the (record index, distance, triangle index) of the nearest triangle hit by the world-space ray from
+        `origin` along `direction` (distances being in units of its length), or None if it hits no triangle.
+
+        The ray is first tested against the world-space bounding boxes of all records, then the records whose boxes
+        it enters are tested nearest first, by intersecting the ray (transformed to the space of the record's node)
+        with the triangle tree of its primitive, until the next box lies beyond the nearest hit.
+        Triangle trees are built when the boxes of their records are first entered (see `get_primitive_triangle_tree`),
+        so that the first picks of large meshes take longer.  Only enabled, `pickable` records are picked."""
+        self.update_world_bounds()
+        origin = np.asarray(origin, dtype=np.float32)
+        direction = np.asarray(direction, dtype=np.float32)
+        candidates = np.flatnonzero(self.pickable & self.enabled)
+        entries = gltfbounds.intersect_ray_boxes(origin, direction,
+                                                 self.world_centers[candidates], self.world_extents[candidates])
+        order = np.argsort(entries)
+        order = order[np.isfinite(entries[order])]
+        nearest = None
+        nearest_distance = np.inf
+        for i, entry in zip(candidates[order].tolist(), entries[order].tolist()):
+            if entry > nearest_distance:
+                break
+            if self.triangle_trees[i] is None:
+                self.triangle_trees[i] = get_primitive_triangle_tree(gltf, self.primitives[i])
+            inverse_world_matrix = np.linalg.inv(self.hierarchy.world_matrices[self.records['node'][i]])
+            hit = self.triangle_trees[i].intersect_ray(origin.dot(inverse_world_matrix[:3,:3]) + inverse_world_matrix[3,:3],
+                                                       direction.dot(inverse_world_matrix[:3,:3]),
+                                                       max_distance=nearest_distance)
+            if hit is not None:
+                nearest_distance = hit[0]
+                nearest = (i, hit[0], hit[1])
+        return nearest
+    def _get_record_rows(self, indices):
+        # returns the rows of the records at the given indices, with the index ranges of their levels of detail
+        rows = self._rows
+        record_rows = [rows[i] for i in indices.tolist()]
+        levels = self.lod_levels[indices]
+        for position in np.flatnonzero(levels).tolist():
+            i, level = indices[position], levels[position]
+            row = record_rows[position]
+            record_rows[position] = (row[:2] + (int(self.lod_index_buffers[i, level]),) + row[3:4] +
+                                     (int(self.lod_counts[i, level]),) + row[5:6] +
+                                     (int(self.lod_byte_offsets[i, level]),) + row[7:])
+        return record_rows
+    def get_rows(self, visible):
+        """Returns the rows (tuples of `DRAW_RECORD_DTYPE` fields) to draw for the records at the indices `visible`,
+        replacing the members of each instance group by a single instanced row and the members of each multi-draw group
+        by a single multi-draw row (at the position of its first member).
+        The instance data of the visible members must then be uploaded for each view by `upload_instance_data`."""
+        multi_draw = self.multi_draw_groups[visible] >= 0
+        positions, rows = self._get_instanced_rows(visible[~multi_draw])
+        if not multi_draw.any():
+            self._multi_draw_nodes = self._multi_draw_commands = None
+            return rows
+        multi_draw_positions, multi_draw_rows = self._get_multi_draw_rows(visible[multi_draw])
+        positions = np.concatenate([np.flatnonzero(~multi_draw)[positions], np.flatnonzero(multi_draw)[multi_draw_positions]])
+        rows = rows + multi_draw_rows
+        return [rows[i] for i in np.argsort(positions, kind='stable').tolist()]
+    def _get_instanced_rows(self, visible):
+        # returns the rows of records which are not drawn by multi-draw calls, and their positions in `visible`
+        groups = self.instance_groups[visible]
+        grouped = groups >= 0
+        if not grouped.any():
+            self._instance_nodes = self._instance_destinations = None
+            return np.arange(len(visible)), self._get_record_rows(visible)
+        order = np.argsort(groups[grouped], kind='stable')
+        instances, instance_groups = visible[grouped][order], groups[grouped][order]
+        group_ids, first_positions, counts = np.unique(instance_groups, return_index=True, return_counts=True)
+        self._instance_destinations = (self.instance_offsets[instance_groups] + np.arange(len(instances))
+                                       - np.repeat(first_positions, counts))
+        self._instance_nodes = self.records['node'][instances]
+        # each group is drawn at the position of its first visible member:
+        ungrouped_positions = np.flatnonzero(~grouped)
+        group_positions = np.flatnonzero(grouped)[order][first_positions]
+        candidates = (self._get_record_rows(visible[~grouped]) +
+                      [self._instance_rows[group][:-1] + (count,)
+                       for group, count in zip(group_ids.tolist(), counts.tolist())])
+        positions = np.concatenate([ungrouped_positions, group_positions])
+        order = np.argsort(positions, kind='stable')
+        return positions[order], [candidates[i] for i in order.tolist()]
+    def _get_multi_draw_rows(self, visible):
+        # returns one row per multi-draw group of the records at the indices `visible` (all of which are members of
+        # multi-draw groups), and the positions of their first members in `visible`, and prepares the group's commands:
+        # the visible members of each group are ordered by primitive and level of detail, and each run of members of the
+        # same primitive and level is drawn by one command, which draws one instance per member (with the member's
+        # instance data at baseInstance)
+        groups = self.multi_draw_groups[visible]
+        group_ids, first_positions = np.unique(groups, return_index=True)
+        group_order = np.argsort(first_positions)
+        group_ids, first_positions = group_ids[group_order], first_positions[group_order]
+        ranks = np.empty(len(self.multi_draw_records), dtype=np.intp)
+        ranks[group_ids] = np.arange(len(group_ids))
+        member_ranks = ranks[groups]
+        primitives = self.multi_draw_primitives[visible]
+        levels = self.lod_levels[visible]
+        order = np.lexsort((levels, primitives, member_ranks))
+        members, member_ranks, primitives, levels = visible[order], member_ranks[order], primitives[order], levels[order]
+        starts = np.flatnonzero(np.concatenate([[True], (member_ranks[1:] != member_ranks[:-1]) |
+                                                        (primitives[1:] != primitives[:-1]) |
+                                                        (levels[1:] != levels[:-1])]))
+        commands = self.draw_commands[members[starts]]
+        lod_starts = starts[levels[starts] > 0]
+        if len(lod_starts):
+            # (the levels of detail of multi-drawn primitives are in the index buffer of their group)
+            lod_commands = levels[starts] > 0
+            lod_members, lod_levels = members[lod_starts], levels[lod_starts]
+            commands['count'][lod_commands] = self.lod_counts[lod_members, lod_levels]
+            commands['firstIndex'][lod_commands] = self.lod_byte_offsets[lod_members, lod_levels] // self._index_sizes[lod_members]
+        commands['instanceCount'] = np.diff(np.append(starts, len(members)))
+        commands['baseInstance'] = starts
+        self._multi_draw_commands = commands
+        self._multi_draw_nodes = self.records['node'][members]
+        first_commands = np.searchsorted(member_ranks[starts], np.arange(len(group_ids)))
+        num_commands = np.diff(np.append(first_commands, len(starts)))
+        multi_draw_rows = self._multi_draw_rows
+        rows = [multi_draw_rows[group][:4] + (count, multi_draw_rows[group][5], first * commands.itemsize) + multi_draw_rows[group][7:]
+                for group, count, first in zip(group_ids.tolist(), num_commands.tolist(), first_commands.tolist())]
+        return first_positions, rows
+    def upload_instance_data(self, modelview_matrices, normal_matrices):
+        """Gathers the instance data of the instance and multi-draw group members of the last `get_rows` call from the
+        given per-node modelview and normal matrices (as computed by `calc_view_matrices`) and uploads it to
+        `instance_buffer` and `multi_draw_instance_buffer`, and uploads the multi-draw commands to `indirect_buffer`."""
+        if self._multi_draw_nodes is not None:
+            n = len(self._multi_draw_nodes)
+            instance_data = self.multi_draw_instance_data[:n]
+            instance_data['MODELVIEW'] = modelview_matrices[self._multi_draw_nodes]
+            instance_data['MODELVIEWINVERSETRANSPOSE'] = normal_matrices[self._multi_draw_nodes]
+            glstate.bind_buffer(gl.GL_ARRAY_BUFFER, self.multi_draw_instance_buffer)
+            gl.glBufferData(gl.GL_ARRAY_BUFFER, instance_data.nbytes, instance_data, gl.GL_STREAM_DRAW)
+            if self.indirect_buffer is None:
+                self.indirect_buffer = gl.glGenBuffers(1)
+            glstate.bind_buffer(gl.GL_DRAW_INDIRECT_BUFFER, self.indirect_buffer)
+            gl.glBufferData(gl.GL_DRAW_INDIRECT_BUFFER, self._multi_draw_commands.nbytes, self._multi_draw_commands,
+                            gl.GL_STREAM_DRAW)
+        if self._instance_nodes is None:
+            return
+        self.instance_data['MODELVIEW'][self._instance_destinations] = modelview_matrices[self._instance_nodes]
+        self.instance_data['MODELVIEWINVERSETRANSPOSE'][self._instance_destinations] = normal_matrices[self._instance_nodes]
+        glstate.bind_buffer(gl.GL_ARRAY_BUFFER, self.instance_buffer)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, self.instance_data.nbytes, self.instance_data, gl.GL_STREAM_DRAW)
+
+
+def compile_draw_list(gltf, hierarchy, node_names=None):
+    """Compiles the node trees of a `NodeHierarchy` into a `DrawList`,
+    creating any vertex array objects which have not been set up yet.
+    Nodes are traversed depth-first, starting from each of `node_names` in turn
+    (by default, the root nodes of the hierarchy).
+
+    Opaque primitives whose program has an instanced variant (see `setup_instanced_program`) are grouped by
+    (program, material, vertex format) for multi-draw indirect calls (see `USE_MULTI_DRAW_INDIRECT`).
+    Otherwise, opaque primitives which are drawn for at least `INSTANCING_MIN_INSTANCES` nodes and whose program has an
+    instanced variant are grouped for instanced drawing.
+
+    The draw list only needs to be recompiled when the nodes, meshes or materials of the scene change."""
+    if node_names is None:
+        node_names = hierarchy.root_names
+    records = []
+    bounds = []
+    material_indices = {}
+    primitive_records = {}
+    skinned_node_names = []
+    lod_ranges = []
+    primitives = []
+    def get_node_index(node_name):
+        if node_name not in hierarchy.node_indices:
+            raise Exception('node "%s" is not part of the node hierarchy' % node_name)
+        return hierarchy.node_indices[node_name]
+    def compile_node(node_name):
+        node = gltf['nodes'][node_name]
+        node_index = get_node_index(node_name)
+        skin = -1
+        if 'skin' in node and node.get('meshes'):
+            skin = len(skinned_node_names)
+            skinned_node_names.append(node_name)
+        for mesh_name in node.get('meshes', []):
+            for primitive in gltf['meshes'][mesh_name]['primitives']:
+                binding_plan = get_binding_plan(gltf, primitive['material'])
+                locations = {'MODELVIEW': -1, 'PROJECTION': -1, 'VIEW': -1, 'MODELVIEWINVERSETRANSPOSE': -1,
+                             'JOINTMATRIX': -1}
+                matrix_index = node_index
+                for semantic, location, semantic_node_name in binding_plan.semantic_uniforms:
+                    if semantic not in locations:
+                        raise Exception('unhandled semantic: %s' % semantic)
+                    if semantic_node_name is not None:
+                        if semantic != 'MODELVIEW':
+                            raise Exception('TODO')
+                        matrix_index = get_node_index(semantic_node_name)
+                    locations[semantic] = location
+                if 'vao' not in primitive:
+                    setup_vao(primitive, gltf)
+                index_accessor = gltf['accessors'][primitive['indices']]
+                index_bufferView = gltf['bufferViews'][index_accessor['bufferView']]
+                if primitive['material'] not in material_indices:
+                    material_indices[primitive['material']] = len(material_indices)
+                primitive_records.setdefault(id(primitive), (primitive, []))[1].append(len(records))
+                primitives.append(primitive)
+                records.append((binding_plan.program_id, primitive['vao'], index_bufferView['id'],
+                                primitive.get('mode', gl.GL_TRIANGLES),
+                                index_accessor['count'], index_accessor['componentType'],
+                                index_bufferView.get('arena_offset', 0) + index_accessor['byteOffset'],
+                                material_indices[primitive['material']], matrix_index,
+                                locations['MODELVIEW'], locations['PROJECTION'], locations['VIEW'],
+                                locations['MODELVIEWINVERSETRANSPOSE'], locations['JOINTMATRIX'], skin, 0))
+                bounds.append(get_primitive_bounds(gltf, primitive))
+                lod_ranges.append(get_primitive_lods(gltf, primitive) if LOD_SCREEN_SIZES is not None else [])
+        for child in node['children']:
+            compile_node(child)
+    for node_name in node_names:
+        compile_node(node_name)
+    material_names = sorted(material_indices.keys(), key=material_indices.get)
+    binding_plans = [get_binding_plan(gltf, material_name) for material_name in material_names]
+    records = np.array(records, dtype=DRAW_RECORD_DTYPE)
+    num_lods = np.array([len(ranges) for ranges in lod_ranges], dtype=np.intp)
+    max_lods = min(num_lods.max() if len(records) else 0, len(LOD_SCREEN_SIZES or ()))
+    num_lods = np.minimum(num_lods, max_lods)
+    lod_index_buffers = np.repeat(records['index_buffer'][:,np.newaxis], max_lods + 1, axis=1)
+    lod_counts = np.repeat(records['count'][:,np.newaxis], max_lods + 1, axis=1)
+    lod_byte_offsets = np.repeat(records['byte_offset'][:,np.newaxis], max_lods + 1, axis=1)
+    for i in np.flatnonzero(num_lods).tolist():
+        ranges = lod_ranges[i][:max_lods]
+        ranges = ranges + ranges[-1:] * (max_lods - len(ranges))
+        lod_index_buffers[i,1:], lod_counts[i,1:], lod_byte_offsets[i,1:] = zip(*ranges)
+    instanced_plans = {}
+    def get_instanced_plan(material_name, instanced_program):
+        # index of the binding plan of the material with the instanced variant of its program
+        if material_name not in instanced_plans:
+            instanced_plans[material_name] = len(binding_plans)
+            material_names.append(material_name)
+            binding_plans.append(compile_binding_plan(gltf, material_name, program_id=instanced_program['id']))
+        return instanced_plans[material_name]
+    multi_draw_groups = np.full(len(records), -1, dtype=np.int32)
+    multi_draw_primitives = np.zeros(len(records), dtype=np.int32)
+    draw_commands = np.zeros(len(records), dtype=DRAW_ELEMENTS_INDIRECT_COMMAND_DTYPE)
+    multi_draw_records = []
+    multi_draw_keys = {}
+    multi_draw_instance_buffer = None
+    use_multi_draw = USE_MULTI_DRAW_INDIRECT and bool(gl.glMultiDrawElementsIndirect)
+    # skinned primitives are drawn one at a time, with the joint matrices of their node:
+    skinned_primitives = {id(primitive) for primitive, indices in primitive_records.values()
+                          if (records['skin'][indices] >= 0).any()}
+    # primitives with levels of detail are drawn at a level per record, so they are not instanced
+    # (and only multi-drawn if their levels are in the index buffer of their group):
+    lod_primitives = {id(primitive) for primitive, indices in primitive_records.values() if num_lods[indices[0]]}
+    for primitive_index, (primitive, indices) in enumerate(primitive_records.values() if use_multi_draw else ()):
+        if id(primitive) in skinned_primitives:
+            continue
+        if id(primitive) in lod_primitives and (lod_index_buffers[indices[0]] != records['index_buffer'][indices[0]]).any():
+            continue
+        material_name = primitive['material']
+        technique = gltf['techniques'][gltf['materials'][material_name]['technique']]
+        if gl.GL_BLEND in technique.get('states', {}).get('enable', []):
+            # blended primitives are drawn one at a time, back to front
+            continue
+        instanced_program = setup_instanced_program(gltf, technique['program'])
+        if instanced_program is None:
+            continue
+        material = get_instanced_plan(material_name, instanced_program)
+        vertex_format, base_vertex = get_vertex_format(primitive, gltf)
+        record = records[indices[0]]
+        key = (instanced_program['id'], material, vertex_format,
+               int(record['index_buffer']), int(record['mode']), int(record['component_type']))
+        if key not in multi_draw_keys:
+            if multi_draw_instance_buffer is None:
+                multi_draw_instance_buffer = gl.glGenBuffers(1)
+            locations = {semantic: location for semantic, location, _ in binding_plans[material].semantic_uniforms}
+            group_record = record.copy()
+            group_record['program'] = instanced_program['id']
+            group_record['vao'] = setup_instanced_vao(primitive, gltf, instanced_program, multi_draw_instance_buffer, 0,
+                                                      base_vertex=base_vertex)
+            group_record['material'] = material
+            group_record['node'] = -1
+            group_record['modelview_location'] = group_record['normal_location'] = -1
+            group_record['projection_location'] = locations.get('PROJECTION', -1)
+            group_record['view_location'] = locations.get('VIEW', -1)
+            group_record['count'] = group_record['byte_offset'] = 0
+            group_record['instance_count'] = -1
+            multi_draw_keys[key] = len(multi_draw_records)
+            multi_draw_records.append(group_record)
+        index_size = np.dtype(GLTF_COMPONENT_TYPES[int(record['component_type'])]).itemsize
+        multi_draw_groups[indices] = multi_draw_keys[key]
+        multi_draw_primitives[indices] = primitive_index
+        draw_commands[indices] = (record['count'], 1, record['byte_offset'] // index_size, base_vertex, 0)
+    multi_draw_records = np.array(multi_draw_records, dtype=DRAW_RECORD_DTYPE)
+    instance_groups = np.full(len(records), -1, dtype=np.int32)
+    instance_records = []
+    instance_buffer = None
+    num_instances = 0
+    for primitive, indices in (primitive_records.values() if INSTANCING_MIN_INSTANCES is not None else ()):
+        if (len(indices) < INSTANCING_MIN_INSTANCES or multi_draw_groups[indices[0]] >= 0
+            or id(primitive) in skinned_primitives or id(primitive) in lod_primitives):
+            continue
+        material_name = primitive['material']
+        technique = gltf['techniques'][gltf['materials'][material_name]['technique']]
+        if gl.GL_BLEND in technique.get('states', {}).get('enable', []):
+            # blended primitives are drawn one at a time, back to front
+            continue
+        instanced_program = setup_instanced_program(gltf, technique['program'])
+        if instanced_program is None:
+            continue
+        material = get_instanced_plan(material_name, instanced_program)
+        locations = {semantic: location for semantic, location, _ in binding_plans[material].semantic_uniforms}
+        if instance_buffer is None:
+            instance_buffer = gl.glGenBuffers(1)
+        record = records[indices[0]].copy()
+        record['program'] = instanced_program['id']
+        record['vao'] = setup_instanced_vao(primitive, gltf, instanced_program, instance_buffer, num_instances)
+        record['material'] = material
+        record['node'] = -1
+        record['modelview_location'] = record['normal_location'] = -1
+        record['projection_location'] = locations.get('PROJECTION', -1)
+        record['view_location'] = locations.get('VIEW', -1)
+        instance_groups[indices] = len(instance_records)
+        instance_records.append(record)
+        num_instances += len(indices)
+    instance_records = np.array(instance_records, dtype=DRAW_RECORD_DTYPE)
+    # sort keys: blended bit (63), then for opaque records program rank (bits 48-62), material (bits 32-47),
+    # leaving bits 0-31 for the depth, and for blended records program rank (bits 16-30), material (bits 0-15),
+    # leaving bits 31-62 for the depth:
+    effective_records = records.copy()
+    grouped = instance_groups >= 0
+    effective_records[grouped] = instance_records[instance_groups[grouped]]
+    multi_drawn = multi_draw_groups >= 0
+    effective_records[multi_drawn] = multi_draw_records[multi_draw_groups[multi_drawn]]
+    program_ranks = np.unique(effective_records['program'], return_inverse=True)[1].ravel().astype(np.uint64)
+    material_ranks = effective_records['material'].astype(np.uint64)
+    if len(records) and (program_ranks.max() >= 1 << 15 or material_ranks.max() >= 1 << 16):
+        raise Exception('too many programs or materials for the draw list sort keys')
+    blended = np.array([gl.GL_BLEND in gltf['techniques'][binding_plans[material].technique_name].get('states', {}).get('enable', [])
+                        for material in effective_records['material'].tolist()], dtype=np.bool_)
+    sort_keys = np.where(blended,
+                         (np.uint64(1) << np.uint64(63)) | (program_ranks << np.uint64(16)) | material_ranks,
+                         (program_ranks << np.uint64(48)) | (material_ranks << np.uint64(32)))
+    draw_list = DrawList(records, material_names, binding_plans, hierarchy, bounds=bounds,
+                         instance_groups=instance_groups, instance_records=instance_records,
+                         instance_buffer=instance_buffer, sort_keys=sort_keys, blended=blended,
+                         multi_draw_groups=multi_draw_groups, multi_draw_records=multi_draw_records,
+                         multi_draw_instance_buffer=multi_draw_instance_buffer, draw_commands=draw_commands,
+                         multi_draw_primitives=multi_draw_primitives,
+                         skin_palettes=gltfskin.SkinPalettes(gltf, hierarchy, skinned_node_names) if skinned_node_names else None,
+                         num_lods=num_lods, lod_index_buffers=lod_index_buffers, lod_counts=lod_counts,
+                         lod_byte_offsets=lod_byte_offsets, primitives=primitives)
+    _logger.debug('* compiled draw list: %d records, %d materials, %d instance groups (%d instances), %d multi-draw groups, '
+                  '%d records with levels of detail, %d pickable records',
+                  len(draw_list), len(material_indices), len(instance_records), num_instances, len(multi_draw_records),
+                  np.count_nonzero(num_lods), np.count_nonzero(draw_list.pickable))
+    return draw_list
+
+
+def render_draw_list(draw_list, gltf, projection_matrix=None, view_matrix=None, cull=True, sort=True,
+                     modelview_matrices=None, normal_matrices=None):
+    """Renders a `DrawList` compiled by `compile_draw_list` for a single view,
+    i.e. `prepare_draw_list` followed by `replay_draw_list`.
+
+    The modelview and normal matrices of all nodes are computed at once by `calc_view_matrices`, unless they are
+    passed in (e.g. when they have been computed for several views at once)."""
+    rows = prepare_draw_list(draw_list, projection_matrix, view_matrix, cull=cull, sort=sort)
+    if modelview_matrices is None:
+        modelview_matrices, normal_matrices = calc_view_matrices(draw_list.hierarchy.world_matrices, view_matrix[np.newaxis])
+        modelview_matrices, normal_matrices = modelview_matrices[0], normal_matrices[0]
+    replay_draw_list(draw_list, rows, gltf, projection_matrix, view_matrix, modelview_matrices, normal_matrices)
+
+
+def prepare_draw_list(draw_list, projection_matrix, view_matrix, cull=True, sort=True):
+    """Determines the rows of a `DrawList` to draw, and their order, for a single view or for a stack of
+    (V,4,4) projection and view matrices (e.g. the two eyes of a stereo view), in which case the rows are
+    prepared once for all views and replayed for each of them by `replay_draw_list`.
+
+    If `cull` is True, records whose world-space bounding boxes lie entirely outside the view frustum(s) are skipped
+    (the numbers of visible and culled records are accumulated in `num_visible` and `num_culled`).
+    Records which are not `enabled` are skipped.
+    If `sort` is True, records are drawn in the order of their sort keys (see `DrawList.sort`, which is passed
+    the mean of the view matrices) rather than in traversal order.
+    The joint matrix palettes of skinned nodes are recomputed if the hierarchy has been updated.
+    The levels of detail of the visible records are chosen by `DrawList.select_lods`, and the numbers of triangles
+    drawn with and without levels of detail are accumulated in `num_triangles` and `num_triangles_full`."""
+    global num_visible, num_culled, num_triangles, num_triangles_full
+    if draw_list.skin_palettes is not None:
+        draw_list.skin_palettes.update()
+    if cull:
+        visible = draw_list.cull(projection_matrix, view_matrix)
+    else:
+        visible = np.arange(len(draw_list))
+    num_visible += len(visible)
+    num_culled += len(draw_list) - len(visible)
+    if not draw_list.enabled.all():
+        visible = visible[draw_list.enabled[visible]]
+    if LOD_SCREEN_SIZES is not None:
+        draw_list.select_lods(visible, projection_matrix, view_matrix)
+    triangles = visible[draw_list.is_triangles[visible]]
+    num_triangles += int(draw_list.lod_counts[triangles, draw_list.lod_levels[triangles]].sum()) // 3
+    num_triangles_full += int(draw_list.lod_counts[triangles, 0].sum()) // 3
+    if sort:
+        visible = draw_list.sort(visible, view_matrix if view_matrix.ndim == 2 else view_matrix.mean(axis=0))
+    return draw_list.get_rows(visible)
+
+
+def replay_draw_list(draw_list, rows, gltf, projection_matrix, view_matrix, modelview_matrices, normal_matrices):
+    """Draws the rows of a `DrawList` returned by `prepare_draw_list` for one view, given the per-node modelview and
+    normal matrices of that view (see `calc_view_matrices`).
+
+    Matrix uniforms are only uploaded when the node or program changes from one row to the next.
+    The projection and view matrices are uploaded once to the frame uniform block, or once per program
+    for programs which do not use it.  Instance groups are drawn with one instanced draw call each,
+    and multi-draw groups with one glMultiDrawElementsIndirect call each.
+    The resulting numbers of program, material and texture changes are accumulated in `num_program_changes`,
+    `num_material_changes` and `num_texture_binds`."""
+    global num_draw_calls
+    draw_list.upload_instance_data(modelview_matrices, normal_matrices)
+    skin_palettes = draw_list.skin_palettes
+    if USE_FRAME_UNIFORM_BLOCK:
+        update_frame_uniforms(projection_matrix, view_matrix)
+    binding_plans = draw_list.binding_plans
+    current_material = current_node = current_program = None
+    frame_programs = set()
+    for (program_id, vao, index_buffer, mode, count, component_type, byte_offset, material, node,
+         modelview_location, projection_location, view_location, normal_location, joint_matrix_location, skin,
+         instance_count) in rows:
+        if material != current_material:
+            apply_binding_plan(binding_plans[material], gltf)
+            current_material = material
+        if node != current_node or program_id != current_program:
+            if modelview_location != -1:
+                gl.glUniformMatrix4fv(modelview_location, 1, False, modelview_matrices[node])
+            if normal_location != -1:
+                gl.glUniformMatrix3fv(normal_location, 1, False, normal_matrices[node])
+            if joint_matrix_location != -1 and skin != -1:
+                gl.glUniformMatrix4fv(joint_matrix_location, int(skin_palettes.counts[skin]), False,
+                                      skin_palettes.get_palette(skin))
+            current_node, current_program = node, program_id
+        if program_id not in frame_programs:
+            if projection_location != -1:
+                gl.glUniformMatrix4fv(projection_location, 1, False, projection_matrix)
+            if view_location != -1:
+                gl.glUniformMatrix4fv(view_location, 1, False, view_matrix)
+            frame_programs.add(program_id)
+        glstate.bind_vertex_array(vao)
+        glstate.bind_buffer(gl.GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+        if instance_count < 0:
+            # multi-draw row: `count` commands starting at `byte_offset` of the indirect buffer
+            gl.glMultiDrawElementsIndirect(mode, component_type, c_void_p(byte_offset), count, 0)
+        elif instance_count:
+            gl.glDrawElementsInstanced(mode, count, component_type, c_void_p(byte_offset), instance_count)
+        else:
+            gl.glDrawElements(mode, count, component_type, c_void_p(byte_offset))
+        num_draw_calls += 1
+    glstate.bind_vertex_array(0)
+    if CHECK_GL_ERRORS:
+        if gl.glGetError() != gl.GL_NO_ERROR:
+            raise Exception('error replaying draw list')
+num_visible = 0
+num_culled = 0
+num_triangles = 0
+num_triangles_full = 0
+
+
 def calc_projection_matrix(camera):
     if 'perspective' in camera:
         f = 1 / np.tan(camera['perspective']['yfov'] / 2)
@@ -333,6 +1767,51 @@ def calc_projection_matrix(camera):
     return projection_matrix
 
 
+def calc_normal_matrices(modelview_matrices, out=None, tolerance=1e-5):
+    """Computes the normal matrices (the inverse-transposes of the upper 3x3 blocks) of an (N,4,4) array of modelview matrices,
+    returning an (N,3,3) float32 array which, like the modelview matrices, can be uploaded without transposition.
+
+    For rigid and uniformly scaled transforms (whose rows are orthogonal and of equal length), the normal matrix is
+    the upper 3x3 block divided by the squared scale; the full inverse is only computed for the remaining matrices."""
+    if out is None:
+        out = np.empty((len(modelview_matrices), 3, 3), dtype=np.float32)
+    blocks = modelview_matrices[:,:3,:3]
+    grams = np.matmul(blocks, blocks.transpose(0,2,1))
+    squared_scales = grams[:,0,0]
+    uniform = (np.abs(grams - squared_scales[:,np.newaxis,np.newaxis] * np.eye(3, dtype=np.float32))
+               <= tolerance * squared_scales[:,np.newaxis,np.newaxis]).all(axis=(1,2))
+    uniform &= squared_scales > 0
+    np.divide(blocks, squared_scales[:,np.newaxis,np.newaxis], out=out, where=uniform[:,np.newaxis,np.newaxis])
+    if not uniform.all():
+        out[~uniform] = np.linalg.inv(blocks[~uniform]).transpose(0,2,1)
+    return out
+
+
+def calc_view_matrices(world_matrices, view_matrices, modelview_out=None, normal_out=None):
+    """Computes the modelview and normal matrices of all (N,4,4) world matrices for all (V,4,4) view matrices at once,
+    returning contiguous (V,N,4,4) and (V,N,3,3) float32 arrays (see `calc_normal_matrices`)."""
+    num_views, num_nodes = len(view_matrices), len(world_matrices)
+    if modelview_out is None:
+        modelview_out = np.empty((num_views, num_nodes, 4, 4), dtype=np.float32)
+    if normal_out is None:
+        normal_out = np.empty((num_views, num_nodes, 3, 3), dtype=np.float32)
+    np.matmul(world_matrices[np.newaxis], view_matrices[:,np.newaxis], out=modelview_out)
+    calc_normal_matrices(modelview_out.reshape(-1, 4, 4), out=normal_out.reshape(-1, 3, 3))
+    return modelview_out, normal_out
+
+
+def calc_cursor_ray(projection_matrix, view_matrix, x, y, width, height):
+    """Returns the world-space origin (on the near plane) and unit direction of the ray through the given window
+    position (in pixels from the top left corner of a window of the given size, as reported by GLFW),
+    e.g. for `DrawList.pick`."""
+    ndc_x, ndc_y = 2 * x / width - 1, 1 - 2 * y / height
+    inverse_view_projection = np.linalg.inv(np.dot(view_matrix, projection_matrix).astype(np.float64))
+    near, far = np.array([[ndc_x, ndc_y, -1, 1], [ndc_x, ndc_y, 1, 1]]).dot(inverse_view_projection)
+    near, far = near[:3] / near[3], far[:3] / far[3]
+    direction = far - near
+    return near.astype(np.float32), (direction / np.linalg.norm(direction)).astype(np.float32)
+
+
 def update_world_matrices(node, gltf, world_matrix=None):
     if 'matrix' not in node:
         matrix = matrix44.create_from_quaternion(np.array(node['rotation']))
@@ -349,3 +1828,126 @@ def update_world_matrices(node, gltf, world_matrix=None):
     node['world_matrix'] = world_matrix.T
     for child in [gltf['nodes'][n] for n in node['children']]:
         update_world_matrices(child, gltf, world_matrix=world_matrix)
+
+
+def quaternions_to_matrices(rotations, out=None):
+    """Converts an (N,4) array of (x, y, z, w) unit quaternions to an (N,3,3) array of rotation matrices
+    (in the row-vector convention, i.e. each matrix is the transpose of the usual rotation matrix)."""
+    x, y, z, w = rotations[:,0], rotations[:,1], rotations[:,2], rotations[:,3]
+    if out is None:
+        out = np.empty((len(rotations), 3, 3), dtype=np.float32)
+    xx, yy, zz = x*x, y*y, z*z
+    xy, xz, yz = x*y, x*z, y*z
+    xw, yw, zw = x*w, y*w, z*w
+    out[:,0,0] = 1 - 2*(yy + zz)
+    out[:,0,1] = 2*(xy + zw)
+    out[:,0,2] = 2*(xz - yw)
+    out[:,1,0] = 2*(xy - zw)
+    out[:,1,1] = 1 - 2*(xx + zz)
+    out[:,1,2] = 2*(yz + xw)
+    out[:,2,0] = 2*(xz + yw)
+    out[:,2,1] = 2*(yz - xw)
+    out[:,2,2] = 1 - 2*(xx + yy)
+    return out
+
+
+class NodeHierarchy(object):
+    """Flattened, array-backed form of the node trees rooted at the given nodes.
+
+    Nodes are stored in topological (breadth-first) order, so that each level of the hierarchy
+    occupies a contiguous range of indices and every parent precedes its children.
+    Local transforms are kept in the `translations`, `rotations` and `scales` arrays
+    (or `matrices`, for nodes which define a `matrix` property), and world matrices are kept in the
+    contiguous (N,4,4) float32 array `world_matrices`.  Like `update_world_matrices`, world matrices use the
+    row-vector convention, i.e. they are the transposes of the usual column-vector matrices.
+
+    After modifying local transforms, call `mark_dirty` with the indices of the modified nodes:
+    the next call to `update` only recomputes the world matrices of the subtrees rooted at those nodes.
+    Each node's `world_matrix` property is set to a view of its row of `world_matrices`."""
+    def __init__(self, gltf, root_node_names):
+        nodes = gltf['nodes']
+        self.root_names = list(root_node_names)
+        names = list(self.root_names)
+        parents = [-1] * len(names)
+        level_offsets = [0]
+        start = 0
+        while start < len(names):
+            stop = len(names)
+            level_offsets.append(stop)
+            for i in range(start, stop):
+                children = nodes[names[i]]['children']
+                names.extend(children)
+                parents.extend([i] * len(children))
+            start = stop
+        self.names = names
+        self.node_indices = {name: i for i, name in enumerate(names)}
+        if len(self.node_indices) != len(names):
+            raise Exception('node hierarchy is not a tree')
+        self.parents = np.array(parents, dtype=np.int32)
+        self.level_offsets = level_offsets
+        n = len(names)
+        self.translations = np.zeros((n, 3), dtype=np.float32)
+        self.rotations = np.zeros((n, 4), dtype=np.float32)
+        self.rotations[:,3] = 1
+        self.scales = np.ones((n, 3), dtype=np.float32)
+        self.has_matrix = np.zeros(n, dtype=np.bool_)
+        self.matrices = np.empty((n, 4, 4), dtype=np.float32)
+        for i, name in enumerate(names):
+            node = nodes[name]
+            if 'matrix' in node:
+                self.has_matrix[i] = True
+                self.matrices[i] = np.array(node['matrix'], dtype=np.float32).reshape((4, 4))
+            else:
+                self.translations[i] = node.get('translation', (0, 0, 0))
+                self.rotations[i] = node.get('rotation', (0, 0, 0, 1))
+                self.scales[i] = node.get('scale', (1, 1, 1))
+        self.local_matrices = np.empty((n, 4, 4), dtype=np.float32)
+        self.world_matrices = np.empty((n, 4, 4), dtype=np.float32)
+        self.dirty = np.ones(n, dtype=np.bool_)
+        # incremented whenever world matrices are recomputed, so that derived data (e.g. bounds) can be kept in sync:
+        self.version = 0
+        for i, name in enumerate(names):
+            nodes[name]['world_matrix'] = self.world_matrices[i]
+    def __len__(self):
+        return len(self.names)
+    def mark_dirty(self, indices):
+        """Marks the local transforms of the nodes at the given indices as modified."""
+        self.dirty[indices] = True
+    def update(self):
+        """Recomputes the local and world matrices of all dirty nodes and their descendants."""
+        dirty = self.dirty
+        if not dirty.any():
+            return
+        self._update_local_matrices(np.flatnonzero(dirty))
+        local_matrices, world_matrices, parents = self.local_matrices, self.world_matrices, self.parents
+        level_offsets = self.level_offsets
+        for level in range(len(level_offsets) - 1):
+            start, stop = level_offsets[level], level_offsets[level+1]
+            level_dirty = dirty[start:stop]
+            if level > 0:
+                level_dirty |= dirty[parents[start:stop]]
+            if level_dirty.all():
+                if level == 0:
+                    world_matrices[start:stop] = local_matrices[start:stop]
+                else:
+                    np.matmul(local_matrices[start:stop], world_matrices[parents[start:stop]],
+                              out=world_matrices[start:stop])
+            elif level_dirty.any():
+                indices = start + np.flatnonzero(level_dirty)
+                if level == 0:
+                    world_matrices[indices] = local_matrices[indices]
+                else:
+                    world_matrices[indices] = np.matmul(local_matrices[indices], world_matrices[parents[indices]])
+        dirty[:] = False
+        self.version += 1
+    def _update_local_matrices(self, indices):
+        local_matrices = np.empty((len(indices), 4, 4), dtype=np.float32)
+        quaternions_to_matrices(self.rotations[indices], out=local_matrices[:,:3,:3])
+        local_matrices[:,:3,:3] *= self.scales[indices][:,:,np.newaxis]
+        local_matrices[:,:3,3] = 0
+        local_matrices[:,3,:3] = self.translations[indices]
+        local_matrices[:,3,3] = 1
+        has_matrix = self.has_matrix[indices]
+        if has_matrix.any():
+            local_matrices[has_matrix] = self.matrices[indices[has_matrix]]
+        self.local_matrices[indices] = local_matrices
@@ -1,5 +1,6 @@
 import sys
 import os.path
+import time
 import json
 import argparse
 import functools
@@ -21,12 +22,17 @@ from pyrr import matrix44
 
 _logger = logging.getLogger(__name__)
 import gltfutils as gltfu
+from glstate import state as glstate
+import gltfloader
+import glarena
+import gltfanim
 from jsobject import JSobject as jsobject
 try:
     from OpenVRRenderer import OpenVRRenderer
 except ImportError:
     OpenVRRenderer = None
-# from gltext import TextDrawer
+from FakeHMDRenderer import FakeHMDRenderer
+from gltext import TextDrawer
 
 
 LOGGING_FORMAT =       '[gltfview.py] %(asctime)s * %(levelname)s * %(name)s : %(message)s'
@@ -48,31 +54,45 @@ def setup_glfw(width=800, height=600, double_buffered=False):
     return window
 
 
-def view_gltf(gltf, uri_path, scene_name=None, openvr=False, window_size=None):
+def view_gltf(gltf, uri_path, scene_name=None, openvr=False, fake_hmd=False, window_size=None,
+              camera_path_filename=None, show_hud=True, streaming=False):
+    """Views the given scene of a gltf in a window (or a VR HMD).  If `streaming` is True, rendering starts right away
+    and the resources are uploaded progressively (see `gltfloader.StreamingLoader`)."""
     if scene_name is None:
         scene_name = gltf['scene']
     if window_size is None:
         window_size = [800, 600]
     window = setup_glfw(width=window_size[0], height=window_size[1],
-                        double_buffered=not openvr)
+                        double_buffered=not (openvr or fake_hmd))
     def on_resize(window, width, height):
         window_size[0], window_size[1] = width, height
     glfw.SetWindowSizeCallback(window, on_resize)
+    vr_renderer = None
     if openvr and OpenVRRenderer is not None:
         vr_renderer = OpenVRRenderer()
-    # text_drawer = TextDrawer()
+    elif fake_hmd:
+        vr_renderer = FakeHMDRenderer()
+    text_drawer = TextDrawer() if show_hud else None
 
     gl.glClearColor(0.01, 0.01, 0.17, 1.0);
 
-    shader_ids = gltfu.setup_shaders(gltf, uri_path)
-    gltfu.setup_programs(gltf, shader_ids)
-    gltfu.setup_textures(gltf, uri_path)
-    gltfu.setup_buffers(gltf, uri_path)
+    start_time = time.perf_counter()
+    loader = None
+    if streaming:
+        loader = gltfloader.StreamingLoader(gltf, uri_path)
+        load_timings = loader.timings
+    else:
+        load_timings = gltfloader.load_resources(gltf, uri_path)
+    for stage, dt in load_timings.items():
+        _logger.info('* load stage "%s": %f', stage, dt)
+    if gltfu.USE_BUFFER_ARENAS:
+        glarena.pool.log_stats()
 
     scene = gltf.scenes[scene_name]
+    hierarchy = gltfu.NodeHierarchy(gltf, scene.nodes)
+    hierarchy.update()
     nodes = [gltf.nodes[n] for n in scene.nodes]
-    for node in nodes:
-        gltfu.update_world_matrices(node, gltf)
+    animation_engine = gltfanim.AnimationEngine(gltf, hierarchy) if gltf.get('animations') else None
 
     camera_world_matrix = np.eye(4, dtype=np.float32)
     projection_matrix = np.array(matrix44.create_perspective_projection_matrix(np.rad2deg(55), window_size[0]/window_size[1], 0.1, 1000),
@@ -88,7 +108,7 @@ def view_gltf(gltf, uri_path, scene_name=None, openvr=False, window_size=None):
                                              dtype=np.float32)
             elif 'orthographic' in camera:
                 raise Exception('TODO')
-            camera_world_matrix = node['world_matrix']
+            camera_world_matrix = node['world_matrix'].copy()
             break
     camera_position = camera_world_matrix[3, :3]
     camera_rotation = camera_world_matrix[:3, :3]
@@ -107,8 +127,26 @@ def view_gltf(gltf, uri_path, scene_name=None, openvr=False, window_size=None):
 
     glfw.SetKeyCallback(window, on_keydown)
 
+    # the node, and world-space point, of the last pick (a left click on the scene):
+    picked = {}
     def on_mousedown(window, button, action, mods):
-        pass
+        if button != glfw.MOUSE_BUTTON_LEFT or action != glfw.PRESS or vr_renderer is not None:
+            return
+        x, y = glfw.GetCursorPos(window)
+        t = time.perf_counter()
+        origin, direction = gltfu.calc_cursor_ray(projection_matrix, np.linalg.inv(camera_world_matrix),
+                                                  x, y, window_size[0], window_size[1])
+        hit = draw_list.pick(origin, direction, gltf)
+        dt = time.perf_counter() - t
+        picked.clear()
+        if hit is None:
+            _logger.info('* picked nothing (%.3f ms)', 1000 * dt)
+            return
+        record, distance, triangle = hit
+        picked['node'] = hierarchy.names[draw_list.records['node'][record]]
+        picked['point'] = origin + distance * direction
+        _logger.info('* picked node "%s" at %s (triangle %d, distance %f, %.3f ms)',
+                     picked['node'], picked['point'], triangle, distance, 1000 * dt)
     glfw.SetMouseButtonCallback(window, on_mousedown)
 
     move_speed = 2.0
@@ -141,14 +179,49 @@ def view_gltf(gltf, uri_path, scene_name=None, openvr=False, window_size=None):
         camera_rotation[...] = rotation.dot(camera_world_matrix[:3,:3])
         camera_position[:] += camera_rotation.T.dot(dposition)
 
-    # sort nodes from front to back to avoid overdraw (assuming opaque objects):
-    nodes = sorted(nodes, key=lambda node: np.linalg.norm(camera_position - node['world_matrix'][3, :3]))
+    # draw order (front to back for opaque objects, to avoid overdraw) is determined per frame by render_draw_list:
+    draw_list = gltfu.compile_draw_list(gltf, hierarchy)
+    if loader is not None:
+        loader.attach(draw_list)
+
+    # per-frame statistics of the performance HUD (the counters of gltfutils accumulate over frames):
+    hud_counts = {}
+    def draw_hud(text_drawer, window_size, dt, nframes):
+        counts = {'draw_calls': gltfu.num_draw_calls, 'visible': gltfu.num_visible, 'culled': gltfu.num_culled,
+                  'triangles': gltfu.num_triangles, 'triangles_full': gltfu.num_triangles_full,
+                  'gl_calls': glstate.num_issued}
+        if nframes <= 1:
+            # the counters are reset after the first frame
+            hud_counts.clear()
+        frame = {name: count - hud_counts.get(name, 0) for name, count in counts.items()}
+        hud_counts.update(counts)
+        # the frame time changes every frame, so it is streamed rather than cached:
+        text_drawer.draw_screen_text('frame time: %6.2f ms' % (1000 * dt), 8, 20, window_size,
+                                     color=(1.0, 1.0, 0.0, 0.0), cache=False)
+        text_drawer.draw_screen_text('draw calls: %d, GL calls: %d' % (frame['draw_calls'], frame['gl_calls']),
+                                     8, 40, window_size, color=(1.0, 1.0, 0.0, 0.0))
+        text_drawer.draw_screen_text('visible / culled: %d / %d' % (frame['visible'], frame['culled']),
+                                     8, 60, window_size, color=(1.0, 1.0, 0.0, 0.0))
+        text_drawer.draw_screen_text('triangles (without LOD): %d (%d)' % (frame['triangles'], frame['triangles_full']),
+                                     8, 80, window_size, color=(1.0, 1.0, 0.0, 0.0))
+        if picked:
+            text_drawer.draw_screen_text('picked: "%s" at (%.3f, %.3f, %.3f)' % ((picked['node'],) + tuple(picked['point'].tolist())),
+                                         8, 120, window_size, color=(1.0, 1.0, 0.0, 0.0))
+        if loader is not None and not loader.complete:
+            text_drawer.draw_screen_text('loading: %d / %d resources (%.1f MB)'
+                                         % (loader.num_uploaded, loader.num_resources, loader.uploaded_bytes / 2**20),
+                                         8, 100, window_size, color=(1.0, 1.0, 0.0, 0.0), cache=False)
 
     _logger.info('starting render loop...')
     sys.stdout.flush()
     gltfu.num_draw_calls = 0
+    gltfu.num_visible = gltfu.num_culled = 0
+    gltfu.num_triangles = gltfu.num_triangles_full = 0
+    gltfu.num_program_changes = gltfu.num_material_changes = gltfu.num_texture_binds = 0
+    glstate.reset_counts()
+    camera_path = []
     nframes = 0
-    lt = glfw.GetTime()
+    lt = t0 = glfw.GetTime()
     dt_max = 0.0
     while not glfw.WindowShouldClose(window):
         t = glfw.GetTime()
@@ -156,34 +229,56 @@ def view_gltf(gltf, uri_path, scene_name=None, openvr=False, window_size=None):
         dt_max = max(dt, dt_max)
         lt = t
         process_input(dt)
-        if openvr:
+        if camera_path_filename is not None:
+            camera_path.append(camera_world_matrix.ravel().tolist())
+        if animation_engine is not None:
+            animation_engine.update(t - t0)
+        hierarchy.update()
+        view_matrix = np.linalg.inv(camera_world_matrix)
+        if loader is not None:
+            loader.update(projection_matrix, view_matrix)
+        if vr_renderer is not None:
             vr_renderer.process_input()
-            vr_renderer.render(gltf, nodes, window_size)
+            vr_renderer.render(gltf, draw_list, window_size)
         else:
-            gl.glViewport(0, 0, window_size[0], window_size[1])
+            glstate.viewport(0, 0, window_size[0], window_size[1])
             gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-            view_matrix = np.linalg.inv(camera_world_matrix)
-            gltfu.set_material_state.current_material = None
-            gltfu.set_technique_state.current_technique = None
-            for node in nodes:
-                gltfu.draw_node(node, gltf,
-                                projection_matrix=projection_matrix,
-                                view_matrix=view_matrix)
-            # text_drawer.draw_text("%f" % dt, color=(1.0, 1.0, 0.0, 0.0),
-            #                       view_matrix=view_matrix,
-            #                       projection_matrix=projection_matrix)
+            gltfu.render_draw_list(draw_list, gltf,
+                                   projection_matrix=projection_matrix,
+                                   view_matrix=view_matrix)
+            if loader is not None:
+                loader.draw_placeholders(projection_matrix, view_matrix)
+            if text_drawer is not None:
+                draw_hud(text_drawer, window_size, dt, nframes)
         if nframes == 0:
             _logger.info("num draw calls per frame: %d", gltfu.num_draw_calls)
+            _logger.info("num visible / culled primitives per frame: %d / %d", gltfu.num_visible, gltfu.num_culled)
+            _logger.info("num triangles per frame (without LOD): %d (%d)", gltfu.num_triangles, gltfu.num_triangles_full)
+            _logger.info("num program / material / texture changes per frame: %d / %d / %d",
+                         gltfu.num_program_changes, gltfu.num_material_changes, gltfu.num_texture_binds)
+            _logger.info("num GL state calls issued / skipped per frame: %d / %d", glstate.num_issued, glstate.num_skipped)
             sys.stdout.flush()
             gltfu.num_draw_calls = 0
+            gltfu.num_visible = gltfu.num_culled = 0
+            gltfu.num_triangles = gltfu.num_triangles_full = 0
+            gltfu.num_program_changes = gltfu.num_material_changes = gltfu.num_texture_binds = 0
+            glstate.reset_counts()
             st = glfw.GetTime()
         nframes += 1
         glfw.SwapBuffers(window)
+        if nframes == 1:
+            _logger.info('time to first frame: %f', time.perf_counter() - start_time)
+        if loader is not None:
+            loader.end_frame()
     _logger.info('FPS (avg): %f', ((nframes - 1) / (t - st)))
     _logger.info('MAX FRAME RENDER TIME: %f', dt_max)
     sys.stdout.flush()
+    if camera_path_filename is not None:
+        with open(camera_path_filename, 'w') as f:
+            json.dump(camera_path, f)
+        _logger.info('* wrote camera path (%d frames) to "%s"', len(camera_path), camera_path_filename)
 
-    if openvr:
+    if vr_renderer is not None:
         vr_renderer.shutdown()
     glfw.DestroyWindow(window)
     glfw.Terminate()
@@ -191,8 +286,16 @@ def view_gltf(gltf, uri_path, scene_name=None, openvr=False, window_size=None):
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('filename', help='path of glTF file to view')
+    parser.add_argument('filename', help='path of glTF (.gltf or .glb) file to view')
     parser.add_argument("--openvr", help="view in VR", action="store_true")
+    parser.add_argument("--fake-hmd", help="render the stereo views of a fixed, simulated HMD (no VR hardware required)",
+                        action="store_true")
+    parser.add_argument("--record-camera-path", help="write the camera world matrix of each frame to this JSON file "
+                                                     "(to be replayed by gltfbench.py)")
+    parser.add_argument("--no-hud", help="do not draw the performance HUD (frame time, draw calls, culling)",
+                        action="store_true")
+    parser.add_argument("--streaming", help="start rendering immediately, uploading buffers and textures progressively",
+                        action="store_true")
     parser.add_argument("-v", help="enable verbose logging", action="store_true")
 
     args = parser.parse_args()
@@ -205,18 +308,18 @@ def main():
 
     global gltf
     try:
-        gltf = json.loads(open(args.filename).read())
+        gltf = gltfu.load_gltf(args.filename, object_hook=jsobject)
         _logger.info('* loaded "%s"', args.filename)
     except Exception as err:
         raise Exception('failed to load %s:\n%s' % (args.filename, err))
 
-    gltf = jsobject(gltf)
     uri_path = os.path.dirname(args.filename)
 
-    view_gltf(gltf, uri_path, openvr=args.openvr)
+    view_gltf(gltf, uri_path, openvr=args.openvr, fake_hmd=args.fake_hmd,
+              camera_path_filename=args.record_camera_path, show_hud=not args.no_hud, streaming=args.streaming)
 
     global view
-    view = functools.partial(view_gltf, gltf, uri_path, openvr=args.openvr)
+    view = functools.partial(view_gltf, gltf, uri_path, openvr=args.openvr, fake_hmd=args.fake_hmd)
 
 
 if __name__ == "__main__":
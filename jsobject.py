@@ -1,36 +1,38 @@
-"""For the dict-subclass JSobject (defined below),
-user-defined attribute names may collide with
-the inherited dict methods (e.g. "keys", "values", "items", etc),
-overwriting the inherited binding.  For these special cases,
-the built-in dict methods are also bound to corresponding '__'-prefixed
-attribute names (e.g. "__keys", "__values", "__items", etc)."""
-_JSOBJECT_DICT_ATTR_RENAMES = {k: '__%s' % k
-                               for k in {}.__dir__()
-                               if not k.startswith('__')}
+import json
 
 
 class JSobject(dict):
-    """Python object-based representation of JSON data.
-    Useful for interactively exploring JSON data via ipython tab-completion."""
-    _BAD_NAMES = frozenset([name for name in {}.__dir__()
-                            if name not in _JSOBJECT_DICT_ATTR_RENAMES])
-    def __init__(self, json_dict):
-        dict.__init__(self)
-        for name, rename in _JSOBJECT_DICT_ATTR_RENAMES.items():
-            dict.__setattr__(self, rename, self.__getattribute__(name))
-        for k, v in json_dict.items():
-            self[k] = v
+    """Python object-based representation of JSON data: a dict whose items can also be accessed as attributes.
+    Useful for interactively exploring JSON data via ipython tab-completion.
+
+    Items are stored only once (instances have no __dict__) and are looked up as attributes only when the dict
+    itself has no attribute of that name, so items named like dict methods (e.g. the "values" of a glTF material)
+    must be accessed as items.  Nested dicts are converted to JSobjects when they are first accessed as attributes;
+    JSON which is parsed with `object_hook=JSobject` (see `loads`) needs no conversion."""
+    __slots__ = ()
+    _BAD_NAMES = frozenset({}.__dir__())
+    def __getattr__(self, k):
+        try:
+            v = dict.__getitem__(self, k)
+        except KeyError:
+            raise AttributeError(k)
+        if type(v) is dict:
+            v = JSobject(v)
+            dict.__setitem__(self, k, v)
+        return v
     def __setattr__(self, k, v):
         if k in JSobject._BAD_NAMES:
             raise Exception('attribute name collision: %s' % k)
-        if isinstance(v, dict):
-            v = JSobject(v)
         dict.__setitem__(self, k, v)
-        dict.__setattr__(self, k, v)
-    def __setitem__(self, k, v):
-        self.__setattr__(k, v)
     def __delattr__(self, k):
-        dict.__delitem__(self, k)
-        dict.__delattr__(self, k)
-    def __delitem__(self, k):
-        self.__delattr__(k)
+        try:
+            dict.__delitem__(self, k)
+        except KeyError:
+            raise AttributeError(k)
+    def __dir__(self):
+        return list(JSobject._BAD_NAMES) + [k for k in self if isinstance(k, str)]
+
+
+def loads(s):
+    """Parses JSON, representing every object by a JSobject."""
+    return json.loads(s, object_hook=JSobject)